@@ -0,0 +1,364 @@
+"""
+Offline benchmark for the SnapGrade grading pipeline
+
+Renders synthetic bubble sheets with known answers for every template,
+photographs them (resolution, rotation, perspective, blur, lighting and
+fill darkness all vary), and grades them with every registered pipeline
+without a server. Reports sheets/sec, per-stage latency, peak RSS,
+answer accuracy, and the share of answers sent to review (with the
+accuracy of the rest) per pipeline, plus how often bubbled fields (student
+IDs, exam versions) are read right.
+
+    python benchmark.py                     # 20 sheets per template
+    python benchmark.py --sheets 50 --seed 7 --json results.json
+    python benchmark.py --processor improved --template simple_5
+"""
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from src.pipeline import PIPELINES, TEMPLATES
+from src.templates import (
+    FIDUCIAL_CENTERS_MM, FIDUCIAL_RADIUS_MM, PAGE_HEIGHT_MM, PAGE_WIDTH_MM,
+    TEMPLATE_LAYOUTS, compile_fields, compile_layout
+)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Width in pixels the printed page is drawn at before being "photographed"
+PRINT_WIDTH = 1240
+
+# Share of questions left blank on each synthetic sheet
+BLANK_RATE = 0.05
+
+# Ranges each photographed sheet is drawn from
+VARIATIONS = {
+    "photo_width": (1000, 3000),   # Resolution of the simulated photo in pixels
+    "rotation": (-12.0, 12.0),     # Page rotation in degrees
+    "perspective": (0.0, 0.03),    # Corner jitter as a fraction of the photo width
+    "blur": (0.0, 2.0),            # Gaussian blur sigma in pixels
+    "brightness": (0.55, 1.1),     # Overall gain applied to the page
+    "gradient": (0.0, 0.35),       # Strength of the uneven lighting across the page
+    "fill": (20, 120)              # Gray level of the pencil marks (0 = black)
+}
+
+def render_sheet(layout_id: str, answers: List[int], fill: int = 40,
+                 width: int = PRINT_WIDTH, fields: Optional[Dict[str, List[int]]] = None) -> np.ndarray:
+    """
+    Draw a printed sheet for a template layout with some bubbles filled in
+
+    Args:
+        layout_id: Key into TEMPLATE_LAYOUTS
+        answers: Choice index marked for each question (-1 = left blank)
+        fill: Gray level of the marks
+        width: Page width in pixels
+        fields: Value index marked at each position of the layout's fields (default: none)
+
+    Returns:
+        Grayscale page image
+    """
+    height = int(round(width * PAGE_HEIGHT_MM / PAGE_WIDTH_MM))
+    px_per_mm = width / PAGE_WIDTH_MM
+    page = np.full((height, width), 245, dtype=np.uint8)
+
+    for x, y in FIDUCIAL_CENTERS_MM:
+        center = (int(x * px_per_mm), int(y * px_per_mm))
+        cv2.circle(page, center, int(FIDUCIAL_RADIUS_MM * px_per_mm), 0, -1)
+
+    # Header and student name box, as on the printed sheets (bubbled fields replace the box)
+    cv2.putText(page, "SnapGrade Bubble Sheet", (int(60 * px_per_mm), int(30 * px_per_mm)),
+                cv2.FONT_HERSHEY_SIMPLEX, width / 1000, 0, 2)
+    field_circles = compile_fields(layout_id, width, height)
+    if not field_circles:
+        cv2.rectangle(page, (int(20 * px_per_mm), int(55 * px_per_mm)),
+                      (int(190 * px_per_mm), int(75 * px_per_mm)), 0, 2)
+
+    outline = max(1, int(0.3 * px_per_mm))
+    grids = [(compile_layout(layout_id, width, height), answers)]
+    grids += [(circles, (fields or {}).get(name, [])) for name, circles in field_circles.items()]
+    for circles, marks in grids:
+        for index, row in enumerate(circles):
+            for choice, (x, y, r) in enumerate(row):
+                cv2.circle(page, (int(x), int(y)), int(r), 0, outline, cv2.LINE_AA)
+                if index < len(marks) and marks[index] == choice:
+                    cv2.circle(page, (int(x), int(y)), int(r * 0.85), int(fill), -1, cv2.LINE_AA)
+
+    return page
+
+
+def photograph(page: np.ndarray, rng: np.random.Generator, photo_width: int, rotation: float,
+               perspective: float, blur: float, brightness: float, gradient: float) -> np.ndarray:
+    """
+    Simulate a phone photo of a printed page lying on a darker desk
+    """
+    height, width = page.shape
+    out_width = int(photo_width)
+    out_height = int(out_width * 4 / 3)
+
+    scale = 0.75 * min(out_width / width, out_height / height)
+    corners = np.array([[-width, -height], [width, -height], [width, height], [-width, height]]) * scale / 2
+    angle = np.deg2rad(rotation)
+    rotate = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    target = corners @ rotate.T + (out_width / 2, out_height / 2)
+    target += rng.normal(0, perspective * out_width, target.shape)
+
+    source = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    homography = cv2.getPerspectiveTransform(source, np.float32(target))
+    photo = cv2.warpPerspective(page, homography, (out_width, out_height), borderValue=90)
+    photo = photo.astype(np.float32)
+
+    # Uneven lighting: a linear falloff in a random direction
+    direction = rng.uniform(0, 2 * np.pi)
+    ys, xs = np.mgrid[0:out_height, 0:out_width].astype(np.float32)
+    ramp = (xs / out_width - 0.5) * np.cos(direction) + (ys / out_height - 0.5) * np.sin(direction)
+    photo *= brightness * (1 - gradient * (ramp + 0.5))
+
+    if blur > 0:
+        photo = cv2.GaussianBlur(photo, (0, 0), blur)
+    photo += rng.normal(0, 3, photo.shape)
+
+    return np.clip(photo, 0, 255).astype(np.uint8)
+
+
+def generate_sheet(layout_id: str, choices: List[str], rng: np.random.Generator,
+                   field_values: Optional[Dict[str, List[str]]] = None
+                   ) -> Tuple[bytes, List[str], Dict[str, str], dict]:
+    """
+    Generate one photographed sheet with random answers, fields and conditions
+
+    Args:
+        layout_id: Key into TEMPLATE_LAYOUTS
+        choices: Answer letters of the template
+        rng: Random generator
+        field_values: Values of each of the template's fields (see pipeline.TEMPLATES)
+
+    Returns:
+        JPEG bytes, the answers marked on the sheet (letters, "" for blank),
+        the value bubbled in every field, and the conditions it was generated under
+    """
+    layout = TEMPLATE_LAYOUTS[layout_id]
+    marks = rng.integers(0, layout["choices"], layout["questions"])
+    marks[rng.random(layout["questions"]) < BLANK_RATE] = -1
+
+    # Every field filled in completely (an ID has all its digits)
+    field_marks = {
+        name: rng.integers(0, field["values"], field["positions"]).tolist()
+        for name, field in layout.get("fields", {}).items()
+        if field_values and name in field_values
+    }
+    fields = {
+        name: "".join(field_values[name][m] for m in field_mark) for name, field_mark in field_marks.items()
+    }
+
+    conditions = {name: float(rng.uniform(low, high)) for name, (low, high) in VARIATIONS.items()}
+    page = render_sheet(layout_id, marks.tolist(), fill=int(conditions["fill"]), fields=field_marks)
+    photo = photograph(
+        page, rng,
+        **{name: conditions[name] for name in
+           ("photo_width", "rotation", "perspective", "blur", "brightness", "gradient")}
+    )
+
+    ok, encoded = cv2.imencode(".jpg", photo, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    if not ok:
+        raise RuntimeError("Could not encode synthetic sheet")
+
+    answers = [choices[m] if m >= 0 else "" for m in marks]
+    return encoded.tobytes(), answers, fields, conditions
+
+
+def _peak_rss_mb() -> Optional[float]:
+    # Prefer VmHWM on Linux: ru_maxrss survives exec, so a spawned worker
+    # would report the parent's peak from rendering the sheets
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    return float(np.percentile(samples, q)) if samples else 0.0
+
+
+def run_processor(processor_name: str,
+                  sheets: List[Tuple[str, bytes, List[str], Dict[str, str]]]) -> dict:
+    """
+    Grade pre-rendered sheets with one pipeline (runs in its own process)
+
+    Args:
+        processor_name: Name of a registered pipeline (see src/pipeline.py)
+        sheets: (template id, JPEG bytes, true answers, true field values) per sheet
+
+    Returns:
+        Throughput, per-stage latency, peak RSS and accuracy figures
+    """
+    from src.ingestion import decode_image
+    from src.logging_utils import configure_logging
+    from src.metrics import REGISTRY, STAGE_SECONDS, sheet_scope, timed_stage
+
+    configure_logging("WARNING")
+    processor = PIPELINES[processor_name]
+
+    # Buffer metric observations so every stage sample can be read back
+    REGISTRY.forwarding = True
+    baseline_rss = _peak_rss_mb()
+
+    stage_samples: Dict[str, List[float]] = {}
+    per_template: Dict[str, dict] = {}
+    sheet_seconds = []
+
+    start = time.perf_counter()
+    for template_id, image_data, truth, true_fields in sheets:
+        sheet_start = time.perf_counter()
+        with sheet_scope(processor_name, template_id), timed_stage("decode"):
+            gray = decode_image(image_data, template_id)
+        result = processor.process_image(gray, truth, template_id)
+        sheet_seconds.append(time.perf_counter() - sheet_start)
+
+        for name, label_values, value in REGISTRY.drain():
+            if name == STAGE_SECONDS.name:
+                stage_samples.setdefault(label_values[0], []).append(value)
+
+        stats = per_template.setdefault(
+            template_id, {"sheets": 0, "failed": 0, "questions": 0, "correct": 0,
+                          "review": 0, "accepted_correct": 0, "fields": 0, "fields_correct": 0}
+        )
+        stats["sheets"] += 1
+        stats["questions"] += len(truth)
+        stats["fields"] += len(true_fields)
+        if not getattr(result, "success", False):
+            stats["failed"] += 1
+            stats["review"] += len(truth)  # A sheet that couldn't be read is checked by hand
+            continue
+        right = [
+            i < len(result.student_answers) and result.student_answers[i] == answer
+            for i, answer in enumerate(truth)
+        ]
+        review = set(result.review_questions)
+        stats["correct"] += sum(right)
+        stats["review"] += len(review)
+        stats["accepted_correct"] += sum(ok for i, ok in enumerate(right) if i + 1 not in review)
+        stats["fields_correct"] += sum(
+            name in result.fields and result.fields[name].value == value for name, value in true_fields.items()
+        )
+    elapsed = time.perf_counter() - start
+
+    for stats in per_template.values():
+        stats["accuracy"] = stats["correct"] / stats["questions"] if stats["questions"] else 0.0
+        accepted = stats["questions"] - stats["review"]
+        stats["review_rate"] = stats["review"] / stats["questions"] if stats["questions"] else 0.0
+        stats["accepted_accuracy"] = stats["accepted_correct"] / accepted if accepted else 0.0
+        stats["field_accuracy"] = stats["fields_correct"] / stats["fields"] if stats["fields"] else None
+
+    questions = sum(s["questions"] for s in per_template.values())
+    return {
+        "processor": processor_name,
+        "sheets": len(sheets),
+        "seconds": elapsed,
+        "sheets_per_sec": len(sheets) / elapsed if elapsed else 0.0,
+        "sheet_ms": {
+            "p50": _percentile(sheet_seconds, 50) * 1000,
+            "p95": _percentile(sheet_seconds, 95) * 1000
+        },
+        "stage_ms": {
+            stage: {
+                "mean": float(np.mean(samples)) * 1000,
+                "p50": _percentile(samples, 50) * 1000,
+                "p95": _percentile(samples, 95) * 1000
+            }
+            for stage, samples in stage_samples.items()
+        },
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": _peak_rss_mb(),
+        "accuracy": sum(s["correct"] for s in per_template.values()) / questions if questions else 0.0,
+        "templates": per_template
+    }
+
+
+def print_report(report: dict):
+    print(f"\n📊 {report['processor']} pipeline - {report['sheets']} sheets in {report['seconds']:.1f}s")
+    print(f"   Throughput: {report['sheets_per_sec']:.1f} sheets/sec "
+          f"(p50 {report['sheet_ms']['p50']:.1f} ms, p95 {report['sheet_ms']['p95']:.1f} ms per sheet)")
+    if report["peak_rss_mb"] is not None:
+        print(f"   Peak RSS: {report['peak_rss_mb']:.0f} MB (after imports: {report['baseline_rss_mb']:.0f} MB)")
+    print(f"   Accuracy: {report['accuracy']:.1%}")
+
+    print("   Stage latency (ms):      mean      p50      p95")
+    for stage, ms in sorted(report["stage_ms"].items(), key=lambda item: -item[1]["mean"]):
+        print(f"     {stage:<20} {ms['mean']:8.2f} {ms['p50']:8.2f} {ms['p95']:8.2f}")
+
+    print("   Per template:")
+    for template_id, stats in sorted(report["templates"].items()):
+        print(f"     {template_id:<20} accuracy {stats['accuracy']:6.1%}  "
+              f"review {stats['review_rate']:6.1%}  accepted {stats['accepted_accuracy']:6.1%}  "
+              f"({stats['sheets']} sheets, {stats['failed']} failed)")
+        if stats["field_accuracy"] is not None:
+            print(f"     {'':<20} fields   {stats['field_accuracy']:6.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline SnapGrade grading benchmark")
+    parser.add_argument("--sheets", type=int, default=20, help="Sheets per template (default: 20)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic sheets")
+    parser.add_argument("--processor", choices=sorted(PIPELINES), action="append",
+                        help="Pipeline to benchmark (repeatable, default: all)")
+    parser.add_argument("--template", action="append", help="Only benchmark these template ids")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    reports = []
+    for processor_name in args.processor or PIPELINES:
+        sheets = []
+        for template_id, template in TEMPLATES.items():
+            if args.template and template_id not in args.template:
+                continue
+            if template.get("grid") not in TEMPLATE_LAYOUTS:
+                print(f"⚠️  Skipping {processor_name}/{template_id}: no printed layout to render")
+                continue
+
+            # Same seed per template, so every pipeline sees identical sheets
+            rng = np.random.default_rng([args.seed, sorted(TEMPLATE_LAYOUTS).index(template["grid"])])
+            for _ in range(args.sheets):
+                image_data, answers, fields, _ = generate_sheet(
+                    template["grid"], template["choices"], rng,
+                    {name: field["values"] for name, field in template.get("fields", {}).items()}
+                )
+                sheets.append((template_id, image_data, answers, fields))
+
+        if not sheets:
+            continue
+
+        print(f"🔍 Benchmarking {processor_name} pipeline on {len(sheets)} sheets...")
+        # A fresh process per pipeline keeps peak RSS figures independent
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            report = executor.submit(run_processor, processor_name, sheets).result()
+        reports.append(report)
+        print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"seed": args.seed, "sheets_per_template": args.sheets, "results": reports}, f, indent=2)
+        print(f"\n💾 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
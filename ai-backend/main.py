@@ -1,22 +1,66 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import cv2
-import numpy as np
-from PIL import Image
-import io
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import asyncio
+import itertools
 import json
-from typing import List, Optional
+import time
+import numpy as np
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from typing import Iterator, List, Optional, Tuple, Union
 from pydantic import BaseModel
 
-from src.bubble_detector import BubbleSheetProcessor
-from src.improved_bubble_detector import ImprovedBubbleSheetProcessor
-from src.models import ProcessingResult, BubbleSheetTemplate
+from src.models import (
+    ProcessingResult, BubbleSheetTemplate, ErrorResult, SheetDetection, RegradeRequest, RegradeResult,
+    RegradeScore, ItemAnalysisResult, ItemStatistics, ScoreDistribution, VersionedItemAnalysisResult, JobStatus
+)
+from src.grading import (
+    AnswerKey, encode_answers, grade_detection, item_analysis, score_matrix, stack_encoded,
+    wrong_question_numbers
+)
+from src.ingestion import MAX_UPLOAD_BYTES, ImageRejectedError, inspect_upload, iter_pages
+from src.job_queue import CallbackRefusedError, JobRunner, SplitSheet, Upload, check_callback_url, create_job_queue
+from src.logging_utils import PipelineLogger, configure_logging
+from src.metrics import JOBS_IN_FLIGHT, REGISTRY, REJECTED_JOBS_TOTAL
+from src.pipeline import list_templates, pipeline_for
+from src.result_cache import DetectionCache
+from src.scan_store import ScanStore
+from src.worker_pool import GradingPool, PoolSaturatedError, detect_sheet
+
+configure_logging()
+log = PipelineLogger("api")
+
+# Worker processes for the CPU-bound grading pipeline
+grading_pool = GradingPool()
+
+# Detections of recently uploaded sheets, so resubmissions skip the vision pipeline
+detection_cache = DetectionCache()
+
+# Every graded sheet's detection, by scan id, for regrading with a corrected key
+scan_store = ScanStore()
+
+# Batches submitted to /jobs, graded in the background
+job_queue = create_job_queue()
+
+# Seconds a queued job's sheet waits before trying the full worker pool again
+JOB_RETRY_DELAY = 1.0
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    grading_pool.start()
+    job_runner.start()
+    yield
+    await job_runner.stop()
+    grading_pool.shutdown()
+    job_queue.close()
+    scan_store.close()
 
 app = FastAPI(
     title="SnapGrade AI Backend",
     description="OpenCV-powered bubble sheet processing API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS for Next.js frontend
@@ -28,9 +72,221 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize both processors
-processor = BubbleSheetProcessor()
-improved_processor = ImprovedBubbleSheetProcessor()
+async def run_grading(image_data: Union[bytes, np.ndarray], correct_answers: AnswerKey, template_id: str,
+                      student_id: Optional[str] = None, page: int = 0,
+                      debug: Optional[bool] = None, exam_id: Optional[str] = None,
+                      frame: Optional[int] = None, digest: Optional[str] = None) -> dict:
+    """
+    Grade one sheet, reading it in the worker pool unless its detection is cached
+    
+    Detections are cached by image content and template, so a resubmitted
+    photo (or the same photo with a corrected answer key) is only graded
+    again, and saved to the scan store so the result's scan_id can be
+    regraded later. Worker metrics are folded into /metrics.
+    
+    A page split from a multi-page upload (see iter_sheets) is read from
+    its frame of image_data but cached under the upload's digest and page,
+    like the same page read from the whole upload.
+    
+    Raises the pool's PoolSaturatedError / asyncio.TimeoutError after counting the rejection.
+    """
+    start = time.perf_counter()
+    cache_key = None
+    if digest is None and (detection_cache.enabled or scan_store.enabled):
+        # Uploads run to MAX_UPLOAD_BYTES, so hash them off the event loop
+        digest = await asyncio.to_thread(DetectionCache.digest, image_data)
+    if detection_cache.enabled:
+        cache_key = DetectionCache.key(image_data, template_id, page, pipeline_for(template_id).name, digest)
+    detection = await detection_cache.lookup(cache_key) if cache_key else None
+    
+    if detection is not None:
+        result = grade_detection(
+            SheetDetection(**detection), correct_answers, student_id, time.perf_counter() - start
+        ).model_dump()
+        return await save_scan(result, detection, exam_id, digest, page)
+    
+    try:
+        detection, metrics_delta = await grading_pool.run(
+            detect_sheet, image_data, template_id, page if frame is None else frame, debug
+        )
+    except PoolSaturatedError:
+        REJECTED_JOBS_TOTAL.inc(reason="queue_full")
+        raise
+    except asyncio.TimeoutError:
+        REJECTED_JOBS_TOTAL.inc(reason="timeout")
+        raise
+    
+    REGISTRY.merge(metrics_delta)
+    if detection.get("success") is False:
+        return detection  # ErrorResult: nothing to grade or cache
+    
+    if cache_key:
+        await detection_cache.store(cache_key, detection)
+    result = grade_detection(SheetDetection(**detection), correct_answers, student_id).model_dump()
+    return await save_scan(result, detection, exam_id, digest, page)
+
+async def grade_sheet(image_data: Union[bytes, np.ndarray, ErrorResult], correct_answers: AnswerKey, template_id: str,
+                      page: int = 0, debug: Optional[bool] = None, exam_id: Optional[str] = None,
+                      queued: bool = False, frame: Optional[int] = None,
+                      digest: Optional[str] = None) -> dict:
+    """
+    Grade one sheet of a batch or job, turning its failure into an ErrorResult
+    
+    Sheets of a queued job (queued=True) wait for room in the worker pool
+    instead of failing with QUEUE_FULL, so grading-day peaks are absorbed,
+    and a crashed worker process is raised so the job runs again. frame and
+    digest locate a page split from a multi-page upload (see run_grading).
+    A file refused unread (see read_uploads) comes as its ErrorResult.
+    """
+    if isinstance(image_data, ErrorResult):
+        return image_data.model_dump()
+    while True:
+        if queued and grading_pool.pending >= grading_pool.max_pending:
+            await asyncio.sleep(JOB_RETRY_DELAY)
+            continue
+        try:
+            return await run_grading(
+                image_data, correct_answers, template_id, None, page, debug, exam_id, frame, digest
+            )
+        except PoolSaturatedError as e:
+            if not queued:
+                return ErrorResult(error=str(e), error_code="QUEUE_FULL").model_dump()
+            await asyncio.sleep(JOB_RETRY_DELAY)
+        except asyncio.TimeoutError:
+            return ErrorResult(
+                error=f"Processing timed out after {grading_pool.job_timeout:g}s",
+                error_code="TIMEOUT"
+            ).model_dump()
+        except BrokenProcessPool:
+            if queued:
+                raise
+            return ErrorResult(error="A grading worker crashed", error_code="PROCESSING_FAILED").model_dump()
+        except Exception as e:
+            return ErrorResult(error=str(e), error_code="PROCESSING_FAILED").model_dump()
+
+async def grade_job_sheet(params: dict, sheet: SplitSheet) -> dict:
+    """Grade one sheet of a queued job, split from its upload by iter_sheets (see JobRunner)"""
+    _, page, image_data, frame, digest = sheet
+    return await grade_sheet(
+        image_data, params["answer_key"], params["template_id"], page,
+        params.get("debug"), params.get("exam_id"), queued=True, frame=frame, digest=digest
+    )
+
+def split_job_upload(upload: Upload, template_id: str) -> Iterator[SplitSheet]:
+    """Split one upload of a queued job into sheets the way /process-batch does"""
+    return iter_sheets([upload], template_id)
+
+# Works through job_queue, one sheet per worker at a time like a batch
+job_runner = JobRunner(job_queue, grade_job_sheet, split_job_upload, sheet_concurrency=grading_pool.workers)
+
+async def read_upload(file: UploadFile) -> bytes:
+    """
+    Read one upload into memory, refusing it when it is over MAX_UPLOAD_BYTES
+    
+    The multipart parser has already spooled the upload to a temporary file
+    (on disk past 1 MB), so an oversized upload is refused from its size
+    without being loaded. Anything else is read in a single call, into the
+    one bytes object the decoder and the worker pool share.
+    
+    Raises:
+        HTTPException: 413 if the upload is too large
+    """
+    too_large = HTTPException(
+        status_code=413,
+        detail=f"{file.filename} is larger than the {MAX_UPLOAD_BYTES / 1024 / 1024:g} MB upload limit"
+    )
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise too_large
+    
+    image_data = await file.read(MAX_UPLOAD_BYTES + 1)
+    if len(image_data) > MAX_UPLOAD_BYTES:
+        raise too_large
+    return image_data
+
+async def read_uploads(files: List[UploadFile]) -> List[Tuple[str, Union[bytes, ErrorResult], int]]:
+    """
+    Read every upload and count its pages (one sheet per page)
+    
+    A file whose pages can't be counted is kept as one sheet, so grading
+    reports its error like any other sheet's. A file over MAX_UPLOAD_BYTES
+    is not read: it is kept as one sheet holding its IMAGE_TOO_LARGE error
+    instead of its bytes, so it fails alone rather than refusing the batch.
+    Headers are inspected in a thread, off the event loop.
+    """
+    uploads = []
+    for file in files:
+        try:
+            image_data = await read_upload(file)
+        except HTTPException as e:
+            uploads.append((file.filename, ErrorResult(error=e.detail, error_code="IMAGE_TOO_LARGE"), 1))
+            continue
+        try:
+            pages = await asyncio.to_thread(inspect_upload, image_data)
+        except Exception:
+            pages = 1
+        uploads.append((file.filename, image_data, pages))
+    return uploads
+
+def is_sheet_upload(file: UploadFile) -> bool:
+    """Whether an upload is of a type sheets are graded from (any image, or a PDF scan)"""
+    return (file.content_type or "").startswith("image/") or file.content_type == "application/pdf"
+
+def iter_sheets(uploads: List[Tuple[str, Union[bytes, ErrorResult], int]], template_id: str
+                ) -> Iterator[SplitSheet]:
+    """
+    Expand uploads into sheets, one per page, as (filename, page, image data, frame, digest)
+    
+    Single images are passed on as they were uploaded. Multi-page uploads
+    (a scanner's PDF or TIFF) are split lazily, one page per sheet asked for
+    (see ingestion.iter_pages), so workers are sent a page each instead of
+    the whole document. frame is where the page sits in the image data
+    passed on, and digest the whole upload's hash its pages are cached under
+    (see run_grading), computed once per upload. A file refused unread (see
+    read_uploads) is passed on as its ErrorResult.
+    """
+    for filename, image_data, pages in uploads:
+        if pages == 1:
+            yield filename, 0, image_data, 0, None
+            continue
+        digest = DetectionCache.digest(image_data)
+        for page, (sheet, frame) in enumerate(iter_pages(image_data, template_id)):
+            yield filename, page, sheet, frame, digest
+
+def parse_answer_key(answer_key: str) -> AnswerKey:
+    """
+    Parse an answer_key form field: a JSON list of answers, or an object of
+    such lists keyed by exam version (picked by each sheet's bubbled version)
+    """
+    try:
+        parsed = json.loads(answer_key)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid answer_key format")
+    
+    keys = parsed.values() if isinstance(parsed, dict) else [parsed]
+    if not keys or not all(isinstance(key, list) and all(isinstance(a, str) for a in key) for key in keys):
+        raise HTTPException(status_code=400, detail="Invalid answer_key format")
+    return parsed
+
+async def save_scan(result: dict, detection: dict, exam_id: Optional[str],
+                    upload_digest: Optional[str] = None, page: int = 0) -> dict:
+    """
+    Persist a graded sheet's detection and tag the result with its scan_id
+    
+    The scan is filed under the result's student (given, or bubbled on the
+    sheet). Sheets that couldn't be graded aren't saved, and a storage
+    failure is logged but never fails the grading request. A sheet graded
+    again under the same exam (the same page of the same upload) keeps its
+    scan_id and replaces the earlier detection, so it counts once. The
+    SQLite write (and its commit) runs in a thread, off the event loop.
+    """
+    if scan_store.enabled and result.get("success"):
+        try:
+            result["scan_id"] = await asyncio.to_thread(
+                scan_store.save, detection, result.get("student_id"), exam_id, upload_digest, page
+            )
+        except Exception:
+            log.exception("Could not save scan", template=detection.get("template_id"))
+    return result
 
 @app.get("/")
 async def root():
@@ -40,106 +296,425 @@ async def root():
 async def health_check():
     return {"status": "healthy", "service": "bubble-detection"}
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Pipeline metrics in the Prometheus text format
+    
+    Per-stage and per-sheet latency histograms, sheet outcomes, fallback
+    paths taken, and worker pool load.
+    """
+    JOBS_IN_FLIGHT.set(grading_pool.pending)
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/templates")
 async def get_templates():
     """Get available bubble sheet templates"""
-    templates = [
-        {
-            "id": "simple_5",
-            "name": "Simple 5 Questions",
-            "questions": 5,
-            "choices": ["A", "B", "C", "D"],
-            "description": "5-question bubble sheet with A-D choices (optimized detection)"
-        },
-        {
-            "id": "standard_25",
-            "name": "Standard 25 Questions",
-            "questions": 25,
-            "choices": ["A", "B", "C", "D"],
-            "description": "Standard 25-question bubble sheet with A-D choices"
-        },
-        {
-            "id": "standard_50", 
-            "name": "Standard 50 Questions",
-            "questions": 50,
-            "choices": ["A", "B", "C", "D"],
-            "description": "Standard 50-question bubble sheet with A-D choices"
-        },
-        {
-            "id": "extended_100",
-            "name": "Extended 100 Questions", 
-            "questions": 100,
-            "choices": ["A", "B", "C", "D", "E"],
-            "description": "Extended 100-question bubble sheet with A-E choices"
-        }
-    ]
-    return {"templates": templates}
+    return {"templates": [template.model_dump() for template in list_templates()]}
 
 @app.post("/process-image")
 async def process_bubble_sheet(
     file: UploadFile = File(...),
     answer_key: str = Form(...),
     template_id: str = Form(default="standard_25"),
-    student_id: Optional[str] = Form(default=None)
+    student_id: Optional[str] = Form(default=None),
+    exam_id: Optional[str] = Form(default=None),
+    debug: Optional[bool] = Form(default=None)
 ):
     """
     Process an uploaded bubble sheet image
     
     Args:
-        file: The bubble sheet image file
-        answer_key: JSON string of correct answers e.g. ["A","B","C","D"]
+        file: The bubble sheet image file (one page; multi-page scans go to /process-batch or /jobs)
+        answer_key: JSON string of correct answers e.g. ["A","B","C","D"], or of one
+            such list per exam version e.g. {"A": [...], "B": [...]}
         template_id: Template to use for processing
-        student_id: Optional student identifier
+        student_id: Optional student identifier (default: the ID bubbled on the sheet)
+        exam_id: Optional exam the sheet belongs to (lets /regrade rescore the whole exam)
+        debug: Log this sheet's pipeline at debug level (true/false overrides SNAPGRADE_DEBUG)
     """
     try:
         # Validate file type
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="File must be an image")
+        if not is_sheet_upload(file):
+            raise HTTPException(status_code=400, detail="File must be an image or a PDF")
         
         # Parse answer key
-        try:
-            correct_answers = json.loads(answer_key)
-        except json.JSONDecodeError:
-            raise HTTPException(status_code=400, detail="Invalid answer_key format")
+        correct_answers = parse_answer_key(answer_key)
         
-        # Read and process image
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Convert PIL image to OpenCV format
-        cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+        # Read the upload, refuse sizes we won't decode, and grade it in a worker process
+        image_data = await read_upload(file)
+        try:
+            pages = await asyncio.to_thread(inspect_upload, image_data)
+        except ImageRejectedError as e:
+            status_code = 413 if e.result.error_code == "IMAGE_TOO_LARGE" else 400
+            return JSONResponse(content=e.result.model_dump(), status_code=status_code)
+        except Exception:
+            pages = 1  # Not a readable image: the worker reports the decode error
+        if pages > 1:
+            raise HTTPException(
+                status_code=400,
+                detail=f"{file.filename} has {pages} pages; send multi-page scans to /process-batch or /jobs"
+            )
         
-        # Use improved processor for 5-question template
-        if template_id == "simple_5":
-            print(f"🎯 Using improved processor for {template_id}")
-            result = improved_processor.process_image(
-                cv_image, 
-                correct_answers, 
+        try:
+            result = await run_grading(
+                image_data,
+                correct_answers,
                 template_id,
-                student_id
+                student_id,
+                debug=debug,
+                exam_id=exam_id
             )
-        else:
-            print(f"🎯 Using standard processor for {template_id}")
-            result = processor.process_image(
-                cv_image, 
-                correct_answers, 
-                template_id,
-                student_id
+        except PoolSaturatedError as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=504,
+                detail=f"Processing timed out after {grading_pool.job_timeout:g}s"
             )
         
         # Check if processing was successful
-        if hasattr(result, 'success') and not result.success:
+        if not result.get("success", False):
             # Return error result
-            return JSONResponse(content=result.model_dump(), status_code=400)
+            return JSONResponse(content=result, status_code=400)
         
-        return JSONResponse(content=result.model_dump())
+        return JSONResponse(content=result)
         
+    except HTTPException:
+        raise
     except Exception as e:
-        import traceback
-        print(f"Error processing image: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+        log.exception("Error processing image", template=template_id)
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
 
+@app.post("/process-batch")
+async def process_batch(
+    files: List[UploadFile] = File(...),
+    answer_key: str = Form(...),
+    template_id: str = Form(default="standard_25"),
+    exam_id: Optional[str] = Form(default=None),
+    debug: Optional[bool] = Form(default=None)
+):
+    """
+    Grade a stack of bubble sheets against one answer key
+    
+    Accepts many images, or multi-page scans such as scanner PDFs and TIFFs
+    (one sheet per page, split as the batch is graded). Sheets are graded in parallel and streamed back as
+    NDJSON, one line per sheet as soon as it is ready. Every line carries
+    the sheet's "index" in upload order (plus "filename" and "page"), and a
+    sheet that fails produces an error line instead of failing the batch.
+    
+    Args:
+        files: The bubble sheet image files
+        answer_key: JSON string of correct answers e.g. ["A","B","C","D"], or of one
+            such list per exam version e.g. {"A": [...], "B": [...]}
+        template_id: Template to use for every sheet
+        exam_id: Optional exam the sheets belong to (lets /regrade rescore them together)
+        debug: Log every sheet's pipeline at debug level (true/false overrides SNAPGRADE_DEBUG)
+    """
+    # Parse answer key once for the whole batch
+    correct_answers = parse_answer_key(answer_key)
+    
+    for file in files:
+        if not is_sheet_upload(file):
+            raise HTTPException(status_code=400, detail=f"{file.filename} must be an image or a PDF")
+    
+    # Expand uploads into sheets (one per page), decoding multi-page scans as they're graded
+    sheets = iter_sheets(await read_uploads(files), template_id)
+    
+    # Keep at most one in-flight sheet per worker so a batch doesn't starve other uploads
+    slots = asyncio.Semaphore(grading_pool.workers)
+    
+    async def grade_batch_sheet(index: int, filename: str, page: int, image_data: Union[bytes, np.ndarray],
+                                frame: int, digest: Optional[str]) -> dict:
+        try:
+            result = await grade_sheet(
+                image_data, correct_answers, template_id, page, debug, exam_id, frame=frame, digest=digest
+            )
+        finally:
+            slots.release()
+        return {"index": index, "filename": filename, "page": page, **result}
+    
+    async def stream_results():
+        # The next sheet is only taken (and a scan's next page decoded) once a
+        # worker slot is free, so a 200-page scan holds a page per worker, not
+        # 200, and its first results stream back while later pages are unread
+        tasks = set()
+        try:
+            for index in itertools.count():
+                await slots.acquire()
+                sheet = await asyncio.to_thread(next, sheets, None)
+                if sheet is None:
+                    break
+                tasks.add(asyncio.ensure_future(grade_batch_sheet(index, *sheet)))
+                
+                for task in [task for task in tasks if task.done()]:
+                    tasks.discard(task)
+                    yield json.dumps(task.result()) + "\n"
+            for task in asyncio.as_completed(tasks):
+                yield json.dumps(await task) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    files: List[UploadFile] = File(...),
+    answer_key: str = Form(...),
+    template_id: str = Form(default="standard_25"),
+    exam_id: Optional[str] = Form(default=None),
+    callback_url: Optional[str] = Form(default=None),
+    debug: Optional[bool] = Form(default=None)
+):
+    """
+    Queue a stack of bubble sheets for grading in the background
+    
+    Takes the same uploads as /process-batch but returns a job id at once,
+    so large batches never run into proxy timeouts. Poll GET /jobs/{job_id}
+    for progress and results, or pass a callback_url to have the finished
+    job's status POSTed to it.
+    
+    Args:
+        files: The bubble sheet image files
+        answer_key: JSON string of correct answers e.g. ["A","B","C","D"], or of one
+            such list per exam version e.g. {"A": [...], "B": [...]}
+        template_id: Template to use for every sheet
+        exam_id: Optional exam the sheets belong to (lets /regrade rescore them together)
+        callback_url: Optional http(s) URL notified when the job finishes (a public
+            address, or a host in SNAPGRADE_CALLBACK_HOSTS)
+        debug: Log every sheet's pipeline at debug level (true/false overrides SNAPGRADE_DEBUG)
+    """
+    correct_answers = parse_answer_key(answer_key)
+    
+    if callback_url:
+        try:
+            check_callback_url(callback_url)
+        except CallbackRefusedError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    for file in files:
+        if not is_sheet_upload(file):
+            raise HTTPException(status_code=400, detail=f"{file.filename} must be an image or a PDF")
+    
+    params = {
+        "answer_key": correct_answers,
+        "template_id": template_id,
+        "exam_id": exam_id,
+        "debug": debug
+    }
+    # Files refused unread are stored empty, with their error as the sheet's result
+    uploads, refused = [], {}
+    for filename, image_data, pages in await read_uploads(files):
+        if isinstance(image_data, ErrorResult):
+            index = sum(upload[2] for upload in uploads)
+            refused[index] = {"index": index, "filename": filename, "page": 0, **image_data.model_dump()}
+            image_data = b""
+        uploads.append((filename, image_data, pages))
+    job_id = await asyncio.to_thread(job_queue.submit, params, uploads, callback_url, refused)
+    job_runner.wake()
+    
+    status = JobStatus(**await asyncio.to_thread(job_queue.get, job_id, include_results=False))
+    return JSONResponse(
+        content=status.model_dump(), status_code=202, headers={"Location": f"/jobs/{job_id}"}
+    )
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, results: bool = True):
+    """
+    Progress of a queued job, with the results of the sheets graded so far
+    
+    Args:
+        job_id: Id returned by POST /jobs
+        results: Include the per-sheet results (pass false for a cheap progress check)
+    """
+    job = await asyncio.to_thread(job_queue.get, job_id, include_results=results)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return JSONResponse(content=JobStatus(**job).model_dump())
+
+def load_scan_groups(request: RegradeRequest):
+    """
+    Load the selected scans, grouped by the answer key each is scored against
+    (a blocking SQLite read: /regrade and /item-analysis call this in a thread)
+
+    With per-version answer keys, every scan goes with the key for its
+    bubbled version; a single key takes every scan, under version None.
+    
+    Returns:
+        Tuple of ({version: (answer key, scans)}, requested scan ids that
+        weren't found, ids of scans whose version has no key)
+    """
+    scans = scan_store.load_answers(request.scan_ids, request.exam_id)
+    found = {scan["scan_id"] for scan in scans}
+    missing = [scan_id for scan_id in request.scan_ids if scan_id not in found]
+    
+    if not isinstance(request.answer_key, dict):
+        return {None: (request.answer_key, scans)}, missing, []
+    
+    groups, unknown = {}, []
+    for scan in scans:
+        if scan["version"] in request.answer_key:
+            groups.setdefault(scan["version"], (request.answer_key[scan["version"]], []))[1].append(scan)
+        else:
+            unknown.append(scan["scan_id"])
+    return groups, missing, unknown
+
+def encode_scans(scans: List[dict], answer_key: List[str]):
+    """
+    Stack scans' stored answers and encode their key as one students x questions matrix
+    """
+    matrix = stack_encoded([scan["answer_codes"] for scan in scans], len(answer_key))
+    return matrix, encode_answers([answer_key])[0]
+
+def regrade_scans(request: RegradeRequest) -> RegradeResult:
+    """
+    Score the stored answers of many scans against a key in one vectorized pass
+    (one pass per exam version with per-version keys)
+    """
+    start = time.perf_counter()
+    groups, missing, unknown = load_scan_groups(request)
+    
+    results = []
+    for version, (answer_key, scans) in groups.items():
+        matrix, key = encode_scans(scans, answer_key)
+        total_questions = len(answer_key)
+        scores, wrong = score_matrix(matrix, key)
+        percentages = np.round(scores / max(total_questions, 1) * 100, 1)
+        
+        results += [
+            RegradeScore(
+                scan_id=scan["scan_id"],
+                student_id=scan["student_id"],
+                version=version,
+                score=int(score),
+                total_questions=total_questions,
+                percentage=float(percentage),
+                incorrect_questions=incorrect
+            )
+            for scan, score, percentage, incorrect
+            in zip(scans, scores, percentages, wrong_question_numbers(wrong))
+        ]
+    
+    return RegradeResult(
+        regraded=len(results),
+        results=results,
+        missing_scan_ids=missing,
+        unknown_version_scan_ids=unknown,
+        processing_time=round(time.perf_counter() - start, 3)
+    )
+
+def _finite(value: float) -> Optional[float]:
+    return round(float(value), 4) if np.isfinite(value) else None
+
+def analyze_group(scans: List[dict], answer_key: List[str], version: Optional[str] = None) -> ItemAnalysisResult:
+    """
+    Compute item and score statistics for scans sharing one answer key in one vectorized pass
+    """
+    start = time.perf_counter()
+    matrix, key = encode_scans(scans, answer_key)
+    stats = item_analysis(matrix, key)
+    
+    choice_count = stats["choice_counts"].shape[1]
+    letters = [chr(ord("A") + i) for i in range(choice_count)]
+    items = [
+        ItemStatistics(
+            question=question + 1,
+            correct_answer=answer_key[question],
+            difficulty=round(float(stats["difficulty"][question]), 4),
+            discrimination=_finite(stats["discrimination"][question]),
+            choice_counts=dict(zip(letters, stats["choice_counts"][question].tolist())),
+            blank=int(stats["blank_counts"][question])
+        )
+        for question in range(len(key))
+    ]
+    
+    scores = stats["scores"]
+    distribution = ScoreDistribution(
+        mean=round(float(scores.mean()), 2),
+        median=float(np.median(scores)),
+        std=round(float(scores.std()), 2),
+        min=int(scores.min()),
+        max=int(scores.max()),
+        histogram=stats["histogram"].tolist()
+    )
+    
+    return ItemAnalysisResult(
+        version=version,
+        students=len(scans),
+        questions=len(key),
+        items=items,
+        score_distribution=distribution,
+        reliability=_finite(stats["reliability"]),
+        processing_time=round(time.perf_counter() - start, 3)
+    )
+
+def analyze_scans(request: RegradeRequest) -> Union[ItemAnalysisResult, VersionedItemAnalysisResult]:
+    """
+    Compute item and score statistics for the selected scans, per exam
+    version with per-version keys (versions order their questions apart,
+    so their items are never pooled)
+    """
+    start = time.perf_counter()
+    groups, missing, unknown = load_scan_groups(request)
+    if not any(scans for _, scans in groups.values()):
+        raise HTTPException(status_code=404, detail="No stored scans match the request")
+    
+    if not isinstance(request.answer_key, dict):
+        answer_key, scans = groups[None]
+        result = analyze_group(scans, answer_key)
+        result.missing_scan_ids = missing
+        return result
+    
+    return VersionedItemAnalysisResult(
+        versions={
+            version: analyze_group(scans, answer_key, version)
+            for version, (answer_key, scans) in sorted(groups.items())
+        },
+        missing_scan_ids=missing,
+        unknown_version_scan_ids=unknown,
+        processing_time=round(time.perf_counter() - start, 3)
+    )
+
+@app.post("/regrade")
+async def regrade(request: RegradeRequest):
+    """
+    Score previously graded sheets again against a corrected answer key
+    
+    Uses the detections stored when the sheets were first graded, so no
+    image is uploaded or processed again. Select the sheets by the scan_id
+    returned with each result, by exam_id, or both. answer_key can be one
+    key, or keys by exam version: each sheet is then scored against the key
+    for its bubbled version, and sheets with no matching key are listed in
+    unknown_version_scan_ids.
+    """
+    if not scan_store.enabled:
+        raise HTTPException(status_code=503, detail="Scan storage is disabled (SNAPGRADE_SCAN_DB)")
+    if not request.scan_ids and request.exam_id is None:
+        raise HTTPException(status_code=400, detail="Provide scan_ids or an exam_id to regrade")
+    
+    result = await asyncio.to_thread(regrade_scans, request)
+    return JSONResponse(content=result.model_dump())
+
+@app.post("/item-analysis")
+async def analyze_items(request: RegradeRequest):
+    """
+    Class-level item analysis of stored scans against an answer key
+    
+    Reports each question's difficulty (share answering correctly),
+    discrimination (how well it separates strong from weak students) and
+    how often each choice was picked, plus the score distribution and the
+    exam's KR-20 reliability. Scans are selected like /regrade. With keys
+    by exam version, each version is analyzed on its own, under versions.
+    """
+    if not scan_store.enabled:
+        raise HTTPException(status_code=503, detail="Scan storage is disabled (SNAPGRADE_SCAN_DB)")
+    if not request.scan_ids and request.exam_id is None:
+        raise HTTPException(status_code=400, detail="Provide scan_ids or an exam_id to analyze")
+    
+    result = await asyncio.to_thread(analyze_scans, request)
+    return JSONResponse(content=result.model_dump())
+
 @app.post("/process-demo")
 async def process_demo_image():
     """
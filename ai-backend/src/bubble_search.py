@@ -0,0 +1,572 @@
+import cv2
+import numpy as np
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, NamedTuple, Optional, Tuple, TypeVar
+
+# Connected components that could be a printed bubble: roughly square, partly
+# but not solidly inked (outlines and pencil fills both qualify), and no
+# bigger than this share of the image width
+BLOB_MAX_ASPECT = 1.6
+BLOB_DENSITY_RANGE = (0.1, 0.9)
+BLOB_MIN_SIDE = 5
+BLOB_MAX_SIDE_FRACTION = 1 / 15
+
+# Blobs whose short side is further than this from the median bubble size
+# are left out of block finding
+BLOB_SIZE_TOLERANCE = 0.35
+
+# A block must hold this many blobs and span at least two bubbles each way,
+# which leaves out lone fiducials and single lines of header text
+MIN_BLOCK_BLOBS = 4
+
+# Autocorrelation a projection profile must reach to count as periodic
+MIN_PITCH_CORRELATION = 0.2
+
+# Bubble radius as a share of the row pitch across the printed layouts
+# (bubbles never overlap the next row, and are never tiny next to it)
+PITCH_RADIUS_RANGE = (0.15, 0.5)
+
+# Bubble radius as a share of the median blob side
+BLOB_RADIUS_RANGE = (0.3, 0.7)
+
+# HoughCircles thresholds for the smoothed block crops (Canny upper threshold,
+# accumulator votes); the radius range is tight here, so fewer votes suffice
+HOUGH_PARAM1 = 50
+HOUGH_PARAM2 = 15
+
+# Blocks are searched on the smallest pyramid level (each halves the image)
+# where their bubbles keep a radius of at least this many pixels
+COARSE_MIN_RADIUS = 5
+
+# Accumulator threshold on that level: bubbles there are 5-10 px in radius
+# whatever the scan resolution, so one threshold fits every level
+COARSE_HOUGH_PARAM2 = 10
+
+# Outline ink between these shares of the radius is fitted when a coarse
+# center is refined at full resolution; fills and neighbours stay out
+REFINE_RING = (0.7, 1.3)
+
+# Answer blocks are searched in bands of about this many bubble rows, so a
+# sheet splits into enough tiles to keep every core busy
+TILE_ROWS = 8
+
+# Threads searching one sheet's tiles at once (OpenCV releases the GIL while
+# it works); 1 searches the tiles in turn on the calling thread. Grading
+# workers share the cores, so the worker pool sets its own (see GradingPool)
+TILE_THREADS = int(os.getenv("SNAPGRADE_TILE_THREADS", os.cpu_count() or 1))
+
+T = TypeVar("T")
+
+
+class AnswerBlock(NamedTuple):
+    x: int                          # Bounding box of the block's bubbles
+    y: int
+    width: int
+    height: int
+    row_pitch: Optional[float]      # Distance between bubble rows (None if not periodic)
+    radius_range: Tuple[int, int]   # Radii HoughCircles searches for in this block
+    min_distance: int               # Smallest distance between two bubble centers
+
+
+class Tile(NamedTuple):
+    x: int                          # Region whose bubbles (by center) the tile owns
+    y: int
+    width: int
+    height: int
+    pad: int                        # Margin searched around the region, so bubbles on its edge are whole
+    block: AnswerBlock              # Block the region is part of
+
+
+def find_bubble_blobs(binary: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Find bubble-sized connected components in a binary image
+
+    Bubbles printed close together can touch once thresholded, so runs of
+    bubbles (as thick as one bubble, any length) are returned as well.
+
+    Args:
+        binary: Preprocessed image with ink set (255) on a zero background
+
+    Returns:
+        Tuple of (int array of (x, y, width, height) boxes, typical bubble side
+        in pixels); the side is 0.0 if no single bubble was found
+    """
+    # Block-based labelling is about twice as fast as the default when stats are needed
+    _, _, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(
+        binary, 8, cv2.CV_32S, cv2.CCL_GRANA
+    )
+    stats = stats[1:]  # Label 0 is the background
+    widths = stats[:, cv2.CC_STAT_WIDTH]
+    heights = stats[:, cv2.CC_STAT_HEIGHT]
+
+    short_side = np.minimum(widths, heights)
+    long_side = np.maximum(widths, heights)
+    density = stats[:, cv2.CC_STAT_AREA] / np.maximum(widths * heights, 1)
+
+    candidate = (
+        (density >= BLOB_DENSITY_RANGE[0]) & (density <= BLOB_DENSITY_RANGE[1])
+        & (short_side >= BLOB_MIN_SIDE)
+        & (short_side <= binary.shape[1] * BLOB_MAX_SIDE_FRACTION)
+    )
+    single = candidate & (long_side <= BLOB_MAX_ASPECT * short_side)
+    if not single.any():
+        return stats[:0, :4], 0.0
+
+    side = float(np.median(long_side[single]))
+    sized = np.abs(short_side - side) <= BLOB_SIZE_TOLERANCE * side
+    return stats[candidate & sized, :4], side
+
+
+def estimate_row_pitch(profile: np.ndarray, min_lag: int, max_lag: int) -> Optional[float]:
+    """
+    Estimate the spacing of bubble rows from a block's horizontal projection profile
+
+    The profile (ink per image row) repeats with every row of bubbles, so the
+    pitch is the strongest peak of its autocorrelation (or a fraction of it,
+    when that peak is really two or three rows apart).
+
+    Args:
+        profile: Ink count per image row across the block
+        min_lag: Shortest pitch considered (about one bubble)
+        max_lag: Longest pitch considered
+
+    Returns:
+        Row pitch in pixels, or None if the profile isn't periodic
+    """
+    centered = profile.astype(np.float64) - profile.mean()
+    energy = float(np.dot(centered, centered))
+    max_lag = min(max_lag, len(centered) // 2)
+    if energy == 0 or max_lag <= min_lag:
+        return None
+
+    correlation = np.correlate(centered, centered, mode="full")[len(centered) - 1:] / energy
+    window = correlation[min_lag:max_lag + 1]
+    lag = int(np.argmax(window))
+    if window[lag] < MIN_PITCH_CORRELATION or lag in (0, len(window) - 1):
+        return None
+
+    # The strongest peak may be a multiple of the pitch; take a fraction of it
+    # instead when that is nearly as strong
+    for divisor in (3, 2):
+        center = (min_lag + lag) / divisor - min_lag
+        low, high = int(np.floor(center)) - 1, int(np.ceil(center)) + 2
+        if low >= 1 and high <= len(window) - 1:
+            candidate = low + int(np.argmax(window[low:high]))
+            if window[candidate] >= 0.85 * window[lag]:
+                lag = candidate
+                break
+
+    # Refine to sub-pixel with a parabola through the peak and its neighbours
+    left, middle, right = window[lag - 1], window[lag], window[lag + 1]
+    denominator = left - 2 * middle + right
+    offset = 0.5 * (left - right) / denominator if denominator else 0.0
+    return float(min_lag + lag + offset)
+
+
+def _radius_range(row_pitch: Optional[float], blob_side: float) -> Tuple[int, int]:
+    low, high = BLOB_RADIUS_RANGE[0] * blob_side, BLOB_RADIUS_RANGE[1] * blob_side
+    if row_pitch is not None:
+        # Tighten to what the row pitch allows, unless the two disagree
+        pitch_low, pitch_high = PITCH_RADIUS_RANGE[0] * row_pitch, PITCH_RADIUS_RANGE[1] * row_pitch
+        if max(low, pitch_low) < min(high, pitch_high):
+            low, high = max(low, pitch_low), min(high, pitch_high)
+    return max(1, int(np.floor(low))), max(2, int(np.ceil(high)))
+
+
+def find_answer_blocks(binary: np.ndarray) -> List[AnswerBlock]:
+    """
+    Find the regions of a page that hold the answer bubbles
+
+    Bubble-sized blobs are drawn into a mask and dilated by about one bubble,
+    which joins the bubbles of a question column into one solid block while
+    headers, name boxes and corner markers stay apart. Each block's row pitch
+    (from its projection profile) sets the radius range searched inside it.
+
+    Args:
+        binary: Preprocessed image with ink set (255) on a zero background
+
+    Returns:
+        Answer blocks, largest first (empty if the page shows no bubble grid)
+    """
+    blobs, blob_side = find_bubble_blobs(binary)
+    if len(blobs) < MIN_BLOCK_BLOBS:
+        return []
+
+    mask = np.zeros(binary.shape[:2], dtype=np.uint8)
+    for x, y, w, h in blobs:
+        mask[y:y + h, x:x + w] = 255
+
+    reach = max(3, int(round(2 * blob_side)) | 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (reach, reach))
+    contours, _ = cv2.findContours(cv2.dilate(mask, kernel), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    centers_x = blobs[:, 0] + blobs[:, 2] // 2
+    centers_y = blobs[:, 1] + blobs[:, 3] // 2
+    blocks = []
+    pad = reach // 2
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        # Undo the dilation to get back to the bubbles' extent
+        x, y, w, h = x + pad, y + pad, w - 2 * pad, h - 2 * pad
+        members = np.count_nonzero(
+            (centers_x >= x) & (centers_x < x + w) & (centers_y >= y) & (centers_y < y + h)
+        )
+        if members < MIN_BLOCK_BLOBS or w < 2 * blob_side or h < 2 * blob_side:
+            continue
+
+        profile = np.count_nonzero(binary[y:y + h, x:x + w], axis=1)
+        row_pitch = estimate_row_pitch(profile, int(0.8 * blob_side), int(4 * blob_side))
+        blocks.append(AnswerBlock(
+            x=x, y=y, width=w, height=h,
+            row_pitch=row_pitch,
+            radius_range=_radius_range(row_pitch, blob_side),
+            min_distance=max(1, int(0.8 * blob_side))
+        ))
+
+    blocks.sort(key=lambda block: block.width * block.height, reverse=True)
+    return blocks
+
+
+def block_tiles(blocks: List[AnswerBlock]) -> List[Tile]:
+    """
+    Split answer blocks into tiles that can be searched independently
+
+    Each block is cut across into bands of about TILE_ROWS bubble rows.
+    The bands don't overlap, but each is searched with a margin of the
+    block's largest bubble radius, so a bubble whose center lies in a band
+    is whole in its search area and belongs to that band alone.
+    """
+    tiles = []
+    for block in blocks:
+        max_radius = block.radius_range[1]
+        pitch = block.row_pitch or 2 * max_radius
+        bands = max(1, int(round(block.height / (TILE_ROWS * pitch))))
+        edges = [block.y + block.height * band // bands for band in range(bands + 1)]
+        tiles.extend(
+            Tile(block.x, top, block.width, bottom - top, max_radius, block)
+            for top, bottom in zip(edges, edges[1:])
+        )
+    return tiles
+
+
+def tile_crop(image: np.ndarray, tile: Tile) -> Tuple[np.ndarray, int, int]:
+    """
+    Get a tile's search area of an image
+
+    Returns:
+        Tuple of (view of the image, x offset, y offset of the view)
+    """
+    height, width = image.shape[:2]
+    x0, y0 = max(tile.x - tile.pad, 0), max(tile.y - tile.pad, 0)
+    x1 = min(tile.x + tile.width + tile.pad, width)
+    y1 = min(tile.y + tile.height + tile.pad, height)
+    return image[y0:y1, x0:x1], x0, y0
+
+
+_tile_executor: Optional[Tuple[int, ThreadPoolExecutor]] = None
+_tile_executor_lock = threading.Lock()
+
+
+def _tile_pool() -> ThreadPoolExecutor:
+    # One pool per process, created on first use (a pool inherited through
+    # fork has no threads behind it)
+    global _tile_executor
+    with _tile_executor_lock:
+        if _tile_executor is None or _tile_executor[0] != os.getpid():
+            _tile_executor = (os.getpid(), ThreadPoolExecutor(TILE_THREADS, thread_name_prefix="snapgrade-tile"))
+        return _tile_executor[1]
+
+
+def map_tiles(search: Callable[[Tile], T], tiles: List[Tile]) -> List[T]:
+    """
+    Search every tile on the tile thread pool (SNAPGRADE_TILE_THREADS)
+
+    Returns:
+        The results in tile order
+    """
+    if TILE_THREADS <= 1 or len(tiles) <= 1:
+        return [search(tile) for tile in tiles]
+    return list(_tile_pool().map(search, tiles))
+
+
+def pyramid_level(radius_range: Tuple[int, int]) -> int:
+    """
+    Get the pyramid level a block with this radius range is searched on (0 = full resolution)
+    """
+    radius = sum(radius_range) / 2
+    level = 0
+    while radius / 2 ** (level + 1) >= COARSE_MIN_RADIUS:
+        level += 1
+    return level
+
+
+def _hough_in_tile(binary: np.ndarray, tile: Tile, param1: int, param2: int) -> Optional[np.ndarray]:
+    # Circles found in one tile, in image coordinates, strongest first
+    min_radius, max_radius = tile.block.radius_range
+    crop, x0, y0 = tile_crop(binary, tile)
+
+    # pyrDown smooths as it halves, which HoughCircles needs on a binary image
+    level = pyramid_level(tile.block.radius_range)
+    scale = 2 ** level
+    if level == 0:
+        searched = cv2.GaussianBlur(crop, (5, 5), 0)
+    else:
+        searched = crop
+        for _ in range(level):
+            searched = cv2.pyrDown(searched)
+        param2 = COARSE_HOUGH_PARAM2
+
+    circles = cv2.HoughCircles(
+        searched,
+        cv2.HOUGH_GRADIENT,
+        dp=1,
+        minDist=max(tile.block.min_distance / scale, 1),
+        param1=param1,
+        param2=param2,
+        minRadius=max(min_radius // scale, 1),
+        maxRadius=-(-max_radius // scale)
+    )
+    if circles is None:
+        return None
+
+    circles = circles[0] * np.float32(scale) + np.array([x0, y0, 0], dtype=np.float32)
+    inside = (
+        (circles[:, 0] >= tile.x) & (circles[:, 0] < tile.x + tile.width)
+        & (circles[:, 1] >= tile.y) & (circles[:, 1] < tile.y + tile.height)
+    )
+    return circles[inside] if inside.any() else None
+
+
+def refine_circles(binary: np.ndarray, circles: np.ndarray, radius: float) -> np.ndarray:
+    """
+    Refine coarse bubble circles against the full-resolution image
+
+    A window around each center is cut from the image, and a least-squares
+    circle (Kasa fit) is fitted to the outline ink in a ring of REFINE_RING
+    times the radius, so a fill inside the bubble doesn't pull the center.
+    The nine moment sums of every window come from a single matrix product.
+    Circles whose window leaves the image, or whose fit moves the center
+    by more than half a radius or has an implausible radius, keep their
+    coarse centers. Every circle gets the median fitted radius: the
+    bubbles are printed alike, and the coarse radii are only good to a
+    pyramid pixel.
+
+    Args:
+        binary: Preprocessed image (non-zero = ink)
+        circles: float array of coarse (x, y, radius) in image coordinates
+        radius: Typical radius of these bubbles (e.g. the median coarse radius)
+
+    Returns:
+        float array of refined (x, y, radius)
+    """
+    reach = int(np.ceil(REFINE_RING[1] * radius))
+    height, width = binary.shape[:2]
+    refined = circles.astype(np.float64)
+    centers_x = np.round(refined[:, 0]).astype(np.int64)
+    centers_y = np.round(refined[:, 1]).astype(np.int64)
+    whole = (
+        (centers_x >= reach) & (centers_x < width - reach)
+        & (centers_y >= reach) & (centers_y < height - reach)
+    )
+    if not whole.any():
+        return refined
+
+    side = 2 * reach + 1
+    windows = np.lib.stride_tricks.sliding_window_view(binary, (side, side))
+    centers_x, centers_y = centers_x[whole], centers_y[whole]
+    ink = (windows[centers_y - reach, centers_x - reach] != 0).reshape(len(centers_x), -1)
+
+    # Per-pixel terms of the fit's normal equations, zero outside the ring
+    offsets = np.arange(-reach, reach + 1, dtype=np.float64)
+    x, y = np.meshgrid(offsets, offsets)
+    x, y = x.ravel(), y.ravel()
+    squared = x * x + y * y
+    ring = (squared >= (REFINE_RING[0] * radius) ** 2) & (squared <= (REFINE_RING[1] * radius) ** 2)
+    terms = np.stack([x * x, x * y, x, y * y, y, np.ones_like(x), x * squared, y * squared, squared], axis=1)
+    sums = ink.astype(np.float32) @ (terms * ring[:, None]).astype(np.float32)
+    sxx, sxy, sx, syy, sy, count, sxz, syz, sz = sums.astype(np.float64).T
+
+    # Solve x^2 + y^2 = a x + b y + c; the center is (a/2, b/2)
+    fitted = count >= np.pi * radius  # Enough outline ink for a fit
+    matrix = np.stack([
+        np.stack([sxx, sxy, sx], axis=-1),
+        np.stack([sxy, syy, sy], axis=-1),
+        np.stack([sx, sy, count], axis=-1)
+    ], axis=-2)[fitted]
+    vector = np.stack([sxz, syz, sz], axis=-1)[fitted, :, None]
+    solvable = np.abs(np.linalg.det(matrix)) > 1e-9
+    solution = np.zeros((len(matrix), 3))
+    solution[solvable] = np.linalg.solve(matrix[solvable], vector[solvable])[..., 0]
+
+    shift_x, shift_y = solution[:, 0] / 2, solution[:, 1] / 2
+    fitted_radius = np.sqrt(np.maximum(solution[:, 2] + shift_x ** 2 + shift_y ** 2, 0))
+    plausible = (
+        solvable & (np.hypot(shift_x, shift_y) < radius / 2)
+        & (fitted_radius > radius / 2) & (fitted_radius < 1.5 * radius)
+    )
+    rows = np.flatnonzero(whole)[np.flatnonzero(fitted)[plausible]]
+    refined[rows, 0] = centers_x[fitted][plausible] + shift_x[plausible]
+    refined[rows, 1] = centers_y[fitted][plausible] + shift_y[plausible]
+    # A fill's own edge pulls its bubble's fit inwards; the printed bubbles
+    # all share one radius, so they all get the typical fitted one
+    if plausible.any():
+        refined[:, 2] = np.median(fitted_radius[plausible])
+    return refined
+
+
+def _drop_seam_duplicates(found: List[Optional[np.ndarray]], tiles: List[Tile]) -> List[Optional[np.ndarray]]:
+    # A bubble straddling the seam between two bands of a block can be found
+    # by both, centered just either side of it; keep the upper band's circle,
+    # as HoughCircles' minimum distance would have in one search of the block
+    kept = list(found)
+    for index in range(1, len(tiles)):
+        above, below, tile = kept[index - 1], kept[index], tiles[index]
+        if above is None or below is None or tiles[index - 1].block is not tile.block:
+            continue
+        distance = np.hypot(below[:, None, 0] - above[None, :, 0], below[:, None, 1] - above[None, :, 1])
+        duplicate = (distance < tile.block.min_distance).any(axis=1)
+        kept[index] = below[~duplicate] if not duplicate.all() else None
+    return kept
+
+
+def hough_in_blocks(binary: np.ndarray, blocks: List[AnswerBlock],
+                    param1: int = HOUGH_PARAM1, param2: int = HOUGH_PARAM2) -> Optional[np.ndarray]:
+    """
+    Run HoughCircles only inside the answer blocks
+
+    The blocks are split into tiles (see block_tiles), searched in parallel,
+    each with its block's radius range. The search is coarse to fine: each
+    block is searched on the pyramid level where its bubbles are a few
+    pixels across (see pyramid_level), so its cost barely grows with the
+    scan resolution, and the circles found are then refined at full
+    resolution (see refine_circles). Circles centered in a tile's margin
+    belong to another tile (or to nothing) and are dropped, as are second
+    detections of a bubble on the seam between two tiles.
+
+    Args:
+        binary: Preprocessed image the blocks were found on
+        blocks: Blocks from find_answer_blocks
+        param1: Upper Canny threshold passed to HoughCircles
+        param2: Accumulator threshold passed to HoughCircles for blocks
+            searched at full resolution
+
+    Returns:
+        float array of (x, y, radius) in image coordinates, or None if nothing was found
+    """
+    tiles = block_tiles(blocks)
+    found = map_tiles(lambda tile: _hough_in_tile(binary, tile, param1, param2), tiles)
+    found = _drop_seam_duplicates(found, tiles)
+
+    block_circles = []
+    for block in blocks:
+        parts = [circles for circles, tile in zip(found, tiles) if tile.block is block and circles is not None]
+        if not parts:
+            continue
+        circles = np.concatenate(parts)
+        if pyramid_level(block.radius_range) > 0:
+            circles = refine_circles(binary, circles, float(np.median(circles[:, 2])))
+        block_circles.append(circles)
+    return np.concatenate(block_circles) if block_circles else None
+
+
+def _nearby_bubble(cells: dict, kept: List[dict], x: float, y: float,
+                   cell_x: int, cell_y: int, limit: float) -> Optional[int]:
+    # Index of a kept bubble within sqrt(limit) of (x, y), from the 3x3 cells around it
+    for neighbour_x in (cell_x - 1, cell_x, cell_x + 1):
+        for neighbour_y in (cell_y - 1, cell_y, cell_y + 1):
+            for index in cells.get((neighbour_x, neighbour_y), ()):
+                bubble = kept[index]
+                if (bubble["x"] - x) ** 2 + (bubble["y"] - y) ** 2 < limit:
+                    return index
+    return None
+
+
+def merge_candidates(candidate_lists: List[List[dict]],
+                     merge_distance: Optional[float] = None) -> List[dict]:
+    """
+    Merge bubble candidates from several detectors into one list without duplicates
+
+    Candidates are taken in priority order: earlier lists first, and each
+    list in the order given (HoughCircles lists its strongest circles first).
+    A candidate centered within merge_distance of a bubble already kept is
+    merged into it instead of being kept again. Kept bubbles are indexed in a
+    grid hash with cells merge_distance wide, so each candidate only checks
+    the 3x3 cells around it and the whole pass is linear in the candidates.
+
+    Args:
+        candidate_lists: Bubble dictionaries per detector, highest priority first
+        merge_distance: Centers closer than this are the same bubble
+            (default: the median candidate radius; distinct bubbles are
+            at least two radii apart)
+
+    Returns:
+        One bubble per group, with the center and radius averaged over the
+        merged candidates and "support" set to how many were merged
+    """
+    candidates = [candidate for candidates in candidate_lists for candidate in candidates]
+    if not candidates:
+        return []
+
+    if merge_distance is None:
+        merge_distance = float(np.median([candidate["radius"] for candidate in candidates]))
+    merge_distance = max(merge_distance, 1.0)
+    limit = merge_distance ** 2
+
+    cells = {}
+    kept = []
+    sums = []  # Running (x, y, radius) totals per kept bubble
+
+    for candidate in candidates:
+        x, y = candidate["x"], candidate["y"]
+        cell_x, cell_y = int(x // merge_distance), int(y // merge_distance)
+
+        match = _nearby_bubble(cells, kept, x, y, cell_x, cell_y, limit)
+        if match is None:
+            cells.setdefault((cell_x, cell_y), []).append(len(kept))
+            kept.append(dict(candidate, support=1))
+            sums.append([x, y, candidate["radius"]])
+            continue
+
+        # Keep the strongest candidate's fields; average the geometry
+        # (the bubble stays filed under its first cell, a fraction of a radius away)
+        bubble, total = kept[match], sums[match]
+        total[0] += x
+        total[1] += y
+        total[2] += candidate["radius"]
+        bubble["support"] += 1
+        bubble["x"] = int(round(total[0] / bubble["support"]))
+        bubble["y"] = int(round(total[1] / bubble["support"]))
+        bubble["radius"] = int(round(total[2] / bubble["support"]))
+
+    for index, bubble in enumerate(kept):
+        bubble["id"] = index
+    return kept
+
+
+def cluster_positions(values: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Group 1-D positions into clusters separated by gaps wider than tolerance
+
+    The positions are binned tolerance wide; runs of occupied bins form one
+    cluster and an empty bin ends it. This is linear in the number of
+    positions (plus the number of bins) and needs no sorting.
+
+    Args:
+        values: Positions, e.g. bubble center y coordinates
+        tolerance: Largest spread within one cluster between neighbouring positions
+
+    Returns:
+        int array of cluster labels, numbered in increasing position from 0
+    """
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    bins = ((values - values.min()) // max(tolerance, 1e-6)).astype(np.int64)
+    occupied = np.bincount(bins) > 0
+    # A new cluster starts at every occupied bin whose predecessor is empty
+    starts = occupied & ~np.concatenate(([False], occupied[:-1]))
+    bin_labels = np.cumsum(starts) - 1
+    return bin_labels[bins]
+
@@ -0,0 +1,109 @@
+import cv2
+import numpy as np
+from functools import lru_cache
+from typing import List, Sequence, Union
+
+CircleArray = Union[np.ndarray, Sequence[Sequence[int]]]
+
+
+@lru_cache(maxsize=128)
+def disk_kernel(radius: int) -> np.ndarray:
+    """
+    Get the filled-disk mask used to measure a bubble of the given radius
+
+    The disk is rasterized with cv2.circle, so it covers exactly the pixels a
+    full-frame mask drawn at the bubble center would cover.
+
+    Args:
+        radius: Bubble radius in pixels
+
+    Returns:
+        Read-only boolean array of shape (2r+1, 2r+1)
+    """
+    size = 2 * radius + 1
+    kernel = np.zeros((size, size), dtype=np.uint8)
+    cv2.circle(kernel, (radius, radius), radius, 1, -1)
+
+    kernel = kernel.astype(bool)
+    kernel.setflags(write=False)
+    return kernel
+
+
+def bubbles_to_circles(bubbles: List[dict]) -> np.ndarray:
+    """
+    Convert bubble dictionaries into an (N, 3) array of (x, y, radius)
+    """
+    if not bubbles:
+        return np.empty((0, 3), dtype=np.int64)
+
+    return np.array(
+        [(b["x"], b["y"], b["radius"]) for b in bubbles],
+        dtype=np.int64
+    )
+
+
+def measure_fill_counts(image: np.ndarray, circles: CircleArray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Count the marked pixels and the total pixels under every bubble at once
+
+    Bubbles are grouped by radius and each group is measured with one gather
+    of (2r+1)x(2r+1) crops, so the cost is proportional to the bubble area
+    instead of the image area. Parts of a disk that fall outside the image
+    are excluded from both counts.
+
+    Args:
+        image: Preprocessed binary image (non-zero = marked)
+        circles: (N, 3) array-like of integer (x, y, radius)
+
+    Returns:
+        Tuple of (filled_pixels, total_pixels) int64 arrays of length N
+    """
+    circles = np.asarray(circles, dtype=np.int64).reshape(-1, 3)
+    filled = np.zeros(len(circles), dtype=np.int64)
+    total = np.zeros(len(circles), dtype=np.int64)
+
+    if len(circles) == 0:
+        return filled, total
+
+    height, width = image.shape[:2]
+    marked = image != 0 if image.ndim == 2 else np.any(image != 0, axis=2)
+
+    for radius in np.unique(circles[:, 2]):
+        group = np.flatnonzero(circles[:, 2] == radius)
+        kernel = disk_kernel(int(radius))
+        offsets = np.arange(-radius, radius + 1)
+
+        rows = circles[group, 1, None] + offsets  # (n, 2r+1)
+        cols = circles[group, 0, None] + offsets  # (n, 2r+1)
+
+        row_valid = (rows >= 0) & (rows < height)
+        col_valid = (cols >= 0) & (cols < width)
+        valid = row_valid[:, :, None] & col_valid[:, None, :] & kernel
+
+        patches = marked[
+            np.clip(rows, 0, height - 1)[:, :, None],
+            np.clip(cols, 0, width - 1)[:, None, :]
+        ]
+
+        filled[group] = np.count_nonzero(patches & valid, axis=(1, 2))
+        total[group] = np.count_nonzero(valid, axis=(1, 2))
+
+    return filled, total
+
+
+def measure_fill_ratios(image: np.ndarray, circles: CircleArray) -> np.ndarray:
+    """
+    Calculate how much of every bubble is filled (0.0 to 1.0)
+
+    Args:
+        image: Preprocessed binary image (non-zero = marked)
+        circles: (N, 3) array-like of integer (x, y, radius)
+
+    Returns:
+        float64 array of fill ratios, 0.0 for bubbles entirely off the image
+    """
+    filled, total = measure_fill_counts(image, circles)
+
+    ratios = np.zeros(len(filled), dtype=np.float64)
+    np.divide(filled, total, out=ratios, where=total > 0)
+    return ratios
@@ -0,0 +1,265 @@
+import numpy as np
+import os
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from .models import ErrorResult, ProcessingResult, SheetDetection
+
+# Codes used in encoded answer matrices (choices are 0 = "A", 1 = "B", ...)
+BLANK = -1          # Question read, no bubble marked
+NOT_DETECTED = -2   # Question beyond what the pipeline read off the sheet
+INVALID = -3        # Anything that isn't a single choice letter
+
+# Questions read with less confidence than this are listed for a teacher to check
+REVIEW_CONFIDENCE = float(os.getenv("SNAPGRADE_REVIEW_CONFIDENCE", 0.9))
+
+# Template fields (see pipeline.TEMPLATES) that grading reads: the student a
+# sheet belongs to, and the exam version that picks its answer key
+STUDENT_ID_FIELD = "student_id"
+VERSION_FIELD = "version"
+
+# One answer key, or one per exam version ({"A": [...], "B": [...]})
+AnswerKey = Union[List[str], Dict[str, List[str]]]
+
+# Answer letter -> code (either case)
+ANSWER_CODES = {"": BLANK}
+for _index in range(26):
+    ANSWER_CODES[chr(ord("A") + _index)] = ANSWER_CODES[chr(ord("a") + _index)] = _index
+
+
+def encode_answers(answer_sheets: Sequence[Sequence[str]], width: int = 0) -> np.ndarray:
+    """
+    Encode many sheets' answers as a compact students x questions matrix
+
+    Args:
+        answer_sheets: Answer letters per sheet ("" for blank)
+        width: Minimum number of columns (e.g. the answer key length)
+
+    Returns:
+        int8 array; sheets shorter than the widest are padded with NOT_DETECTED
+    """
+    width = max([width] + [len(answers) for answers in answer_sheets])
+    matrix = np.full((len(answer_sheets), width), NOT_DETECTED, dtype=np.int8)
+
+    for row, answers in enumerate(answer_sheets):
+        matrix[row, :len(answers)] = [ANSWER_CODES.get(answer, INVALID) for answer in answers]
+
+    return matrix
+
+
+def stack_encoded(rows: Sequence[np.ndarray], width: int = 0) -> np.ndarray:
+    """
+    Stack already-encoded answer rows (e.g. loaded from storage) into one matrix
+
+    Args:
+        rows: int8 arrays, one per sheet
+        width: Minimum number of columns
+
+    Returns:
+        int8 array padded with NOT_DETECTED like encode_answers
+    """
+    width = max([width] + [len(row) for row in rows])
+    matrix = np.full((len(rows), width), NOT_DETECTED, dtype=np.int8)
+    for index, row in enumerate(rows):
+        matrix[index, :len(row)] = row
+    return matrix
+
+
+def score_matrix(matrix: np.ndarray, key: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score every sheet against an answer key in one comparison
+
+    Questions a sheet has no reading for (NOT_DETECTED) are neither right
+    nor wrong, matching how a single sheet is graded.
+
+    Args:
+        matrix: Encoded answers from encode_answers
+        key: Encoded answer key (one row)
+
+    Returns:
+        Tuple of (score per sheet, boolean students x questions mask of wrong answers)
+    """
+    questions = min(matrix.shape[1], len(key))
+    answers = matrix[:, :questions]
+
+    correct = answers == key[:questions]
+    wrong = ~correct & (answers != NOT_DETECTED)
+    return correct.sum(axis=1), wrong
+
+
+def wrong_question_numbers(wrong: np.ndarray) -> List[List[int]]:
+    """
+    Turn a wrong-answer mask into 1-based question numbers per sheet
+    """
+    rows, columns = np.nonzero(wrong)
+    splits = np.searchsorted(rows, np.arange(1, wrong.shape[0]))
+    return [(chunk + 1).tolist() for chunk in np.split(columns, splits)]
+
+
+def grade_answers(student_answers: List[str], correct_answers: List[str]) -> Tuple[int, List[int]]:
+    """
+    Grade one sheet's answers against the correct answers
+
+    Returns:
+        Tuple of (score, list of incorrect question numbers)
+    """
+    matrix = encode_answers([student_answers])
+    scores, wrong = score_matrix(matrix, encode_answers([correct_answers])[0])
+    return int(scores[0]), wrong_question_numbers(wrong)[0]
+
+
+def select_answer_key(answer_key: AnswerKey, detection: SheetDetection) -> Tuple[List[str], bool]:
+    """
+    Pick the answer key a sheet is graded against
+
+    Args:
+        answer_key: One answer key, or one per exam version
+        detection: The sheet, whose version field picks among per-version keys
+
+    Returns:
+        Tuple of (answer key, whether the sheet's version field picked it)
+
+    Raises:
+        ValueError: If there are per-version keys and none matches the version read
+    """
+    if not isinstance(answer_key, dict):
+        return answer_key, False
+
+    version = detection.fields.get(VERSION_FIELD)
+    if version is None:
+        raise ValueError(f"Template {detection.template_id} has no version field to pick an answer key")
+    if version.value is None:
+        raise ValueError("Could not read the exam version off the sheet")
+    if version.value not in answer_key:
+        raise ValueError(f"No answer key for exam version {version.value}")
+    return answer_key[version.value], True
+
+
+def grade_detection(detection: SheetDetection, answer_key: AnswerKey,
+                    student_id: Optional[str] = None,
+                    processing_time: Optional[float] = None) -> Union[ProcessingResult, ErrorResult]:
+    """
+    Score a detected sheet against an answer key
+
+    Sheets with a bubbled student ID are attributed to it unless a
+    student_id is given, and per-version answer keys are picked by the
+    sheet's bubbled version. Fields a result relies on that couldn't be
+    read (a position blank or marked twice) or were read with less than
+    REVIEW_CONFIDENCE are listed for review, like questions.
+
+    Args:
+        detection: What the vision pipeline read off the sheet
+        answer_key: List of correct answers, or one such list per exam version
+        student_id: Optional student identifier (default: the sheet's bubbled ID)
+        processing_time: Seconds to report (default: the detection's own time)
+
+    Returns:
+        ProcessingResult, or ErrorResult (UNKNOWN_VERSION) if no answer key fits the sheet
+    """
+    try:
+        correct_answers, by_version = select_answer_key(answer_key, detection)
+    except ValueError as e:
+        return ErrorResult(error=str(e), error_code="UNKNOWN_VERSION")
+
+    score, incorrect_questions = grade_answers(detection.student_answers, correct_answers)
+    if processing_time is None:
+        processing_time = detection.detection_time
+
+    # Graded questions the pipeline wasn't sure of (or didn't read at all)
+    confidence = detection.confidence_scores
+    review_questions = [
+        question + 1 for question in range(len(correct_answers))
+        if question >= len(confidence) or confidence[question] < REVIEW_CONFIDENCE
+    ]
+
+    # Fields read off the sheet that the result relies on
+    used_fields = [VERSION_FIELD] if by_version else []
+    if student_id is None and STUDENT_ID_FIELD in detection.fields:
+        student_id = detection.fields[STUDENT_ID_FIELD].value
+        used_fields.append(STUDENT_ID_FIELD)
+    review_fields = [
+        name for name in used_fields
+        if detection.fields[name].value is None or detection.fields[name].confidence < REVIEW_CONFIDENCE
+    ]
+
+    return ProcessingResult(
+        success=True,
+        student_answers=detection.student_answers,
+        correct_answers=correct_answers,
+        score=score,
+        total_questions=len(correct_answers),
+        percentage=round((score / len(correct_answers)) * 100, 1) if correct_answers else 0.0,
+        incorrect_questions=incorrect_questions,
+        processing_time=round(processing_time, 2),
+        confidence_scores=detection.confidence_scores,
+        answer_flags=detection.answer_flags,
+        review_questions=review_questions,
+        review_fields=review_fields,
+        needs_review=bool(review_questions or review_fields),
+        fields=detection.fields,
+        image_quality=detection.image_quality,
+        student_id=student_id
+    )
+
+
+def item_analysis(matrix: np.ndarray, key: np.ndarray, choices: int = 0) -> dict:
+    """
+    Class-wide statistics for an exam, computed over the whole answer matrix at once
+
+    Args:
+        matrix: Encoded answers (students x questions), e.g. from stack_encoded
+        key: Encoded answer key; it sets the number of questions analyzed
+        choices: Number of choices per question (default: highest choice seen)
+
+    Returns:
+        Dict of arrays:
+            scores          total score per student
+            difficulty      share of students answering each question correctly
+            discrimination  correlation of each question with the rest of the exam
+                            (corrected point-biserial; NaN when undefined)
+            choice_counts   questions x choices count of students picking each choice
+            blank_counts    students leaving each question blank
+            histogram       number of students at each score, 0..questions
+            reliability     KR-20 internal consistency of the exam (NaN when undefined)
+
+    Raises:
+        ValueError: If the matrix has no students
+    """
+    if len(matrix) == 0:
+        raise ValueError("Item analysis needs at least one answer sheet")
+
+    questions = len(key)
+    if matrix.shape[1] < questions:
+        matrix = stack_encoded(list(matrix), questions)
+    answers = matrix[:, :questions]
+
+    correct = (answers == key).astype(np.float64)
+    scores = correct.sum(axis=1)
+    difficulty = correct.mean(axis=0)
+
+    # Corrected item-total correlation: each item against the score on the other items
+    rest = scores[:, None] - correct
+    with np.errstate(invalid="ignore", divide="ignore"):
+        covariance = (correct * rest).mean(axis=0) - difficulty * rest.mean(axis=0)
+        discrimination = covariance / (correct.std(axis=0) * rest.std(axis=0))
+
+    # Count every (question, code) pair in one bincount; codes are shifted past INVALID
+    choices = max(choices, int(max(answers.max(initial=-1), key.max(initial=-1))) + 1)
+    width = choices - INVALID
+    flat = (answers.astype(np.int64) - INVALID) + np.arange(questions) * width
+    counts = np.bincount(flat.ravel(), minlength=questions * width).reshape(questions, width)
+
+    # KR-20: share of score variance not explained by per-item variance
+    with np.errstate(invalid="ignore", divide="ignore"):
+        reliability = questions / (questions - 1) * (
+            1 - (difficulty * (1 - difficulty)).sum() / scores.var()
+        ) if questions > 1 else np.nan
+
+    return {
+        "scores": scores.astype(np.int64),
+        "difficulty": difficulty,
+        "discrimination": discrimination,
+        "choice_counts": counts[:, -INVALID:],
+        "blank_counts": counts[:, BLANK - INVALID],
+        "histogram": np.bincount(scores.astype(np.int64), minlength=questions + 1),
+        "reliability": float(reliability)
+    }
@@ -80,6 +80,33 @@ def resize_image(image: np.ndarray, max_width: int = 1200, max_height: int = 160
     
     return image
 
+# Accepted image sizes as (short side, long side), in either orientation. The
+# maximum bounds the pixels actually decoded: a 600 dpi scan of a Legal page
+# (5100x8400) fits, and JPEGs count at the reduced size they decode to
+MIN_IMAGE_SIDES = (300, 400)
+MAX_IMAGE_SIDES = (5400, 8600)
+
+def validate_dimensions(width: int, height: int) -> tuple[bool, str]:
+    """
+    Check an image's size against the accepted range, before decoding it
+    
+    Args:
+        width: Image width in pixels
+        height: Image height in pixels
+        
+    Returns:
+        Tuple of (is_valid, error_message)
+    """
+    short_side, long_side = sorted((width, height))
+    
+    if short_side < MIN_IMAGE_SIDES[0] or long_side < MIN_IMAGE_SIDES[1]:
+        return False, f"Image resolution too low (minimum {MIN_IMAGE_SIDES[0]}x{MIN_IMAGE_SIDES[1]})"
+    
+    if short_side > MAX_IMAGE_SIDES[0] or long_side > MAX_IMAGE_SIDES[1]:
+        return False, f"Image resolution too high (maximum {MAX_IMAGE_SIDES[0]}x{MAX_IMAGE_SIDES[1]})"
+    
+    return True, "Valid image"
+
 def validate_image(image: np.ndarray) -> tuple[bool, str]:
     """
     Validate if image is suitable for processing
@@ -97,14 +124,7 @@ def validate_image(image: np.ndarray) -> tuple[bool, str]:
         return False, "Image must be grayscale or color"
     
     height, width = image.shape[:2]
-    
-    if width < 300 or height < 400:
-        return False, "Image resolution too low (minimum 300x400)"
-    
-    if width > 4000 or height > 6000:
-        return False, "Image resolution too high (maximum 4000x6000)"
-    
-    return True, "Valid image"
+    return validate_dimensions(width, height)
 
 def enhance_image_quality(image: np.ndarray) -> np.ndarray:
     """
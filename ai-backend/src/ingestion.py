@@ -0,0 +1,328 @@
+import io
+import os
+import threading
+import numpy as np
+from PIL import Image
+from typing import Iterator, Optional, Tuple, Union
+
+from .image_utils import MIN_IMAGE_SIDES, resize_image, validate_dimensions
+from .models import ErrorResult
+from .templates import TEMPLATE_LAYOUTS, canonical_size
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # PDF uploads are refused without it
+    pdfium = None
+
+# Uploads larger than this are refused before being read into memory
+MAX_UPLOAD_BYTES = int(float(os.getenv("SNAPGRADE_MAX_UPLOAD_MB", 50)) * 1024 * 1024)
+
+# The page rarely fills the whole photo, so decoded images keep this much
+# resolution beyond the template's canonical page size
+INGEST_MARGIN = 1.5
+
+# (long side, short side) bounds for templates without a registered layout
+DEFAULT_MAX_SIDES = (1600, 1200)
+
+# PDF files start with this header (a few bytes of junk may come before it)
+PDF_SIGNATURE = b"%PDF-"
+PDF_SIGNATURE_SEARCH = 1024
+
+# PDFium must not be called from two threads at once (the API process
+# splits the pages of batch uploads on worker threads)
+_pdfium_lock = threading.Lock()
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+# EXIF orientation -> transpose that restores the upright image
+EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90
+}
+
+
+class ImageRejectedError(ValueError):
+    """Raised when an image's header shows a size outside the accepted range"""
+
+    def __init__(self, result: ErrorResult):
+        super().__init__(result.error)
+        self.result = result
+
+
+def dimension_gate(width: int, height: int,
+                   decoded_size: Optional[Tuple[int, int]] = None) -> Optional[ErrorResult]:
+    """
+    Decide from an image's header whether its size can be graded
+
+    Args:
+        width: Width in the header
+        height: Height in the header
+        decoded_size: (width, height) the decoder will produce, when it
+            decodes reduced (JPEG draft mode); the maximum applies to it
+
+    Returns:
+        ErrorResult to send back instead of decoding, or None if the size is accepted
+    """
+    # Too small is judged on the header size, too large on what is decoded
+    valid, message = validate_dimensions(width, height)
+    too_large = not valid and min(width, height) >= MIN_IMAGE_SIDES[0] and max(width, height) >= MIN_IMAGE_SIDES[1]
+    if too_large and decoded_size is not None:
+        valid, message = validate_dimensions(*decoded_size)
+    if valid:
+        return None
+
+    return ErrorResult(
+        error=f"{message}, got {width}x{height}",
+        error_code="IMAGE_TOO_LARGE" if too_large else "IMAGE_TOO_SMALL"
+    )
+
+
+def is_pdf(image_data: bytes) -> bool:
+    """
+    Tell a PDF upload (e.g. a document scanner's multi-page scan) from an image
+    """
+    return PDF_SIGNATURE in image_data[:PDF_SIGNATURE_SEARCH]
+
+
+def open_pdf(image_data: bytes) -> "pdfium.PdfDocument":
+    """
+    Open a PDF upload without rendering anything (close it with close_pdf)
+
+    Raises:
+        ImageRejectedError: If PDF support (pypdfium2) isn't installed
+    """
+    if pdfium is None:
+        raise ImageRejectedError(ErrorResult(
+            error="PDF uploads need pypdfium2 installed on the server",
+            error_code="UNSUPPORTED_FORMAT"
+        ))
+    with _pdfium_lock:
+        return pdfium.PdfDocument(image_data)
+
+
+def close_pdf(document: "pdfium.PdfDocument"):
+    """
+    Close a document opened with open_pdf
+    """
+    with _pdfium_lock:
+        document.close()
+
+
+def _frame_limits(image: Image.Image, template_id: Optional[str]) -> Tuple[int, int]:
+    # (max width, max height) of the stored (pre-rotation) frame: the ingest
+    # limits' sides matched to its orientation
+    long_side, short_side = ingest_limits(template_id)
+    width, height = image.size
+    return (long_side, short_side) if width >= height else (short_side, long_side)
+
+
+def _gate_frame(image: Image.Image, template_id: Optional[str]) -> Optional[ErrorResult]:
+    # Set a JPEG frame to decode reduced (draft mode) and check the size it decodes at
+    header_size = image.size
+    if image.format == "JPEG":
+        max_width, max_height = _frame_limits(image, template_id)
+        scale = min(max_width / header_size[0], max_height / header_size[1], 1.0)
+        image.draft("L", (int(header_size[0] * scale), int(header_size[1] * scale)))
+    return dimension_gate(*header_size, decoded_size=image.size)
+
+
+def open_image(image_data: bytes, page: int = 0, template_id: Optional[str] = None) -> Image.Image:
+    """
+    Open one frame of an upload, reading only its header
+
+    The bytes are wrapped, not copied (BytesIO shares an immutable bytes
+    buffer), and no pixels are decoded until the caller asks for them.
+    JPEGs are set to decode at the reduced size the template needs, and
+    are checked at that size, so a photo far larger than image_utils.MAX_IMAGE_SIDES
+    is accepted when what is decoded of it fits.
+
+    Raises:
+        ImageRejectedError: If the frame is too small or too large to grade
+    """
+    image = Image.open(io.BytesIO(image_data))
+    if page:
+        image.seek(page)
+
+    rejection = _gate_frame(image, template_id)
+    if rejection is not None:
+        raise ImageRejectedError(rejection)
+    return image
+
+
+def ingest_limits(template_id: Optional[str]) -> Tuple[int, int]:
+    """
+    Get the (long side, short side) an upload is decoded down to for a template
+    """
+    if template_id not in TEMPLATE_LAYOUTS:
+        return DEFAULT_MAX_SIDES
+
+    width, height = canonical_size(template_id)
+    return int(height * INGEST_MARGIN), int(width * INGEST_MARGIN)
+
+
+def inspect_upload(image_data: bytes) -> int:
+    """
+    Check an upload's size from its header and count its frames, without decoding pixels
+
+    Raises:
+        ImageRejectedError: If the (first) frame is too small or too large to grade,
+            or the upload is a PDF and PDF support isn't installed
+    """
+    if is_pdf(image_data):
+        document = open_pdf(image_data)
+        try:
+            with _pdfium_lock:
+                return len(document)
+        finally:
+            close_pdf(document)
+    return getattr(open_image(image_data), "n_frames", 1)
+
+
+def _render_pdf_page(document: "pdfium.PdfDocument", page: int, template_id: Optional[str]) -> np.ndarray:
+    """
+    Rasterize one PDF page straight to grayscale at the resolution the template needs
+
+    A PDF page is the sheet itself, not a photo of it, so it is rendered at
+    the template's canonical page size (fitted within DEFAULT_MAX_SIDES for
+    templates without a layout) and registration has nothing to scale.
+    """
+    if template_id in TEMPLATE_LAYOUTS:
+        short_side, long_side = canonical_size(template_id)
+    else:
+        long_side, short_side = DEFAULT_MAX_SIDES
+
+    with _pdfium_lock:
+        pdf_page = document[page]
+        try:
+            width, height = pdf_page.get_size()
+            max_width, max_height = (long_side, short_side) if width >= height else (short_side, long_side)
+
+            bitmap = pdf_page.render(scale=min(max_width / width, max_height / height), grayscale=True)
+            try:
+                return np.array(bitmap.to_numpy())  # The bitmap's buffer is freed with it
+            finally:
+                bitmap.close()
+        finally:
+            pdf_page.close()
+
+
+def _decode_frame(image: Image.Image, template_id: Optional[str]) -> np.ndarray:
+    # The current frame of an opened image -> upright grayscale within the ingest limits
+    # (JPEGs were already set to decode reduced by _gate_frame)
+    orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    max_width, max_height = _frame_limits(image, template_id)
+
+    # Flatten transparency onto white paper before dropping color
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        image = image.convert("RGBA")
+        image = Image.alpha_composite(Image.new("RGBA", image.size, (255, 255, 255, 255)), image)
+
+    if image.mode != "L":
+        image = image.convert("L")
+
+    gray = resize_image(np.asarray(image), max_width, max_height)
+
+    if orientation in EXIF_TRANSPOSE:
+        gray = np.asarray(Image.fromarray(gray).transpose(EXIF_TRANSPOSE[orientation]))
+
+    return gray
+
+
+def decode_image(image_data: bytes, template_id: Optional[str] = None, page: int = 0) -> np.ndarray:
+    """
+    Decode an upload straight to a reduced-size grayscale array
+
+    JPEGs are decoded in draft mode, which lets the decoder produce grayscale
+    at 1/2, 1/4 or 1/8 scale directly, so the full-resolution color frame is
+    never materialized. Other formats are converted to grayscale (alpha is
+    flattened onto white) and then reduced with resize_image. EXIF rotation
+    is applied last, on the small buffer. PDF pages are rendered in
+    grayscale at the template's canonical size.
+
+    Args:
+        image_data: Raw uploaded image bytes
+        template_id: Template the image will be graded with (sets the target size)
+        page: Frame to decode for multi-page images (e.g. TIFF) or page of a PDF
+
+    Returns:
+        Upright uint8 grayscale image no larger than the template's ingest limits
+
+    Raises:
+        ImageRejectedError: If the frame is too small or too large to grade, or
+            the upload is a PDF and PDF support isn't installed
+    """
+    if is_pdf(image_data):
+        document = open_pdf(image_data)
+        try:
+            return _render_pdf_page(document, page, template_id)
+        finally:
+            close_pdf(document)
+
+    return _decode_frame(open_image(image_data, page, template_id), template_id)
+
+
+def _pdf_page_document(document: "pdfium.PdfDocument", page: int) -> bytes:
+    # A one-page PDF holding a copy of one page's content (nothing is rendered)
+    with _pdfium_lock:
+        single = pdfium.PdfDocument.new()
+        try:
+            single.import_pages(document, [page])
+            buffer = io.BytesIO()
+            single.save(buffer)
+            return buffer.getvalue()
+        finally:
+            single.close()
+
+
+def iter_pages(image_data: bytes, template_id: Optional[str] = None
+               ) -> Iterator[Tuple[Union[bytes, np.ndarray], int]]:
+    """
+    Split a multi-page upload (a scanner's PDF or TIFF) into its pages, one at a time
+
+    The document is opened once and each page is only taken out of it when
+    it is asked for, so however many pages a scan has, only the pages
+    handed on are held in memory. Every page comes out as a sheet that can
+    be read on its own, with the frame to read in it:
+
+        PDF pages as one-page PDFs (frame 0), copied without rendering, so
+            they are rasterized at the template's resolution where they are read
+        Image frames decoded as decode_image would (frame 0), in order, so
+            TIFF frame seeks never walk the file from the start again
+        A page that can't be split or decoded here as the whole upload and
+            its page number, so reading it reports why
+
+    Args:
+        image_data: Raw uploaded bytes
+        template_id: Template the pages will be graded with (sets the decoded size)
+
+    Yields:
+        (page data for decode_image or an already decoded grayscale page, frame) per page
+    """
+    if is_pdf(image_data):
+        document = open_pdf(image_data)
+        try:
+            with _pdfium_lock:
+                pages = len(document)
+            for page in range(pages):
+                try:
+                    sheet = _pdf_page_document(document, page), 0
+                except Exception:
+                    sheet = image_data, page
+                yield sheet
+        finally:
+            close_pdf(document)
+        return
+
+    image = Image.open(io.BytesIO(image_data))
+    for page in range(getattr(image, "n_frames", 1)):
+        try:
+            image.seek(page)
+            sheet = (image_data, page) if _gate_frame(image, template_id) else (_decode_frame(image, template_id), 0)
+        except Exception:
+            sheet = image_data, page
+        yield sheet
@@ -0,0 +1,805 @@
+import asyncio
+import http.client
+import ipaddress
+import json
+import os
+import socket
+import sqlite3
+import threading
+import urllib.request
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import numpy as np
+
+from .logging_utils import PipelineLogger
+from .models import ErrorResult
+
+log = PipelineLogger("jobs")
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# Callback delivery attempts, waiting CALLBACK_BACKOFF seconds (doubling) in between
+CALLBACK_ATTEMPTS = 3
+CALLBACK_BACKOFF = 1.0
+CALLBACK_TIMEOUT = 10
+
+# Callback hosts allowed even though they are local or private (e.g. an
+# internal service), from SNAPGRADE_CALLBACK_HOSTS: "hooks.internal,10.0.0.5"
+CALLBACK_HOSTS = {
+    host.strip().lower() for host in os.getenv("SNAPGRADE_CALLBACK_HOSTS", "").split(",") if host.strip()
+}
+
+# Finished jobs the in-process queue keeps around for polling
+MEMORY_FINISHED_JOBS = 1000
+
+# An uploaded file of a job: (filename, image bytes, page count)
+Upload = Tuple[str, bytes, int]
+
+# An upload with sheets still to grade: (filename, image bytes, page count,
+# sheet index by page for the pages without a result)
+PendingUpload = Tuple[str, bytes, int, Dict[int, int]]
+
+# One page of an upload, ready to grade: (filename, page, image bytes, a
+# decoded page or the error of a file refused unread, frame to read in it,
+# upload digest or None)
+SplitSheet = Tuple[str, int, Union[bytes, np.ndarray, ErrorResult], int, Optional[str]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    total_sheets INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    callback_url TEXT,
+    callback_status TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id TEXT NOT NULL,
+    file_index INTEGER NOT NULL,
+    filename TEXT,
+    image BLOB NOT NULL,
+    PRIMARY KEY (job_id, file_index)
+);
+CREATE TABLE IF NOT EXISTS job_sheets (
+    job_id TEXT NOT NULL,
+    sheet_index INTEGER NOT NULL,
+    file_index INTEGER NOT NULL,
+    page INTEGER NOT NULL,
+    success INTEGER,
+    result TEXT,
+    PRIMARY KEY (job_id, sheet_index)
+);
+"""
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+class JobQueue(ABC):
+    """
+    Storage for grading jobs submitted through /jobs
+
+    A job is a stack of uploads graded against one answer key. Each page of
+    each upload is one sheet, whose result is recorded as soon as it is
+    graded, so a job interrupted by a crash or restart only regrades the
+    sheets it had not finished. Implementations must be safe to call from
+    several threads.
+
+    Job status dicts carry: job_id, status, template_id, exam_id,
+    total_sheets, completed_sheets, failed_sheets, attempts, error,
+    callback_url, callback_status, created_at, updated_at and results
+    (sheet results in sheet order).
+    """
+
+    def __init__(self, max_attempts: Optional[int] = None):
+        self.max_attempts = max_attempts or int(os.getenv("SNAPGRADE_JOB_MAX_ATTEMPTS", 3))
+
+    @abstractmethod
+    def submit(self, params: dict, uploads: List[Upload], callback_url: Optional[str] = None,
+               results: Optional[Dict[int, dict]] = None) -> str:
+        """
+        Queue a job
+
+        Args:
+            params: Grading parameters (answer_key, template_id, exam_id, debug)
+            uploads: The uploaded files, one sheet per page
+            callback_url: URL to POST the finished job's status to
+            results: Results already settled at submission, by sheet index
+                (e.g. a file refused for its size); those sheets are never graded
+
+        Returns:
+            The new job id
+        """
+
+    @abstractmethod
+    def claim(self) -> Optional[dict]:
+        """
+        Take the oldest queued job and mark it running (counting an attempt)
+
+        Returns:
+            {"job_id", "params", "attempts", "callback_url"}, or None when nothing is queued
+        """
+
+    @abstractmethod
+    def pending_uploads(self, job_id: str) -> Iterator[PendingUpload]:
+        """
+        Uploads of a job that have sheets without a result yet, in order
+
+        Uploads are loaded one at a time as the iterator is advanced, so a
+        job's images are never all held in memory at once.
+        """
+
+    @abstractmethod
+    def record_result(self, job_id: str, index: int, result: dict):
+        """Save the result of one sheet"""
+
+    @abstractmethod
+    def finish(self, job_id: str, status: str, error: Optional[str] = None):
+        """Mark a job completed or failed and drop its uploaded images"""
+
+    @abstractmethod
+    def release(self, job_id: str, error: str) -> str:
+        """
+        Put a job whose run crashed back in the queue, or fail it once it
+        has used up max_attempts
+
+        Returns:
+            The job's new status
+        """
+
+    @abstractmethod
+    def recover(self) -> List[str]:
+        """
+        Requeue jobs left running by a previous process (called at startup)
+
+        Returns:
+            Ids of the jobs failed instead, having used up max_attempts
+        """
+
+    @abstractmethod
+    def get(self, job_id: str, include_results: bool = True) -> Optional[dict]:
+        """Status of a job, or None if it is unknown"""
+
+    @abstractmethod
+    def set_callback_status(self, job_id: str, status: str):
+        """Record how delivering the job's callback went"""
+
+    def close(self):
+        """Release the queue's storage (called at shutdown)"""
+
+
+class MemoryJobQueue(JobQueue):
+    """
+    Job queue held in the API process
+
+    Jobs are lost when the process stops; only the most recent
+    MEMORY_FINISHED_JOBS finished jobs are kept for polling.
+    """
+
+    def __init__(self, max_attempts: Optional[int] = None):
+        super().__init__(max_attempts)
+        self._jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, params: dict, uploads: List[Upload], callback_url: Optional[str] = None,
+               results: Optional[Dict[int, dict]] = None) -> str:
+        job_id = uuid.uuid4().hex
+        sheets = [
+            (file_index, page)
+            for file_index, (_, _, pages) in enumerate(uploads)
+            for page in range(pages)
+        ]
+        now = _now()
+        with self._lock:
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": QUEUED,
+                "params": params,
+                "uploads": list(uploads),
+                "sheets": sheets,
+                "results": dict(results or {}),
+                "attempts": 0,
+                "error": None,
+                "callback_url": callback_url,
+                "callback_status": None,
+                "created_at": now,
+                "updated_at": now
+            }
+        return job_id
+
+    def claim(self) -> Optional[dict]:
+        with self._lock:
+            for job in self._jobs.values():
+                if job["status"] == QUEUED:
+                    job["status"] = RUNNING
+                    job["attempts"] += 1
+                    job["updated_at"] = _now()
+                    return {key: job[key] for key in ("job_id", "params", "attempts", "callback_url")}
+        return None
+
+    def pending_uploads(self, job_id: str) -> Iterator[PendingUpload]:
+        with self._lock:
+            job = self._jobs[job_id]
+            uploads = job["uploads"]
+            pending: Dict[int, Dict[int, int]] = {}
+            for index, (file_index, page) in enumerate(job["sheets"]):
+                if index not in job["results"]:
+                    pending.setdefault(file_index, {})[page] = index
+
+        for file_index, pages in pending.items():
+            filename, image_data, page_count = uploads[file_index]
+            yield filename, image_data, page_count, pages
+
+    def record_result(self, job_id: str, index: int, result: dict):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["results"][index] = result
+            job["updated_at"] = _now()
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = status
+            job["error"] = error
+            job["updated_at"] = _now()
+            # Keep the sheet list for total_sheets, not the images
+            job["uploads"] = []
+
+            finished = [key for key, other in self._jobs.items() if other["status"] in (COMPLETED, FAILED)]
+            for key in finished[:max(len(finished) - MEMORY_FINISHED_JOBS, 0)]:
+                del self._jobs[key]
+
+    def release(self, job_id: str, error: str) -> str:
+        with self._lock:
+            job = self._jobs[job_id]
+            if job["attempts"] < self.max_attempts:
+                job["status"] = QUEUED
+                job["error"] = error
+                job["updated_at"] = _now()
+                return QUEUED
+        self.finish(job_id, FAILED, error)
+        return FAILED
+
+    def recover(self) -> List[str]:
+        return []  # Nothing outlives the process
+
+    def get(self, job_id: str, include_results: bool = True) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            results = [job["results"][index] for index in sorted(job["results"])]
+            status = {
+                key: job[key] for key in (
+                    "job_id", "status", "attempts", "error", "callback_url",
+                    "callback_status", "created_at", "updated_at"
+                )
+            }
+
+        status.update(
+            template_id=job["params"]["template_id"],
+            exam_id=job["params"].get("exam_id"),
+            total_sheets=len(job["sheets"]),
+            completed_sheets=len(results),
+            failed_sheets=sum(1 for result in results if not result.get("success", False)),
+            results=results if include_results else []
+        )
+        return status
+
+    def set_callback_status(self, job_id: str, status: str):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id]["callback_status"] = status
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    Job queue persisted in SQLite, so queued and interrupted jobs survive a restart
+
+    Every upload is stored once (a multi-page TIFF is not copied per page)
+    and deleted when its job finishes; sheet results are kept.
+    """
+
+    def __init__(self, path: str, max_attempts: Optional[int] = None):
+        super().__init__(max_attempts)
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def submit(self, params: dict, uploads: List[Upload], callback_url: Optional[str] = None,
+               results: Optional[Dict[int, dict]] = None) -> str:
+        job_id = uuid.uuid4().hex
+        sheets, files = [], []
+        for file_index, (filename, image_data, pages) in enumerate(uploads):
+            files.append((job_id, file_index, filename, image_data))
+            first = len(sheets)
+            sheets.extend((job_id, first + page, file_index, page) for page in range(pages))
+
+        now = _now()
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT INTO jobs (job_id, status, params, total_sheets, callback_url, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, QUEUED, json.dumps(params), len(sheets), callback_url, now, now)
+                )
+                connection.executemany("INSERT INTO job_files VALUES (?, ?, ?, ?)", files)
+                connection.executemany(
+                    "INSERT INTO job_sheets (job_id, sheet_index, file_index, page) VALUES (?, ?, ?, ?)",
+                    sheets
+                )
+                # In the same transaction, so a runner never sees these sheets ungraded
+                connection.executemany(
+                    "UPDATE job_sheets SET success = ?, result = ? WHERE job_id = ? AND sheet_index = ?",
+                    [
+                        (int(bool(result.get("success", False))),
+                         json.dumps(result, separators=(",", ":")), job_id, index)
+                        for index, result in (results or {}).items()
+                    ]
+                )
+        return job_id
+
+    def claim(self) -> Optional[dict]:
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                row = connection.execute(
+                    "SELECT job_id, params, attempts, callback_url FROM jobs "
+                    "WHERE status = ? ORDER BY created_at LIMIT 1",
+                    (QUEUED,)
+                ).fetchone()
+                if row is None:
+                    return None
+                connection.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE job_id = ?",
+                    (RUNNING, _now(), row[0])
+                )
+
+        return {"job_id": row[0], "params": json.loads(row[1]), "attempts": row[2] + 1, "callback_url": row[3]}
+
+    def pending_uploads(self, job_id: str) -> Iterator[PendingUpload]:
+        # The sheet list first (no images), then each file's image as it's reached
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT sheet_index, file_index, page, result IS NULL FROM job_sheets "
+                "WHERE job_id = ? ORDER BY sheet_index",
+                (job_id,)
+            ).fetchall()
+
+        page_counts: Dict[int, int] = {}
+        pending: Dict[int, Dict[int, int]] = {}
+        for index, file_index, page, unfinished in rows:
+            page_counts[file_index] = page_counts.get(file_index, 0) + 1
+            if unfinished:
+                pending.setdefault(file_index, {})[page] = index
+
+        for file_index, pages in pending.items():
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT filename, image FROM job_files WHERE job_id = ? AND file_index = ?",
+                    (job_id, file_index)
+                ).fetchone()
+            if row is not None:
+                yield row[0], bytes(row[1]), page_counts[file_index], pages
+
+    def record_result(self, job_id: str, index: int, result: dict):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "UPDATE job_sheets SET success = ?, result = ? WHERE job_id = ? AND sheet_index = ?",
+                    (int(bool(result.get("success", False))),
+                     json.dumps(result, separators=(",", ":")), job_id, index)
+                )
+                connection.execute("UPDATE jobs SET updated_at = ? WHERE job_id = ?", (_now(), job_id))
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                    (status, error, _now(), job_id)
+                )
+                connection.execute("DELETE FROM job_files WHERE job_id = ?", (job_id,))
+
+    def release(self, job_id: str, error: str) -> str:
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                updated = connection.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ? AND attempts < ?",
+                    (QUEUED, error, _now(), job_id, self.max_attempts)
+                ).rowcount
+        if updated:
+            return QUEUED
+
+        self.finish(job_id, FAILED, error)
+        return FAILED
+
+    def recover(self) -> List[str]:
+        with self._lock:
+            exhausted = [
+                row[0] for row in self._connect().execute(
+                    "SELECT job_id FROM jobs WHERE status = ? AND attempts >= ?",
+                    (RUNNING, self.max_attempts)
+                )
+            ]
+
+        for job_id in exhausted:
+            self.finish(job_id, FAILED, "Interrupted too many times")
+
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                requeued = connection.execute(
+                    "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?",
+                    (QUEUED, _now(), RUNNING)
+                ).rowcount
+        if requeued:
+            log.info("Requeued interrupted jobs", jobs=requeued)
+        return exhausted
+
+    def get(self, job_id: str, include_results: bool = True) -> Optional[dict]:
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT job_id, status, params, total_sheets, attempts, error, callback_url, "
+                "callback_status, created_at, updated_at FROM jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            completed, failed = connection.execute(
+                "SELECT COUNT(result), COUNT(result) - COALESCE(SUM(success), 0) "
+                "FROM job_sheets WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+            results = []
+            if include_results:
+                results = [
+                    json.loads(result) for (result,) in connection.execute(
+                        "SELECT result FROM job_sheets WHERE job_id = ? AND result IS NOT NULL "
+                        "ORDER BY sheet_index",
+                        (job_id,)
+                    )
+                ]
+
+        params = json.loads(row[2])
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "template_id": params["template_id"],
+            "exam_id": params.get("exam_id"),
+            "total_sheets": row[3],
+            "completed_sheets": completed,
+            "failed_sheets": failed,
+            "attempts": row[4],
+            "error": row[5],
+            "callback_url": row[6],
+            "callback_status": row[7],
+            "created_at": row[8],
+            "updated_at": row[9],
+            "results": results
+        }
+
+    def set_callback_status(self, job_id: str, status: str):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "UPDATE jobs SET callback_status = ? WHERE job_id = ?", (status, job_id)
+                )
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def create_job_queue(path: Optional[str] = None) -> JobQueue:
+    """
+    Build the configured job queue
+
+    SNAPGRADE_JOB_DB (or path) selects a SQLite queue that survives
+    restarts; without it jobs are kept in the API process.
+    """
+    path = os.getenv("SNAPGRADE_JOB_DB", "") if path is None else path
+    return SQLiteJobQueue(path) if path else MemoryJobQueue()
+
+
+class CallbackRefusedError(ValueError):
+    """Raised for a callback URL that is not http(s) or points at a local or private address"""
+
+
+def _local_address(address: str) -> bool:
+    # Loopback, private, link-local, reserved, unspecified or multicast
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return not ip.is_global or ip.is_multicast
+
+
+def check_callback_url(url: str) -> str:
+    """
+    Check a callback URL before a job is queued with it
+
+    Only http(s) URLs are accepted. A host given as an address (or
+    localhost) must be public unless it is in CALLBACK_HOSTS; a host name is
+    checked again every time it is resolved to POST to it (see post_json).
+
+    Returns:
+        The URL's host
+
+    Raises:
+        CallbackRefusedError: If the URL may not be called back
+    """
+    parsed = urlparse(url)
+    try:
+        host, _ = parsed.hostname, parsed.port
+    except ValueError:
+        host = None
+    if parsed.scheme not in ("http", "https") or not host:
+        raise CallbackRefusedError("callback_url must be an http(s) URL")
+    if host in CALLBACK_HOSTS:
+        return host
+
+    try:
+        local = _local_address(host)
+    except ValueError:
+        local = host == "localhost" or host.endswith(".localhost")
+    if local:
+        raise CallbackRefusedError(f"callback_url must not point to a local or private address ({host})")
+    return host
+
+
+def _connect_public(address: Tuple[str, int], timeout: Optional[float] = None, source_address=None) -> socket.socket:
+    # socket.create_connection, refusing a host that resolves to a local or
+    # private address, and connecting to the address that was checked
+    host, port = address
+    if host.lower() in CALLBACK_HOSTS:
+        return socket.create_connection(address, timeout, source_address)
+
+    addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    for *_, sockaddr in addresses:
+        if _local_address(sockaddr[0]):
+            raise CallbackRefusedError(f"{host} resolves to a local or private address ({sockaddr[0]})")
+    return socket.create_connection((addresses[0][4][0], port), timeout, source_address)
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # A redirect is returned as an error rather than followed to a host that wasn't checked
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+# Callbacks go straight to their host: no proxies, no redirects, public addresses only
+_callback_opener = urllib.request.build_opener(
+    urllib.request.ProxyHandler({}), _PublicHTTPHandler, _PublicHTTPSHandler, _NoRedirect
+)
+
+
+def post_json(url: str, payload: dict, timeout: float = CALLBACK_TIMEOUT) -> int:
+    """
+    POST a JSON body to a callback URL and return the response status
+
+    Raises:
+        CallbackRefusedError: If the URL is not http(s) or its host is, or
+            resolves to, a local or private address (see check_callback_url)
+        urllib.error.URLError / HTTPError: If the request fails
+    """
+    check_callback_url(url)
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST"
+    )
+    with _callback_opener.open(request, timeout=timeout) as response:
+        return response.status
+
+
+class JobRunner:
+    """
+    Background tasks that work through a JobQueue on the API's event loop
+
+    Queue calls (SQLite reads and writes, uploads included) run in a thread,
+    so a job's bookkeeping never blocks the requests the loop is serving.
+
+    Each task claims the oldest queued job and grades its remaining sheets,
+    at most sheet_concurrency at a time. Its uploads are loaded one at a
+    time and split into pages by split_upload (in a thread) only as worker
+    slots free up, the way /process-batch splits them, so a job holds one
+    upload and a page per slot rather than every image it was sent.
+    A sheet's own failure (undecodable image, timeout) is recorded as its
+    result; an exception escaping grade_sheet is treated as a crash and the
+    job is queued again, picking up at the first sheet without a result,
+    until it runs out of attempts. Finished jobs are POSTed to their
+    callback URL.
+
+    Configuration comes from the environment unless given explicitly:
+        SNAPGRADE_JOB_CONCURRENCY  jobs graded at once (default: 1)
+    """
+
+    def __init__(self, queue: JobQueue,
+                 grade_sheet: Callable[[dict, SplitSheet], Awaitable[Dict[str, Any]]],
+                 split_upload: Callable[[Upload, str], Iterator[SplitSheet]],
+                 concurrency: Optional[int] = None, sheet_concurrency: int = 1,
+                 poll_interval: float = 5.0):
+        self.queue = queue
+        self.grade_sheet = grade_sheet
+        self.split_upload = split_upload
+        self.concurrency = concurrency or int(os.getenv("SNAPGRADE_JOB_CONCURRENCY", 1))
+        self.sheet_concurrency = sheet_concurrency
+        self.poll_interval = poll_interval
+
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self):
+        """Requeue interrupted jobs and start the runner tasks (inside the event loop)"""
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        for job_id in self.queue.recover():
+            self._tasks.append(asyncio.create_task(self._notify(job_id)))
+        self._tasks.extend(asyncio.create_task(self._work()) for _ in range(self.concurrency))
+
+    async def stop(self):
+        """
+        Cancel the runner tasks
+
+        A job interrupted here stays running in a persistent queue and is
+        picked up again by the next start().
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        """Check the queue now instead of at the next poll (call after a submit)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _work(self):
+        while True:
+            job = await asyncio.to_thread(self.queue.claim)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(job)
+
+    def _pending_sheets(self, job_id: str, template_id: str) -> Iterator[Tuple[int, SplitSheet]]:
+        # (sheet index, sheet) for every page without a result, one upload loaded at a time
+        for filename, image_data, pages, pending in self.queue.pending_uploads(job_id):
+            for sheet in self.split_upload((filename, image_data, pages), template_id):
+                if sheet[1] in pending:
+                    yield pending[sheet[1]], sheet
+
+    async def _run(self, job: dict):
+        job_id = job["job_id"]
+        log.info("Running job", job_id=job_id, attempt=job["attempts"])
+        slots = asyncio.Semaphore(self.sheet_concurrency)
+
+        async def grade(index: int, sheet: SplitSheet):
+            try:
+                result = await self.grade_sheet(job["params"], sheet)
+            finally:
+                slots.release()
+            filename, page = sheet[:2]
+            result = {"index": index, "filename": filename, "page": page, **result}
+            await asyncio.to_thread(self.queue.record_result, job_id, index, result)
+
+        tasks = set()
+        try:
+            # The next sheet is only taken (and its upload loaded or page
+            # decoded) once a slot is free
+            sheets = self._pending_sheets(job_id, job["params"]["template_id"])
+            while True:
+                await slots.acquire()
+                pending = await asyncio.to_thread(next, sheets, None)
+                if pending is None:
+                    break
+                tasks.add(asyncio.ensure_future(grade(*pending)))
+
+                # Surface a crashed sheet now rather than after the whole job
+                for task in [task for task in tasks if task.done()]:
+                    tasks.discard(task)
+                    task.result()
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception("Job run crashed", job_id=job_id, attempt=job["attempts"])
+            if await asyncio.to_thread(self.queue.release, job_id, str(e) or type(e).__name__) == QUEUED:
+                return
+        else:
+            await asyncio.to_thread(self.queue.finish, job_id, COMPLETED)
+            log.info("Finished job", job_id=job_id)
+        finally:
+            # Sheets still in flight after a crash are graded by the next run
+            for task in tasks:
+                task.cancel()
+
+        await self._notify(job_id)
+
+    async def _notify(self, job_id: str):
+        status = await asyncio.to_thread(self.queue.get, job_id)
+        if status is None or not status["callback_url"]:
+            return
+
+        delay = CALLBACK_BACKOFF
+        for attempt in range(1, CALLBACK_ATTEMPTS + 1):
+            try:
+                await asyncio.to_thread(post_json, status["callback_url"], status)
+                await asyncio.to_thread(self.queue.set_callback_status, job_id, "delivered")
+                return
+            except CallbackRefusedError as e:
+                log.warning("Job callback refused", job_id=job_id, error=str(e))
+                await asyncio.to_thread(self.queue.set_callback_status, job_id, "refused")
+                return
+            except Exception as e:
+                log.warning("Job callback failed", job_id=job_id, attempt=attempt, error=str(e))
+                if attempt < CALLBACK_ATTEMPTS:
+                    await asyncio.sleep(delay)
+                    delay *= 2
+
+        await asyncio.to_thread(self.queue.set_callback_status, job_id, "failed")
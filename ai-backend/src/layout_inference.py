@@ -0,0 +1,283 @@
+import math
+import numpy as np
+from typing import List, Optional, Tuple
+
+from .bubble_search import cluster_positions
+
+# Row and column clusters holding fewer bubbles than this, or less than this
+# share of the median cluster's, are stray detections, not part of the grid
+# (question columns likewise, against the largest question column)
+MIN_CLUSTER_SIZE = 2
+MIN_CLUSTER_SHARE = 0.3
+
+# Neighbours are looked for within this many bubble radii, at most this far
+# from the row (or column) direction
+NEIGHBOUR_REACH_RADII = 8.0
+NEIGHBOUR_MAX_ANGLE = math.radians(30)
+
+# Neighbour links this close to their median direction are averaged into the angle
+INLIER_ANGLE = math.radians(5)
+
+# Neighbour links longer than this many pitches cross between question
+# columns, which are printed at least three choice pitches apart
+LINK_PITCHES = 1.5
+
+# A linked group with more choice clusters than the template's choices plus
+# this many is another printed bubble field (an ID grid), not a question column
+EXTRA_CHOICE_CLUSTERS = 2
+
+# A sparse top row this many pitches above the next one (or off the row
+# pitch) is stray marks rather than a row of the grid
+STRAY_ROW_PITCHES = 1.5
+
+
+def _neighbour_pairs(xs: np.ndarray, ys: np.ndarray, reach: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Every (source, target) pair of distinct bubbles in the same or adjacent grid-hash cells
+
+    The grid hash is a sorted array of cell keys (cells reach wide), so each
+    neighbouring cell's members are one contiguous slice found with
+    searchsorted, and every bubble is only paired with the few around it.
+    """
+    cell_x = (xs // reach).astype(np.int64) - int(xs.min() // reach) + 1
+    cell_y = (ys // reach).astype(np.int64) - int(ys.min() // reach) + 1
+    stride = int(cell_y.max()) + 2
+    keys = cell_x * stride + cell_y
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    sources, targets = [], []
+    for offset in (-stride - 1, -stride, -stride + 1, -1, 0, 1, stride - 1, stride, stride + 1):
+        first = np.searchsorted(sorted_keys, keys + offset, side="left")
+        counts = np.searchsorted(sorted_keys, keys + offset, side="right") - first
+        total = int(counts.sum())
+        if total == 0:
+            continue
+        # Expand every (bubble, cell slice) into one index per pair
+        starts = np.repeat(first - (np.cumsum(counts) - counts), counts)
+        sources.append(np.repeat(np.arange(len(xs)), counts))
+        targets.append(order[np.arange(total) + starts])
+
+    source, target = np.concatenate(sources), np.concatenate(targets)
+    distinct = source != target
+    return source[distinct], target[distinct]
+
+
+def _nearest_links(xs: np.ndarray, ys: np.ndarray, pairs: Tuple[np.ndarray, np.ndarray],
+                   reach: float, horizontal: bool) -> Tuple[np.ndarray, np.ndarray]:
+    # Each bubble's nearest neighbour to the right (horizontal) or below, as
+    # (source, target) index arrays with at most one link per source
+    source, target = pairs
+    dx, dy = xs[target] - xs[source], ys[target] - ys[source]
+    forward, sideways = (dx, dy) if horizontal else (dy, dx)
+    distance = np.hypot(dx, dy)
+    usable = (forward > 0) & (np.abs(sideways) <= forward * math.tan(NEIGHBOUR_MAX_ANGLE)) \
+        & (distance <= reach)
+    source, target, distance = source[usable], target[usable], distance[usable]
+
+    best = np.full(len(xs), np.inf)
+    np.minimum.at(best, source, distance)
+    nearest = distance == best[source]
+    source, target = source[nearest], target[nearest]
+
+    # Equally near neighbours would link a bubble twice; keep the first
+    _, first = np.unique(source, return_index=True)
+    return source[first], target[first]
+
+
+def _link_direction(xs: np.ndarray, ys: np.ndarray, links: Tuple[np.ndarray, np.ndarray],
+                    horizontal: bool) -> Tuple[float, float]:
+    """
+    Common direction and typical length of a set of neighbour links
+
+    Centers are whole pixels, so single links give coarse angles; the links
+    close to the median direction are summed instead.
+
+    Returns:
+        (angle from the x axis (horizontal) or y axis in radians, median length),
+        (0.0, 0.0) without links
+    """
+    source, target = links
+    if len(source) == 0:
+        return 0.0, 0.0
+
+    dx, dy = xs[target] - xs[source], ys[target] - ys[source]
+    forward, sideways = (dx, dy) if horizontal else (dy, dx)
+    angles = np.arctan2(sideways, forward)
+    inliers = np.abs(angles - np.median(angles)) <= INLIER_ANGLE
+    angle = math.atan2(sideways[inliers].sum(), forward[inliers].sum())
+    return angle, float(np.median(np.hypot(dx, dy)))
+
+
+def _grid_links(xs: np.ndarray, ys: np.ndarray, reach: float) -> Tuple[Tuple[np.ndarray, np.ndarray],
+                                                                       Tuple[np.ndarray, np.ndarray]]:
+    """
+    Link every bubble to its nearest neighbour to the right and below
+
+    The right neighbour is the next choice of the same question, the one
+    below the same choice of the next question. Links longer than
+    LINK_PITCHES pitches cross the gap between question columns and are
+    dropped, so the links never leave a question column.
+
+    Returns:
+        (right links, links down), each a (source, target) pair of index arrays
+    """
+    pairs = _neighbour_pairs(xs, ys, reach)
+    right = _nearest_links(xs, ys, pairs, reach, horizontal=True)
+    down = _nearest_links(xs, ys, pairs, reach, horizontal=False)
+    _, choice_pitch = _link_direction(xs, ys, right, horizontal=True)
+    _, row_pitch = _link_direction(xs, ys, down, horizontal=False)
+    limit = LINK_PITCHES * max(choice_pitch, row_pitch)
+
+    def short(links):
+        source, target = links
+        keep = np.hypot(xs[target] - xs[source], ys[target] - ys[source]) <= limit
+        return source[keep], target[keep]
+
+    return short(right), short(down)
+
+
+def _linked_groups(count: int, source: np.ndarray, target: np.ndarray) -> np.ndarray:
+    # Connected components of the links: every bubble ends up labelled with the
+    # smallest index reachable through them (vectorized label propagation)
+    labels = np.arange(count)
+    while len(source):
+        low = np.minimum(labels[source], labels[target])
+        updated = labels.copy()
+        np.minimum.at(updated, source, low)
+        np.minimum.at(updated, target, low)
+        updated = updated[updated]  # Jump along labels that were lowered too
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    return labels
+
+
+def _grid_clusters(values: np.ndarray, tolerance: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Cluster labels, center and size of every cluster; stray clusters get NaN centers
+    labels = cluster_positions(values, tolerance)
+    counts = np.bincount(labels)
+    centers = np.bincount(labels, weights=values) / counts
+
+    stray = counts < max(MIN_CLUSTER_SIZE, MIN_CLUSTER_SHARE * np.median(counts))
+    centers[stray] = np.nan
+    return labels, centers, counts
+
+
+def _drop_stray_top_row(centers: np.ndarray, counts: np.ndarray, pitch: float):
+    # A sparse first row well above the next, or off the row pitch, is stray marks
+    kept = np.flatnonzero(~np.isnan(centers))
+    if len(kept) < 2 or pitch <= 0 or counts[kept[0]] >= np.median(counts[kept]):
+        return
+
+    steps = (centers[kept[1]] - centers[kept[0]]) / pitch
+    if steps > STRAY_ROW_PITCHES or abs(steps - round(steps)) > 0.25:
+        centers[kept[0]] = np.nan
+
+
+def _number_clusters(centers: np.ndarray, pitch: float) -> np.ndarray:
+    """
+    Number clusters from the first one, in whole steps of the pitch
+
+    Each gap is rounded on its own, so a missing row or choice is skipped,
+    and a scale that changes slowly down the page (perspective) never adds up.
+
+    Returns:
+        Number of every cluster (-1 for stray clusters)
+    """
+    numbers = np.full(len(centers), -1, dtype=np.int64)
+    kept = np.flatnonzero(~np.isnan(centers))
+    if len(kept) == 0:
+        return numbers
+
+    steps = np.ones(len(kept) - 1)
+    if pitch > 0:
+        steps = np.maximum(np.rint(np.diff(centers[kept]) / pitch), 1)
+    numbers[kept] = np.concatenate(([0], np.cumsum(steps)))
+    return numbers
+
+
+def infer_layout(bubbles: List[dict], questions: int, choices: int) -> List[List[Optional[dict]]]:
+    """
+    Map detected bubbles to question and choice numbers from their positions alone
+
+    Bubbles are first grouped into the printed question columns by linking
+    each to its nearest neighbours (groups far wider than a question, such
+    as a student ID grid, are left out). Within a question column, centers are
+    projected across that column's own row and column directions (which
+    perspective makes differ from column to column) and clustered in 1-D,
+    in linear time, into rows and choices. Clusters are numbered in steps of
+    the measured pitch, so a bubble the detector missed leaves a hole
+    instead of shifting the rest. Questions run down each question column,
+    then continue in the next, as printed.
+
+    Sets "question" and "choice" on every bubble that was placed.
+
+    Args:
+        bubbles: Detected bubbles with x, y and radius (any order)
+        questions: Number of questions on the sheet
+        choices: Number of choices per question
+
+    Returns:
+        questions x choices nested list holding the bubble found for each
+        choice, or None where no bubble was found
+    """
+    slots: List[List[Optional[dict]]] = [[None] * choices for _ in range(questions)]
+    if len(bubbles) < MIN_CLUSTER_SIZE:
+        return slots
+
+    xs = np.array([bubble["x"] for bubble in bubbles], dtype=np.float64)
+    ys = np.array([bubble["y"] for bubble in bubbles], dtype=np.float64)
+    radius = float(np.median([bubble["radius"] for bubble in bubbles]))
+    reach = NEIGHBOUR_REACH_RADII * radius
+    tolerance = max(radius / 2, 1.0)
+
+    # Question columns are the groups of linked bubbles, ordered left to right
+    right, down = _grid_links(xs, ys, reach)
+    groups = _linked_groups(len(bubbles), np.concatenate((right[0], down[0])),
+                            np.concatenate((right[1], down[1])))
+    sizes = np.bincount(groups, minlength=len(bubbles))
+    grids = []
+    for group in np.flatnonzero(sizes >= max(MIN_CLUSTER_SIZE, MIN_CLUSTER_SHARE * sizes.max())).tolist():
+        members = np.flatnonzero(groups == group)
+
+        # Perspective tilts rows and columns differently in every question
+        # column, so each is measured from the column's own links
+        row_angle, choice_pitch = _link_direction(
+            xs, ys, tuple(links[groups[right[0]] == group] for links in right), horizontal=True
+        )
+        column_angle, row_pitch = _link_direction(
+            xs, ys, tuple(links[groups[down[0]] == group] for links in down), horizontal=False
+        )
+
+        # Position along the rows (square to the columns) and down the column (square to the rows)
+        column_xs, column_ys = xs[members], ys[members]
+        along = column_xs * math.cos(column_angle) - column_ys * math.sin(column_angle)
+        across = column_ys * math.cos(row_angle) - column_xs * math.sin(row_angle)
+
+        choice_labels, choice_centers, _ = _grid_clusters(along, tolerance)
+        if np.count_nonzero(~np.isnan(choice_centers)) > choices + EXTRA_CHOICE_CLUSTERS:
+            continue
+        choice_numbers = _number_clusters(choice_centers, choice_pitch)[choice_labels]
+
+        row_labels, row_centers, row_counts = _grid_clusters(across, tolerance)
+        _drop_stray_top_row(row_centers, row_counts, row_pitch)
+        row_numbers = _number_clusters(row_centers, row_pitch)[row_labels]
+        grids.append((float(column_xs.mean()), members, choice_numbers, row_numbers))
+
+    grids.sort(key=lambda grid: grid[0])
+    rows_per_column = math.ceil(questions / max(len(grids), 1))
+
+    for column, (_, members, choice_numbers, row_numbers) in enumerate(grids):
+        for member, choice, row in zip(members.tolist(), choice_numbers.tolist(), row_numbers.tolist()):
+            if not 0 <= row < rows_per_column or not 0 <= choice < choices:
+                continue
+
+            question = column * rows_per_column + row
+            if question < questions and slots[question][choice] is None:
+                bubble = bubbles[member]
+                bubble["question"] = question
+                bubble["choice"] = choice
+                slots[question][choice] = bubble
+
+    return slots
@@ -0,0 +1,144 @@
+import contextvars
+import logging
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+# Share of requests that get debug logging when nobody asked for it
+DEBUG_SAMPLE_RATE = float(os.getenv("SNAPGRADE_DEBUG_SAMPLE_RATE", 0))
+
+# Debug switch for the request currently being processed (see debug_scope)
+_request_debug = contextvars.ContextVar("snapgrade_request_debug", default=False)
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formatter that appends a record's structured fields as key=value pairs
+    """
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            message += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return message
+
+
+def configure_logging(level: Optional[str] = None):
+    """
+    Send "snapgrade.*" logs to stderr at SNAPGRADE_LOG_LEVEL (default INFO)
+
+    Safe to call more than once (e.g. in every worker process).
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter())
+
+    root = logging.getLogger("snapgrade")
+    root.handlers[:] = [handler]
+    root.setLevel((level or os.getenv("SNAPGRADE_LOG_LEVEL", "INFO")).upper())
+    root.propagate = False
+
+
+def env_flag(name: str) -> bool:
+    """Read a boolean deployment setting such as SNAPGRADE_DEBUG=1"""
+    return os.getenv(name, "").lower() in ("1", "true", "yes", "on")
+
+
+@contextmanager
+def debug_scope(enabled: Optional[bool] = None) -> Iterator[bool]:
+    """
+    Turn debug logging on or off for the work done inside the block
+
+    Args:
+        enabled: True/False to force it; None samples SNAPGRADE_DEBUG_SAMPLE_RATE of requests
+    """
+    if enabled is None:
+        enabled = DEBUG_SAMPLE_RATE > 0 and random.random() < DEBUG_SAMPLE_RATE
+
+    token = _request_debug.set(enabled)
+    try:
+        yield enabled
+    finally:
+        _request_debug.reset(token)
+
+
+class PipelineLogger:
+    """
+    Logger for the grading pipeline
+
+    Messages use %-style arguments, so nothing is formatted unless the record
+    is emitted. Debug records are emitted when the logger's level allows it
+    or when the current request asked for debug output, and hot loops should
+    check debug_enabled() once instead of calling debug() per bubble.
+    """
+
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(f"snapgrade.{name}")
+
+    def debug_enabled(self) -> bool:
+        return _request_debug.get() or self._logger.isEnabledFor(logging.DEBUG)
+
+    def debug(self, msg: str, *args, **fields):
+        if self.debug_enabled():
+            self._emit(logging.DEBUG, msg, args, fields)
+
+    def info(self, msg: str, *args, **fields):
+        if self._logger.isEnabledFor(logging.INFO):
+            self._emit(logging.INFO, msg, args, fields)
+
+    def warning(self, msg: str, *args, **fields):
+        if self._logger.isEnabledFor(logging.WARNING):
+            self._emit(logging.WARNING, msg, args, fields)
+
+    def exception(self, msg: str, *args, **fields):
+        self._emit(logging.ERROR, msg, args, fields, exc_info=True)
+
+    def _emit(self, level: int, msg: str, args: tuple, fields: dict, exc_info: bool = False):
+        # Build the record directly so request-scoped debug bypasses the level check
+        record = self._logger.makeRecord(
+            self._logger.name, level, "(pipeline)", 0, msg, args,
+            exc_info=sys.exc_info() if exc_info else None,
+            extra={"fields": fields} if fields else None
+        )
+        self._logger.handle(record)
+
+
+class StageTimer:
+    """
+    Collects the wall-clock duration of each pipeline stage for one sheet
+
+    Args:
+        observer: Optional callback(stage, seconds) run as each stage ends
+            (e.g. metrics.observe_stage)
+    """
+
+    def __init__(self, observer: Optional[Callable[[str, float], None]] = None):
+        self.timings: Dict[str, float] = {}
+        self._observer = observer
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+            if self._observer is not None:
+                self._observer(name, seconds)
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the timer was created"""
+        return time.perf_counter() - self._start
+
+    def fields(self) -> Dict[str, float]:
+        """Stage timings in milliseconds, ready to pass as log fields"""
+        return {f"{name}_ms": round(seconds * 1000, 1) for name, seconds in self.timings.items()}
@@ -0,0 +1,258 @@
+import contextvars
+from abc import ABC, abstractmethod
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# Latency buckets in seconds, from a single fast stage up to a slow full sheet
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (metric name, label values, value) recorded in a worker and not yet merged
+MetricsDelta = List[Tuple[str, Tuple[str, ...], float]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _Metric(ABC):
+    """A named metric; subclasses store its values and render them in the exposition format"""
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._registry = None
+
+    def _label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _submit(self, label_values: Tuple[str, ...], value: float):
+        if self._registry is not None and self._registry.forwarding:
+            self._registry.buffer(self.name, label_values, value)
+        else:
+            with self._lock:
+                self._apply(label_values, value)
+
+    @abstractmethod
+    def _apply(self, label_values: Tuple[str, ...], value: float):
+        """Fold one recorded value into the series (called with the lock held)"""
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        """Exposition lines for every series, without the HELP/TYPE header"""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        self._submit(self._label_values(labels), amount)
+
+    def _apply(self, label_values, value):
+        self._values[label_values] = self._values.get(label_values, 0.0) + value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            return [
+                f"{self.name}{_format_labels(self.labelnames, values)} {total:g}"
+                for values, total in sorted(self._values.items())
+            ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._label_values(labels)] = value
+
+    def _apply(self, label_values, value):
+        self._values[label_values] = value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            return [
+                f"{self.name}{_format_labels(self.labelnames, values)} {value:g}"
+                for values, value in sorted(self._values.items())
+            ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        self._submit(self._label_values(labels), value)
+
+    def _apply(self, label_values, value):
+        series = self._series.setdefault(label_values, [0.0] * (len(self.buckets) + 2))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.labelnames + ("le",), values + (f"{bound:g}",))
+                    lines.append(f"{self.name}_bucket{labels} {count:g}")
+                labels = _format_labels(self.labelnames + ("le",), values + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {series[-2]:g}")
+                labels = _format_labels(self.labelnames, values)
+                lines.append(f"{self.name}_sum{labels} {series[-1]:.6g}")
+                lines.append(f"{self.name}_count{labels} {series[-2]:g}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Set of metrics rendered in the Prometheus text exposition format
+
+    Worker processes run in forwarding mode: observations are buffered and
+    shipped back with each job (drain), then merged into the API process's
+    registry (merge), so /metrics covers every worker.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._pending: MetricsDelta = []
+        self._lock = threading.Lock()
+        self.forwarding = False
+
+    def register(self, metric: _Metric) -> _Metric:
+        metric._registry = self
+        self._metrics[metric.name] = metric
+        return metric
+
+    def buffer(self, name: str, label_values: Tuple[str, ...], value: float):
+        with self._lock:
+            self._pending.append((name, label_values, value))
+
+    def drain(self) -> MetricsDelta:
+        """Take the observations buffered since the last drain"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return pending
+
+    def merge(self, delta: MetricsDelta):
+        """Apply observations drained from a worker process"""
+        for name, label_values, value in delta:
+            metric = self._metrics.get(name)
+            if metric is not None:
+                with metric._lock:
+                    metric._apply(tuple(label_values), value)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "snapgrade_stage_seconds",
+    "Time spent in each pipeline stage",
+    ("stage", "template", "processor")
+))
+SHEET_SECONDS = REGISTRY.register(Histogram(
+    "snapgrade_sheet_seconds",
+    "End-to-end processing time per sheet",
+    ("template", "processor")
+))
+SHEETS_TOTAL = REGISTRY.register(Counter(
+    "snapgrade_sheets_total",
+    "Sheets processed, by outcome",
+    ("template", "processor", "status")
+))
+FALLBACKS_TOTAL = REGISTRY.register(Counter(
+    "snapgrade_fallbacks_total",
+    "Times a sheet needed a fallback path",
+    ("fallback", "template", "processor")
+))
+REJECTED_JOBS_TOTAL = REGISTRY.register(Counter(
+    "snapgrade_rejected_jobs_total",
+    "Grading jobs refused or abandoned by the worker pool",
+    ("reason",)
+))
+CACHE_LOOKUPS_TOTAL = REGISTRY.register(Counter(
+    "snapgrade_cache_lookups_total",
+    "Detection cache lookups, by result",
+    ("result",)
+))
+JOBS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "snapgrade_jobs_in_flight",
+    "Grading jobs running or queued in the worker pool"
+))
+
+# Labels of the sheet currently being processed (see sheet_scope)
+_sheet_labels = contextvars.ContextVar(
+    "snapgrade_sheet_labels", default={"template": "unknown", "processor": "unknown"}
+)
+
+
+@contextmanager
+def sheet_scope(processor: str, template: str) -> Iterator[None]:
+    """Label every stage and fallback recorded inside the block"""
+    token = _sheet_labels.set({"template": template, "processor": processor})
+    try:
+        yield
+    finally:
+        _sheet_labels.reset(token)
+
+
+def observe_stage(stage: str, seconds: float):
+    """Record one stage duration for the current sheet"""
+    STAGE_SECONDS.observe(seconds, stage=stage, **_sheet_labels.get())
+
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    """Time the block as a stage of the current sheet"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def record_fallback(fallback: str):
+    """Count a fallback path taken by the current sheet"""
+    FALLBACKS_TOTAL.inc(fallback=fallback, **_sheet_labels.get())
+
+
+def record_sheet(status: str, seconds: float):
+    """Record the outcome and total time of the current sheet"""
+    labels = _sheet_labels.get()
+    SHEETS_TOTAL.inc(status=status, **labels)
+    SHEET_SECONDS.observe(seconds, **labels)
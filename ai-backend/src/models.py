@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 from datetime import datetime
 
 class BubbleSheetTemplate(BaseModel):
@@ -8,6 +8,7 @@ class BubbleSheetTemplate(BaseModel):
     questions: int
     choices: List[str]
     description: str
+    fields: Dict[str, List[str]] = {}
 
 class ImageQuality(BaseModel):
     resolution: str
@@ -15,6 +16,22 @@ class ImageQuality(BaseModel):
     skew_angle: float
     blur_score: float
 
+class FieldReading(BaseModel):
+    value: Optional[str] = None
+    confidence: float = 0.0
+    flags: List[List[str]] = []
+
+class SheetDetection(BaseModel):
+    template_id: str
+    student_answers: List[str]
+    fill_ratios: List[List[float]]
+    confidence_scores: List[float]
+    answer_flags: List[List[str]] = []
+    fields: Dict[str, FieldReading] = {}
+    image_quality: ImageQuality
+    bubbles_detected: int
+    detection_time: float
+
 class ProcessingResult(BaseModel):
     success: bool
     student_answers: List[str]
@@ -25,11 +42,90 @@ class ProcessingResult(BaseModel):
     incorrect_questions: List[int]
     processing_time: float
     confidence_scores: List[float]
+    answer_flags: List[List[str]] = []
+    review_questions: List[int] = []
+    review_fields: List[str] = []
+    needs_review: bool = False
+    fields: Dict[str, FieldReading] = {}
     image_quality: ImageQuality
     student_id: Optional[str] = None
+    scan_id: Optional[str] = None
     processed_at: str = Field(default_factory=lambda: datetime.now().isoformat())
     
 class ErrorResult(BaseModel):
     success: bool = False
     error: str
     error_code: str
+
+class RegradeRequest(BaseModel):
+    # One answer key, or one per exam version ({"A": [...], "B": [...]})
+    answer_key: Union[List[str], Dict[str, List[str]]]
+    scan_ids: List[str] = []
+    exam_id: Optional[str] = None
+
+class RegradeScore(BaseModel):
+    scan_id: str
+    student_id: Optional[str] = None
+    version: Optional[str] = None
+    score: int
+    total_questions: int
+    percentage: float
+    incorrect_questions: List[int]
+
+class RegradeResult(BaseModel):
+    success: bool = True
+    regraded: int
+    results: List[RegradeScore]
+    missing_scan_ids: List[str] = []
+    unknown_version_scan_ids: List[str] = []
+    processing_time: float
+
+class ItemStatistics(BaseModel):
+    question: int
+    correct_answer: str
+    difficulty: float
+    discrimination: Optional[float] = None
+    choice_counts: Dict[str, int]
+    blank: int
+
+class ScoreDistribution(BaseModel):
+    mean: float
+    median: float
+    std: float
+    min: int
+    max: int
+    histogram: List[int]
+
+class ItemAnalysisResult(BaseModel):
+    success: bool = True
+    version: Optional[str] = None
+    students: int
+    questions: int
+    items: List[ItemStatistics]
+    score_distribution: ScoreDistribution
+    reliability: Optional[float] = None
+    missing_scan_ids: List[str] = []
+    processing_time: float
+
+class VersionedItemAnalysisResult(BaseModel):
+    success: bool = True
+    versions: Dict[str, ItemAnalysisResult]
+    missing_scan_ids: List[str] = []
+    unknown_version_scan_ids: List[str] = []
+    processing_time: float
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str
+    template_id: str
+    exam_id: Optional[str] = None
+    total_sheets: int
+    completed_sheets: int = 0
+    failed_sheets: int = 0
+    attempts: int = 0
+    error: Optional[str] = None
+    callback_url: Optional[str] = None
+    callback_status: Optional[str] = None
+    created_at: str
+    updated_at: str
+    results: List[Dict[str, Any]] = []
@@ -0,0 +1,320 @@
+import cv2
+import numpy as np
+import os
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from .models import BubbleSheetTemplate, ErrorResult, FieldReading, ProcessingResult, SheetDetection
+from .logging_utils import PipelineLogger, StageTimer, debug_scope, env_flag
+from .grading import AnswerKey, grade_detection
+from .quality import assess_quality, describe_quality, quality_gate, to_grayscale
+from .metrics import observe_stage, record_sheet, sheet_scope
+from .templates import canonical_size, compile_fields, compile_layout
+from . import stages
+
+log = PipelineLogger("detector")
+
+
+class PipelineStages(NamedTuple):
+    """
+    Interchangeable implementations of each step of reading a sheet (see src/stages.py)
+
+    Build a variant of an existing pipeline with _replace, e.g.
+    PIPELINES["standard"].stages._replace(detect=my_detect).
+    """
+    register: Callable[[np.ndarray, dict], Tuple[np.ndarray, float]]
+    preprocess: Callable[[np.ndarray], np.ndarray]
+    detect: Callable[[np.ndarray, dict], List[dict]]
+    measure: Callable[[np.ndarray, List[dict], dict], stages.Measurement]
+    decide: Callable[[stages.Measurement, List[dict], dict], stages.Decision]
+
+
+# Every sheet template the API accepts. "grid" names the printed layout in
+# templates.TEMPLATE_LAYOUTS and "pipeline" the entry of PIPELINES that reads it;
+# "fields" lists the values of each of the layout's other bubble fields.
+TEMPLATES = {
+    "simple_5": {
+        "name": "Simple 5 Questions",
+        "description": "5-question bubble sheet with A-D choices (optimized detection)",
+        "questions": 5,
+        "choices": ["A", "B", "C", "D"],
+        "bubble_size_range": (10, 50),
+        "grid": "simple_5",
+        "pipeline": "improved"
+    },
+    "standard_25": {
+        "name": "Standard 25 Questions",
+        "description": "Standard 25-question bubble sheet with A-D choices",
+        "questions": 25,
+        "choices": ["A", "B", "C", "D"],
+        "bubble_size_range": (15, 45),
+        "grid": "standard_25",
+        "pipeline": "standard"
+    },
+    "standard_50": {
+        "name": "Standard 50 Questions",
+        "description": "Standard 50-question bubble sheet with A-D choices",
+        "questions": 50,
+        "choices": ["A", "B", "C", "D"],
+        "bubble_size_range": (12, 35),
+        "grid": "standard_50",
+        "pipeline": "standard"
+    },
+    "standard_50_id": {
+        "name": "Standard 50 Questions with Student ID",
+        "description": "Standard 50-question bubble sheet with A-D choices, bubbled student ID and version",
+        "questions": 50,
+        "choices": ["A", "B", "C", "D"],
+        "fields": {
+            "student_id": {"positions": 6, "values": list("0123456789")},
+            "version": {"positions": 1, "values": ["A", "B", "C", "D"]}
+        },
+        "bubble_size_range": (12, 35),
+        "grid": "standard_50_id",
+        "pipeline": "standard"
+    },
+    "extended_100": {
+        "name": "Extended 100 Questions",
+        "description": "Extended 100-question bubble sheet with A-E choices",
+        "questions": 100,
+        "choices": ["A", "B", "C", "D", "E"],
+        "bubble_size_range": (10, 30),
+        "grid": "extended_100",
+        "pipeline": "standard"
+    }
+}
+
+# Pipeline for template ids that aren't registered (they fail with "Unknown template")
+DEFAULT_PIPELINE = "standard"
+
+# Per-template pipeline overrides, e.g. "standard_25=improved,simple_5=standard",
+# to A/B a pipeline in production without a code change
+PIPELINE_OVERRIDES = dict(
+    entry.strip().split("=", 1)
+    for entry in os.getenv("SNAPGRADE_PIPELINES", "").split(",")
+    if "=" in entry
+)
+
+
+class SheetPipeline:
+    """
+    Reads bubble sheets by running a set of stages
+
+    Every sheet goes through the same steps: a quality gate, then the
+    stages in order (register the page, preprocess it, detect bubbles,
+    measure their fill, decide the answers), each timed and recorded
+    under the pipeline's name.
+    """
+
+    def __init__(self, name: str, stages: PipelineStages):
+        self.name = name
+        self.stages = stages
+        # Per-deployment debug output (SNAPGRADE_DEBUG=1); requests can still opt in
+        self.debug_mode = env_flag("SNAPGRADE_DEBUG")
+
+    def process_image(self, image: np.ndarray, correct_answers: AnswerKey,
+                      template_id: str = "standard_25", student_id: Optional[str] = None,
+                      debug: Optional[bool] = None) -> Union[ProcessingResult, ErrorResult]:
+        """
+        Read a sheet and grade it
+
+        Args:
+            image: OpenCV image (BGR or grayscale)
+            correct_answers: List of correct answers, or one per exam version
+            template_id: Template configuration to use
+            student_id: Optional student identifier (default: the ID bubbled on the sheet)
+            debug: Force debug logging on/off for this sheet (default: the
+                deployment's debug_mode, otherwise sampled)
+
+        Returns:
+            ProcessingResult with detected answers and scoring
+        """
+        detection = self.detect(image, template_id, debug)
+        if isinstance(detection, ErrorResult):
+            return detection
+
+        return grade_detection(detection, correct_answers, student_id)
+
+    def detect(self, image: np.ndarray, template_id: str = "standard_25",
+               debug: Optional[bool] = None) -> Union[SheetDetection, ErrorResult]:
+        """
+        Run the vision pipeline only: read the marked answers off a sheet
+
+        The result doesn't depend on any answer key, so it can be cached and
+        graded again later (see grading.grade_detection).
+
+        Args:
+            image: OpenCV image (BGR or grayscale)
+            template_id: Template configuration to use
+            debug: Force debug logging on/off for this sheet (default: the
+                deployment's debug_mode, otherwise sampled)
+
+        Returns:
+            SheetDetection, or ErrorResult if the sheet couldn't be read
+        """
+        # An explicit request value wins over the deployment's SNAPGRADE_DEBUG
+        if debug is None and self.debug_mode:
+            debug = True
+        with debug_scope(debug), sheet_scope(self.name, template_id):
+            return self._run(image, template_id)
+
+    def warm_up(self):
+        """
+        Run every stage once on an unmarked page of each template this pipeline reads
+
+        Worker processes call this at startup (see worker_pool._init_worker), so
+        one-off setup (compiled grids, preprocessing scratch buffers, OpenCV's
+        thread pool) isn't paid by their first sheet, inside its timeout.
+        """
+        for template_id, template in TEMPLATES.items():
+            if pipeline_for(template_id) is not self:
+                continue
+            width, height = canonical_size(template["grid"])
+            page = np.full((height, width), 255, dtype=np.uint8)
+            circles = [compile_layout(template["grid"], width, height)]
+            circles += compile_fields(template["grid"], width, height).values()
+            for x, y, radius in np.concatenate([c.reshape(-1, 3) for c in circles]).tolist():
+                cv2.circle(page, (x, y), radius, 0, max(1, radius // 6))
+            assess_quality(page)
+            registered_image, _ = self.stages.register(page, template)
+            binary_image = self.stages.preprocess(registered_image)
+            bubbles = self.stages.detect(binary_image, template)
+            self.stages.decide(self.stages.measure(binary_image, bubbles, template), bubbles, template)
+
+    def _run(self, image: np.ndarray, template_id: str) -> Union[SheetDetection, ErrorResult]:
+        timer = StageTimer(observer=observe_stage)
+
+        try:
+            template = TEMPLATES.get(template_id)
+            if not template:
+                raise ValueError(f"Unknown template: {template_id}")
+
+            # Reject uploads too dark or blurry to grade before any detection
+            gray = to_grayscale(image)
+            with timer.stage("quality"):
+                quality = assess_quality(gray)
+            rejection = quality_gate(quality)
+            if rejection is not None:
+                record_sheet("rejected", timer.elapsed)
+                log.info(
+                    "Sheet rejected",
+                    processor=self.name, template=template_id, reason=rejection.error_code,
+                    brightness=round(quality.brightness, 1), sharpness=round(quality.sharpness, 1)
+                )
+                return rejection
+
+            with timer.stage("register"):
+                registered_image, skew_angle = self.stages.register(gray, template)
+            with timer.stage("preprocess"):
+                binary_image = self.stages.preprocess(registered_image)
+            with timer.stage("detect"):
+                bubbles = self.stages.detect(binary_image, template)
+            with timer.stage("measure"):
+                measurement = self.stages.measure(binary_image, bubbles, template)
+            with timer.stage("decide"):
+                decision = self.stages.decide(measurement, bubbles, template)
+            log.debug("Student answers detected: %s", decision.answers)
+
+            detection_time = timer.elapsed
+            record_sheet("success", detection_time)
+            log.info(
+                "Sheet processed",
+                processor=self.name, template=template_id, bubbles=len(bubbles),
+                total_ms=round(detection_time * 1000, 1), **timer.fields()
+            )
+
+            return SheetDetection(
+                template_id=template_id,
+                student_answers=decision.answers,
+                # Only questions with every choice found report their fills
+                fill_ratios=[
+                    [] if np.isnan(row).any() else np.round(row, 4).tolist() for row in measurement.answers
+                ],
+                confidence_scores=decision.confidence,
+                answer_flags=decision.flags,
+                fields={name: _field_reading(field) for name, field in decision.fields.items()},
+                image_quality=describe_quality(quality, skew_angle),
+                bubbles_detected=len(bubbles),
+                detection_time=detection_time
+            )
+
+        except Exception as e:
+            record_sheet("error", timer.elapsed)
+            log.exception("Error processing image", processor=self.name, template=template_id)
+            return ErrorResult(
+                error=str(e),
+                error_code="PROCESSING_FAILED"
+            )
+
+
+def _field_reading(decision: stages.Decision) -> FieldReading:
+    # A field's value is one mark per position, in order. A position left blank
+    # or marked twice leaves the whole field unread (None), so a partly bubbled
+    # ID is never taken for another student's; grading lists it for review
+    unclear = any(
+        not answer or stages.FLAG_MULTIPLE in flags for answer, flags in zip(decision.answers, decision.flags)
+    )
+    return FieldReading(
+        value=None if unclear else "".join(decision.answers),
+        confidence=round(float(np.prod(decision.confidence)), 4),
+        flags=decision.flags
+    )
+
+
+# Named pipelines; templates pick one by name
+PIPELINES: Dict[str, SheetPipeline] = {}
+
+
+def register_pipeline(name: str, pipeline_stages: PipelineStages) -> SheetPipeline:
+    """
+    Add (or replace) a named pipeline that templates and benchmarks can select
+    """
+    PIPELINES[name] = SheetPipeline(name, pipeline_stages)
+    return PIPELINES[name]
+
+
+register_pipeline("standard", PipelineStages(
+    register=stages.register_to_template,
+    preprocess=stages.threshold_and_clean,
+    detect=stages.detect_circles,
+    measure=stages.measure_layout,
+    decide=stages.decide_by_contrast
+))
+
+register_pipeline("improved", PipelineStages(
+    register=stages.register_to_template,
+    preprocess=stages.threshold_image,
+    detect=stages.detect_circles_and_contours,
+    measure=stages.measure_layout,
+    decide=stages.decide_by_contrast
+))
+
+
+for _template_id, _name in PIPELINE_OVERRIDES.items():
+    if _name not in PIPELINES:
+        raise ValueError(f"SNAPGRADE_PIPELINES: unknown pipeline {_name!r} for {_template_id}")
+
+
+def pipeline_for(template_id: str) -> SheetPipeline:
+    """
+    Get the pipeline that reads a template (SNAPGRADE_PIPELINES overrides the registry)
+    """
+    template = TEMPLATES.get(template_id, {})
+    name = PIPELINE_OVERRIDES.get(template_id, template.get("pipeline", DEFAULT_PIPELINE))
+    return PIPELINES[name]
+
+
+def list_templates() -> List[BubbleSheetTemplate]:
+    """
+    Describe every registered template for clients
+    """
+    return [
+        BubbleSheetTemplate(
+            id=template_id,
+            name=template["name"],
+            questions=template["questions"],
+            choices=template["choices"],
+            description=template["description"],
+            fields={name: field["values"] for name, field in template.get("fields", {}).items()}
+        )
+        for template_id, template in TEMPLATES.items()
+    ]
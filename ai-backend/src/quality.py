@@ -0,0 +1,118 @@
+import cv2
+import numpy as np
+import os
+from typing import NamedTuple, Optional
+
+from .models import ErrorResult, ImageQuality
+
+# Quality is measured on the first pyramid level no longer than this, which
+# is cheap to build and keeps sensor noise out of the blur estimate
+QUALITY_MAX_SIDE = 800
+
+# Laplacian variance (at the quality level) that counts as fully sharp
+SHARPNESS_NORMALIZER = 500.0
+
+# Uploads darker or blurrier than this are rejected before any detection runs
+MIN_BRIGHTNESS = float(os.getenv("SNAPGRADE_MIN_BRIGHTNESS", 20))
+MIN_SHARPNESS = float(os.getenv("SNAPGRADE_MIN_SHARPNESS", 6))
+
+
+class QualityReport(NamedTuple):
+    width: int              # Size of the image as uploaded (after decoding)
+    height: int
+    brightness: float       # Mean gray level, 0-255
+    sharpness: float        # Laplacian variance on the reduced pyramid level
+
+
+def to_grayscale(image: np.ndarray) -> np.ndarray:
+    """
+    Get a grayscale view of an image, converting only if it is color
+    """
+    if len(image.shape) == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+
+def pyramid_level(gray: np.ndarray, max_side: int = QUALITY_MAX_SIDE) -> np.ndarray:
+    """
+    Halve an image with pyrDown until its longest side is at most max_side
+    """
+    level = gray
+    while max(level.shape[:2]) > max_side:
+        level = cv2.pyrDown(level)
+    return level
+
+
+def assess_quality(gray: np.ndarray) -> QualityReport:
+    """
+    Measure brightness and sharpness of an upload on a reduced pyramid level
+
+    The Laplacian is taken in int16 (exact for 8-bit input) and reduced with
+    meanStdDev, so no full-size float frame is ever allocated.
+
+    Args:
+        gray: The grayscale image the pipeline already decoded
+
+    Returns:
+        QualityReport for the image
+    """
+    height, width = gray.shape[:2]
+    level = pyramid_level(gray)
+
+    brightness = cv2.mean(level)[0]
+    _, stddev = cv2.meanStdDev(cv2.Laplacian(level, cv2.CV_16S))
+
+    return QualityReport(
+        width=width,
+        height=height,
+        brightness=float(brightness),
+        sharpness=float(stddev[0, 0]) ** 2
+    )
+
+
+def quality_gate(report: QualityReport) -> Optional[ErrorResult]:
+    """
+    Decide whether an upload is too poor to grade at all
+
+    Returns:
+        ErrorResult to send back instead of grading, or None if the image is usable
+    """
+    if report.brightness < MIN_BRIGHTNESS:
+        return ErrorResult(
+            error=f"Image is too dark to grade (mean brightness {report.brightness:.0f}/255). "
+                  "Retake the photo in better light.",
+            error_code="IMAGE_TOO_DARK"
+        )
+
+    if report.sharpness < MIN_SHARPNESS:
+        return ErrorResult(
+            error="Image is too blurry to grade. Hold the camera steady and retake the photo.",
+            error_code="IMAGE_TOO_BLURRY"
+        )
+
+    return None
+
+
+def describe_quality(report: QualityReport, skew_angle: float = 0.0) -> ImageQuality:
+    """
+    Summarize a quality report for the API response
+
+    Analyzes resolution, lighting, skew, and blur
+    """
+    resolution = "Good" if report.width > 800 and report.height > 600 else "Poor"
+
+    if report.brightness > 200:
+        lighting = "Too Bright"
+    elif report.brightness < 50:
+        lighting = "Too Dark"
+    else:
+        lighting = "Good"
+
+    blur_score = min(report.sharpness / SHARPNESS_NORMALIZER, 1.0)
+
+    return ImageQuality(
+        resolution=resolution,
+        lighting=lighting,
+        skew_angle=skew_angle,
+        blur_score=round(blur_score, 2)
+    )
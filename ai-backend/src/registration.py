@@ -0,0 +1,185 @@
+import cv2
+import math
+import numpy as np
+from itertools import combinations
+from typing import NamedTuple, Optional
+
+from .templates import (
+    FIDUCIAL_CENTERS_MM, PAGE_HEIGHT_MM, PAGE_WIDTH_MM, canonical_size
+)
+
+# Longest side of the copy that markers and page edges are searched on
+DETECTION_MAX_SIDE = 800
+
+# Number of largest marker candidates considered when picking the four corners
+MAX_FIDUCIAL_CANDIDATES = 12
+
+
+class Registration(NamedTuple):
+    image: np.ndarray        # Page warped to the template's canonical size
+    homography: np.ndarray   # 3x3 transform from original to canonical pixels
+    skew_angle: float        # Rotation of the page's top edge in degrees
+    method: str              # "fiducials" or "page_edges"
+
+
+def _order_corners(points: np.ndarray) -> np.ndarray:
+    """
+    Order four points as top-left, top-right, bottom-right, bottom-left
+    """
+    center = points.mean(axis=0)
+    angles = np.arctan2(points[:, 1] - center[1], points[:, 0] - center[0])
+    ordered = points[np.argsort(angles)]  # clockwise in image coordinates, starting left
+
+    # Rotate so the corner closest to the origin comes first
+    start = int(np.argmin(ordered.sum(axis=1)))
+    return np.roll(ordered, -start, axis=0)
+
+
+def _quad_area(points: np.ndarray) -> float:
+    return float(cv2.contourArea(points.astype(np.float32)))
+
+
+def _has_page_proportions(corners: np.ndarray, expected_ratio: float, tolerance: float = 0.35) -> bool:
+    """
+    Check that an ordered quad is roughly as tall relative to its width as expected
+    """
+    width = (np.linalg.norm(corners[1] - corners[0]) + np.linalg.norm(corners[2] - corners[3])) / 2
+    height = (np.linalg.norm(corners[3] - corners[0]) + np.linalg.norm(corners[2] - corners[1])) / 2
+    if width == 0:
+        return False
+    return abs(height / width - expected_ratio) <= expected_ratio * tolerance
+
+
+def find_fiducials(gray: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Find the four filled corner markers on a (downscaled) grayscale page
+
+    Candidates are solid, round blobs without holes (so empty bubble outlines
+    are ignored); of those, the four similar-sized blobs spanning the
+    largest quad are the corner markers.
+
+    Returns:
+        (4, 2) float32 array of marker centers ordered TL, TR, BR, BL, or None
+    """
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    contours, hierarchy = cv2.findContours(binary, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    if hierarchy is None:
+        return None
+
+    min_area = gray.shape[0] * gray.shape[1] * 1e-5
+    candidates = []
+    for contour, (_, _, first_child, parent) in zip(contours, hierarchy[0]):
+        if parent != -1 or first_child != -1:
+            continue  # holes and rings (empty bubbles, letters with counters)
+
+        area = cv2.contourArea(contour)
+        perimeter = cv2.arcLength(contour, True)
+        if area < min_area or perimeter == 0:
+            continue
+
+        circularity = 4 * math.pi * area / (perimeter * perimeter)
+        hull_area = cv2.contourArea(cv2.convexHull(contour))
+        if circularity < 0.75 or hull_area == 0 or area / hull_area < 0.9:
+            continue
+
+        M = cv2.moments(contour)
+        candidates.append((area, M["m10"] / M["m00"], M["m01"] / M["m00"]))
+
+    candidates = sorted(candidates, reverse=True)[:MAX_FIDUCIAL_CANDIDATES]
+    expected_ratio = (FIDUCIAL_CENTERS_MM[3][1] - FIDUCIAL_CENTERS_MM[0][1]) / \
+                     (FIDUCIAL_CENTERS_MM[1][0] - FIDUCIAL_CENTERS_MM[0][0])
+
+    best, best_area = None, 0.0
+    for group in combinations(candidates, 4):
+        areas = [c[0] for c in group]
+        if max(areas) > 2.5 * min(areas):
+            continue  # markers are all printed the same size
+
+        corners = _order_corners(np.array([c[1:] for c in group], dtype=np.float32))
+        quad_area = _quad_area(corners)
+        if quad_area > best_area and _has_page_proportions(corners, expected_ratio):
+            best, best_area = corners, quad_area
+
+    # The markers span most of the page, so a tiny quad is a false match
+    if best is None or best_area < 0.1 * gray.shape[0] * gray.shape[1]:
+        return None
+    return best
+
+
+def find_page_corners(gray: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Find the outline of the paper against the background on a (downscaled) grayscale image
+
+    Returns:
+        (4, 2) float32 array of page corners ordered TL, TR, BR, BL, or None
+    """
+    edges = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 50, 150)
+    edges = cv2.dilate(edges, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    min_area = 0.2 * gray.shape[0] * gray.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(approx) == 4 and cv2.isContourConvex(approx) and cv2.contourArea(approx) >= min_area:
+            corners = _order_corners(approx.reshape(4, 2).astype(np.float32))
+            if _has_page_proportions(corners, PAGE_HEIGHT_MM / PAGE_WIDTH_MM):
+                return corners
+
+    return None
+
+
+def register_page(image: np.ndarray, layout_id: str) -> Optional[Registration]:
+    """
+    Register a photographed or scanned page to a template's canonical frame
+
+    Corner markers (or, failing that, the paper edges) are located on a
+    downscaled copy, and the full-resolution image is warped once straight
+    to the template's canonical size, so later stages cost the same no
+    matter how large the input is.
+
+    Args:
+        image: Original image (BGR or grayscale)
+        layout_id: Key into TEMPLATE_LAYOUTS
+
+    Returns:
+        Registration result, or None if neither markers nor page edges were found
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
+
+    height, width = gray.shape[:2]
+    scale = min(DETECTION_MAX_SIDE / max(height, width), 1.0)
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+
+    canonical_width, canonical_height = canonical_size(layout_id)
+    px_per_mm = canonical_width / PAGE_WIDTH_MM
+
+    corners = find_fiducials(small)
+    if corners is not None:
+        method = "fiducials"
+        targets = np.array(FIDUCIAL_CENTERS_MM, dtype=np.float32) * px_per_mm
+    else:
+        corners = find_page_corners(small)
+        if corners is None:
+            return None
+        method = "page_edges"
+        targets = np.array(
+            [(0, 0), (canonical_width, 0), (canonical_width, canonical_height), (0, canonical_height)],
+            dtype=np.float32
+        )
+
+    source = corners / scale
+    homography = cv2.getPerspectiveTransform(source, targets)
+    warped = cv2.warpPerspective(
+        gray, homography, (canonical_width, canonical_height),
+        flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE
+    )
+
+    top_edge = source[1] - source[0]
+    skew_angle = math.degrees(math.atan2(top_edge[1], top_edge[0]))
+
+    return Registration(
+        image=warped,
+        homography=homography,
+        skew_angle=round(skew_angle, 2),
+        method=method
+    )
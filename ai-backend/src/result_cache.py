@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from .logging_utils import PipelineLogger
+from .metrics import CACHE_LOOKUPS_TOTAL
+
+log = PipelineLogger("cache")
+
+# Bump when a pipeline change makes earlier detections stale, so entries
+# written to the disk tier by an older release are never served
+CACHE_VERSION = 3
+
+
+class DetectionCache:
+    """
+    Content-addressed cache of sheet detections
+
+    Entries are keyed by the hash of the uploaded bytes plus the template
+    (and page), and hold what the vision pipeline read off the sheet - not
+    a score - so a resubmitted photo, or the same photo against a corrected
+    answer key, only needs grading again.
+
+    The memory tier is an LRU bounded by the size of the stored entries.
+    With a directory configured, entries are also written to disk, which
+    survives restarts and is shared by every API process on the host; the
+    disk tier is bounded the same way, evicting the least recently used file.
+
+    Configuration comes from the environment unless given explicitly:
+        SNAPGRADE_CACHE_MB       memory tier size (default: 64, 0 disables the cache)
+        SNAPGRADE_CACHE_DIR      directory for the disk tier (default: no disk tier)
+        SNAPGRADE_CACHE_DISK_MB  disk tier size (default: 1024)
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, disk_dir: Optional[str] = None,
+                 disk_max_bytes: Optional[int] = None):
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv("SNAPGRADE_CACHE_MB", 64)) * 1024 * 1024)
+        if disk_dir is None:
+            disk_dir = os.getenv("SNAPGRADE_CACHE_DIR") or None
+        if disk_max_bytes is None:
+            disk_max_bytes = int(float(os.getenv("SNAPGRADE_CACHE_DISK_MB", 1024)) * 1024 * 1024)
+
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._disk_size = 0
+        self._lock = threading.Lock()
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_size = sum(
+                entry.stat().st_size for entry in os.scandir(self.disk_dir)
+                if entry.name.endswith(".json")
+            )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or bool(self.disk_dir)
+
+    @staticmethod
+    def digest(image_data: bytes) -> str:
+        """
+        Content hash of an upload, as used in its sheets' keys
+        """
+        return hashlib.sha256(image_data).hexdigest()
+
+    @staticmethod
+    def key(image_data: bytes, template_id: str, page: int = 0, pipeline: str = "",
+            digest: Optional[str] = None) -> str:
+        """
+        Build the cache key for one sheet of an upload
+
+        The pipeline that read the sheet is part of the key, so switching a
+        template to another pipeline never serves the old one's detections.
+        Pass the upload's digest when it is already known (e.g. once for all
+        the pages of a multi-page upload) to skip hashing image_data again.
+        """
+        digest = digest or DetectionCache.digest(image_data)
+        return f"v{CACHE_VERSION}-{pipeline}-{template_id}-{page}-{digest}"
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Look up a detection, promoting disk hits into memory
+
+        Returns:
+            The stored SheetDetection as a dict, or None
+        """
+        payload = self._recall(key)
+        if payload is None and self.disk_dir:
+            payload = self._promote(key)
+        return self._loaded(payload)
+
+    def put(self, key: str, detection: dict):
+        """
+        Store a detection (a SheetDetection as a dict)
+        """
+        payload = json.dumps(detection, separators=(",", ":")).encode()
+        self._remember(key, payload)
+        if self.disk_dir:
+            self._write_disk(key, payload)
+
+    async def lookup(self, key: str) -> Optional[dict]:
+        """
+        get() for the event loop: the memory tier is looked up inline, the
+        disk tier (file reads) in a thread
+        """
+        payload = self._recall(key)
+        if payload is None and self.disk_dir:
+            payload = await asyncio.to_thread(self._promote, key)
+        return self._loaded(payload)
+
+    async def store(self, key: str, detection: dict):
+        """
+        put() for the event loop: the memory tier is filled inline, the disk
+        tier (file write and eviction) in a thread
+        """
+        payload = json.dumps(detection, separators=(",", ":")).encode()
+        self._remember(key, payload)
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, payload)
+
+    def _recall(self, key: str) -> Optional[bytes]:
+        # A memory tier hit, marked as recently used
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+        return payload
+
+    def _promote(self, key: str) -> Optional[bytes]:
+        # A disk tier hit, copied into the memory tier
+        payload = self._read_disk(key)
+        if payload is not None:
+            self._remember(key, payload)
+        return payload
+
+    def _loaded(self, payload: Optional[bytes]) -> Optional[dict]:
+        CACHE_LOOKUPS_TOTAL.inc(result="hit" if payload is not None else "miss")
+        return json.loads(payload) if payload is not None else None
+
+    def _remember(self, key: str, payload: bytes):
+        if len(payload) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+
+            self._entries[key] = payload
+            self._size += len(payload)
+
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                payload = f.read()
+            os.utime(path)  # Mark as recently used for disk eviction
+            return payload
+        except OSError:
+            return None
+
+    def _write_disk(self, key: str, payload: bytes):
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+
+        try:
+            # Write then rename so readers never see a partial entry
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(payload)
+            os.replace(temp_path, path)
+        except OSError:
+            log.exception("Could not write detection to the disk cache", path=path)
+            return
+
+        with self._lock:
+            self._disk_size += len(payload)
+            over_budget = self._disk_size > self.disk_max_bytes
+
+        if over_budget:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # Oldest access first, down to 90% of the budget so this doesn't run on every write
+        entries = sorted(
+            (entry for entry in os.scandir(self.disk_dir) if entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        total = sum(entry.stat().st_size for entry in entries)
+        target = self.disk_max_bytes * 0.9
+
+        for entry in entries:
+            if total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+            except OSError:
+                continue
+
+        with self._lock:
+            self._disk_size = total
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+
+from .grading import VERSION_FIELD, encode_answers
+
+# Scan ids are looked up this many per SELECT (SQLite limits bound variables)
+QUERY_CHUNK = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    scan_id TEXT PRIMARY KEY,
+    exam_id TEXT,
+    template_id TEXT NOT NULL,
+    student_id TEXT,
+    answer_codes BLOB NOT NULL,
+    detection TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scans_exam ON scans (exam_id);
+"""
+
+
+class ScanStore:
+    """
+    SQLite store of sheet detections, kept apart from any score
+
+    Every graded sheet is saved under a scan id with what the pipeline
+    read off it, so the sheets can be scored again against a corrected
+    answer key (see /regrade) without uploading the images again. Answers
+    are also stored pre-encoded as int8 (see grading.encode_answers), so
+    loading thousands of scans for a regrade needs no per-answer parsing.
+
+    The database is opened on first use at SNAPGRADE_SCAN_DB (default:
+    data/scans.db); set it to an empty string to turn persistence off.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = os.getenv("SNAPGRADE_SCAN_DB", "data/scans.db") if path is None else path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    @staticmethod
+    def scan_id(exam_id: Optional[str], template_id: str, upload_digest: str, page: int = 0) -> str:
+        """
+        Id of one page of an upload graded for an exam
+
+        The same sheet graded again under the same exam (a retry, or a batch
+        sent twice) gets the same id, so it replaces its earlier scan instead
+        of counting as another student in /regrade and /item-analysis.
+        """
+        source = json.dumps([exam_id, template_id, upload_digest, page])
+        return hashlib.sha256(source.encode()).hexdigest()[:32]
+
+    def save(self, detection: dict, student_id: Optional[str] = None,
+             exam_id: Optional[str] = None, upload_digest: Optional[str] = None,
+             page: int = 0) -> str:
+        """
+        Persist a detection (a SheetDetection as a dict)
+
+        Args:
+            detection: What the pipeline read off the sheet
+            student_id: Student the sheet is filed under
+            exam_id: Exam the sheet is filed under
+            upload_digest: Content hash of the upload the sheet came from
+                (see DetectionCache.digest); a sheet saved again under the same
+                exam replaces its earlier scan. Without it, every save is a new scan
+            page: Page of the upload the sheet is on
+
+        Returns:
+            The scan id
+        """
+        if upload_digest is None:
+            scan_id = uuid.uuid4().hex
+        else:
+            scan_id = ScanStore.scan_id(exam_id, detection["template_id"], upload_digest, page)
+        with self._lock:
+            connection = self._connect()
+            # A resubmitted sheet keeps its first created_at, and so its place in an exam
+            connection.execute(
+                "INSERT INTO scans VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (scan_id) DO UPDATE SET student_id = excluded.student_id, "
+                "answer_codes = excluded.answer_codes, detection = excluded.detection",
+                (
+                    scan_id, exam_id, detection["template_id"], student_id,
+                    encode_answers([detection["student_answers"]])[0].tobytes(),
+                    json.dumps(detection, separators=(",", ":")),
+                    datetime.now().isoformat()
+                )
+            )
+            connection.commit()
+        return scan_id
+
+    def get(self, scan_id: str) -> Optional[dict]:
+        """
+        Load one scan with its full detection
+        """
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT scan_id, exam_id, template_id, student_id, detection, created_at "
+                "FROM scans WHERE scan_id = ?",
+                (scan_id,)
+            ).fetchone()
+
+        if row is None:
+            return None
+        return {
+            "scan_id": row[0],
+            "exam_id": row[1],
+            "template_id": row[2],
+            "student_id": row[3],
+            "detection": json.loads(row[4]),
+            "created_at": row[5]
+        }
+
+    def load_answers(self, scan_ids: Optional[List[str]] = None,
+                     exam_id: Optional[str] = None) -> List[dict]:
+        """
+        Load the detected answers of many scans, for regrading
+
+        Args:
+            scan_ids: Scans to load
+            exam_id: Load every scan saved under this exam (combined with scan_ids)
+
+        Returns:
+            {"scan_id", "student_id", "template_id", "version", "answer_codes"} per
+            scan found, answer_codes being the encoded int8 answers and version
+            the exam version bubbled on the sheet (None if unread or not printed)
+        """
+        # The version is read out of the stored detection, so scans saved
+        # before versions were used need no migration
+        columns = (
+            "SELECT scan_id, student_id, template_id, json_extract(detection, ?), answer_codes FROM scans"
+        )
+        version_path = f"$.fields.{VERSION_FIELD}.value"
+        rows = []
+        with self._lock:
+            connection = self._connect()
+            if exam_id is not None:
+                rows.extend(connection.execute(
+                    f"{columns} WHERE exam_id = ? ORDER BY created_at", (version_path, exam_id)
+                ))
+            ids = list(dict.fromkeys(scan_ids or []))
+            for start in range(0, len(ids), QUERY_CHUNK):
+                chunk = ids[start:start + QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows.extend(connection.execute(
+                    f"{columns} WHERE scan_id IN ({placeholders})", [version_path] + chunk
+                ))
+
+        scans = {}
+        for scan_id, student_id, template_id, version, answers in rows:
+            scans[scan_id] = {
+                "scan_id": scan_id,
+                "student_id": student_id,
+                "template_id": template_id,
+                "version": version,
+                "answer_codes": np.frombuffer(answers, dtype=np.int8)
+            }
+        return list(scans.values())
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,491 @@
+import cv2
+import numpy as np
+from typing import Dict, List, NamedTuple, Tuple
+import math
+import threading
+
+from .fill_measurement import bubbles_to_circles, measure_fill_ratios
+from .templates import locate_grid_bubbles
+from .bubble_search import (
+    block_tiles, find_answer_blocks, hough_in_blocks, map_tiles, merge_candidates, tile_crop
+)
+from .layout_inference import infer_layout
+from .registration import register_page
+from .logging_utils import PipelineLogger
+from .metrics import record_fallback, timed_stage
+
+log = PipelineLogger("stages")
+
+# Share of each bubble's radius that is measured: the interior, clear of
+# the printed outline wherever the circle was fitted
+MEASURED_RADIUS = 0.7
+
+# Questions on either side of a question whose bubbles give its local
+# background (the fill an unmarked bubble measures there)
+BACKGROUND_WINDOW = 3
+
+# Smallest spread assumed for unmarked bubbles' fills, so a spotless
+# synthetic background doesn't make every reading look certain
+MIN_FILL_NOISE = 0.02
+
+# A question's darkest bubble this many noise spreads above the background
+# is a mark, and counts towards the sheet's typical mark contrast
+MARK_NOISE_SPREADS = 6.0
+
+# Typical mark contrast (fill above the background) for sheets with no marks to measure it on
+DEFAULT_MARK_CONTRAST = 0.5
+
+# Bubbles darker than the background by this share of the typical mark
+# contrast are marked; by ERASED_LEVEL, they hold ink that isn't a full mark
+MARKED_LEVEL = 0.5
+ERASED_LEVEL = 0.2
+
+# Share of questions students leave blank. A question whose found choices
+# are all unmarked is only likely blank if this outweighs the chance that
+# a choice the detector missed holds the mark (filled bubbles lose the
+# outline edge the detectors look for)
+BLANK_PRIOR = 0.05
+
+# Flags a question can be given besides its answer
+FLAG_BLANK = "blank"          # No choice marked
+FLAG_MULTIPLE = "multiple"    # More than one choice marked; the darkest is the answer
+FLAG_ERASED = "erased"        # A choice holds partial ink (an erased or very faint mark)
+
+
+class Measurement(NamedTuple):
+    answers: np.ndarray             # Fill per question and choice, NaN where no bubble was found
+    fields: Dict[str, np.ndarray]   # Fill per position and value of each of the template's fields
+
+
+class Decision(NamedTuple):
+    answers: List[str]              # Choice letter per question ("" when none)
+    confidence: List[float]         # Probability each answer was read right, 0-1
+    flags: List[List[str]]          # FLAG_* values per question
+    fields: Dict[str, "Decision"]   # The same, per position, for each of the template's fields
+
+
+# ---------------------------------------------------------------------------
+# register: (grayscale image, template) -> (page image, skew angle in degrees)
+# ---------------------------------------------------------------------------
+
+def register_to_template(image: np.ndarray, template: dict) -> Tuple[np.ndarray, float]:
+    """
+    Detect document boundaries and correct perspective distortion
+
+    The page is located by its corner markers (or paper edges) and warped
+    to the template's canonical resolution, so the bubble grid lands on
+    its compiled positions.
+
+    Returns:
+        Tuple of (registered image, skew angle in degrees); the image is
+        returned unchanged with a 0.0 angle if no page could be found
+    """
+    if not template.get("grid"):
+        return image, 0.0
+
+    registration = register_page(image, template["grid"])
+    if registration is None:
+        record_fallback("unregistered")
+        log.debug("Page not found, processing the full frame")
+        return image, 0.0
+
+    log.debug("Page registered by %s (skew %.1f deg)", registration.method, registration.skew_angle)
+    return registration.image, registration.skew_angle
+
+
+# ---------------------------------------------------------------------------
+# preprocess: page image -> binary image (non-zero = ink)
+# ---------------------------------------------------------------------------
+
+# Structuring element for threshold_and_clean's close and open, built once
+CLEAN_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+
+# Page sizes each thread keeps scratch buffers for: registered pages come in
+# one canonical size per layout, unregistered photos in any size
+SCRATCH_SHAPES = 4
+
+_scratch = threading.local()
+
+
+def _scratch_images(shape: Tuple[int, ...]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get this thread's two uint8 page buffers for a page shape, allocated on first use
+    """
+    buffers = getattr(_scratch, "buffers", None)
+    if buffers is None:
+        buffers = _scratch.buffers = {}
+    images = buffers.get(shape)
+    if images is None:
+        if len(buffers) >= SCRATCH_SHAPES:
+            buffers.pop(next(iter(buffers)))
+        images = buffers[shape] = (np.empty(shape, np.uint8), np.empty(shape, np.uint8))
+    return images
+
+
+def threshold_image(image: np.ndarray) -> np.ndarray:
+    """
+    Blur and adaptively threshold the page, so ink is non-zero
+
+    Preprocessing writes into the calling thread's scratch buffers instead
+    of allocating a page per step, so the returned image is only valid
+    until the same thread preprocesses its next page.
+    """
+    blurred, binary = _scratch_images(image.shape)
+    cv2.GaussianBlur(image, (5, 5), 0, dst=blurred)
+    return cv2.adaptiveThreshold(
+        blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY_INV, 11, 2, dst=binary
+    )
+
+
+def threshold_and_clean(image: np.ndarray) -> np.ndarray:
+    """
+    Threshold the page, then close gaps and remove specks with morphology
+    """
+    binary = threshold_image(image)
+    cleaned, _ = _scratch_images(image.shape)  # The blur is no longer needed
+    cv2.morphologyEx(binary, cv2.MORPH_CLOSE, CLEAN_KERNEL, dst=cleaned)
+    return cv2.morphologyEx(cleaned, cv2.MORPH_OPEN, CLEAN_KERNEL, dst=binary)
+
+
+# ---------------------------------------------------------------------------
+# detect: (binary image, template) -> bubble dictionaries
+# ---------------------------------------------------------------------------
+
+def _grid_bubbles(image: np.ndarray, template: dict) -> List[dict]:
+    # Direct lookup of the template's known bubble positions (empty if the page doesn't match)
+    if not template.get("grid"):
+        return []
+
+    bubbles = locate_grid_bubbles(image, template["grid"])
+    if bubbles:
+        log.debug("Page matches %s layout: %d bubbles", template["grid"], len(bubbles))
+        return bubbles
+    record_fallback("grid_search")
+    log.debug("Page doesn't match the template layout, searching for bubbles")
+    return []
+
+
+def _hough_bubbles(image: np.ndarray, template: dict, min_dist: int) -> Tuple[List[dict], list]:
+    """
+    Search the image for bubbles with HoughCircles
+
+    Only the answer blocks are searched, with radii that fit their row
+    pitch; the whole frame is searched with the template's radii if no
+    block is found.
+
+    Returns:
+        (bubbles in HoughCircles' order, strongest first; answer blocks searched)
+    """
+    with timed_stage("hough"):
+        blocks = find_answer_blocks(image)
+        if blocks:
+            circles = hough_in_blocks(image, blocks)
+        else:
+            record_fallback("full_frame_hough")
+            circles = cv2.HoughCircles(
+                image,
+                cv2.HOUGH_GRADIENT,
+                dp=1,
+                minDist=min_dist,  # Minimum distance between circles
+                param1=50,         # Upper threshold for edge detection
+                param2=30,         # Accumulator threshold for center detection
+                minRadius=template["bubble_size_range"][0],
+                maxRadius=template["bubble_size_range"][1]
+            )
+            circles = circles[0] if circles is not None else None
+
+    if circles is None:
+        return [], blocks
+
+    circles = np.round(circles).astype("int")
+    log.debug("HoughCircles found: %d circles", len(circles))
+    return [
+        {"id": i, "x": int(x), "y": int(y), "radius": int(r), "method": "hough"}
+        for i, (x, y, r) in enumerate(circles)
+    ], blocks
+
+
+def _contour_bubbles(image: np.ndarray, radius_range: Tuple[int, int]) -> List[dict]:
+    """
+    Alternative bubble detection using contour analysis
+
+    Args:
+        image: Preprocessed binary image
+        radius_range: Smallest and largest bubble radius in pixels
+    """
+    bubbles = []
+
+    # Find contours
+    contours, _ = cv2.findContours(image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    min_area = 3.14 * (radius_range[0] ** 2)
+    max_area = 3.14 * (radius_range[1] ** 2)
+
+    for i, contour in enumerate(contours):
+        area = cv2.contourArea(contour)
+
+        if min_area <= area <= max_area:
+            # Check if contour is roughly circular
+            perimeter = cv2.arcLength(contour, True)
+            if perimeter > 0:
+                circularity = 4 * 3.14 * area / (perimeter * perimeter)
+
+                if circularity > 0.5:  # Reasonably circular
+                    # Get centroid
+                    M = cv2.moments(contour)
+                    if M["m00"] != 0:
+                        cx = int(M["m10"] / M["m00"])
+                        cy = int(M["m01"] / M["m00"])
+                        radius = int(math.sqrt(area / 3.14))
+
+                        bubbles.append({
+                            "id": len(bubbles),
+                            "x": cx,
+                            "y": cy,
+                            "radius": radius,
+                            "method": "contour",
+                            "area": area,
+                            "circularity": circularity
+                        })
+
+    return bubbles
+
+
+def _contour_bubbles_in_blocks(image: np.ndarray, blocks: list, radius_range: Tuple[int, int]) -> List[dict]:
+    """
+    Run the contour search on the answer blocks' tiles in parallel
+
+    Each tile keeps the bubbles centered in its own region, so bubbles
+    outside every block are left out and none is found twice.
+    """
+    def search(tile) -> List[dict]:
+        crop, x0, y0 = tile_crop(image, tile._replace(pad=radius_range[1]))
+        bubbles = [dict(bubble, x=bubble["x"] + x0, y=bubble["y"] + y0)
+                   for bubble in _contour_bubbles(crop, radius_range)]
+        return [bubble for bubble in bubbles
+                if tile.x <= bubble["x"] < tile.x + tile.width and tile.y <= bubble["y"] < tile.y + tile.height]
+
+    return [bubble for bubbles in map_tiles(search, block_tiles(blocks)) for bubble in bubbles]
+
+
+def detect_circles(image: np.ndarray, template: dict) -> List[dict]:
+    """
+    Look the bubbles up on the template grid, or search for them with HoughCircles
+
+    Returns:
+        List of bubble dictionaries with position and size info
+    """
+    bubbles = _grid_bubbles(image, template)
+    if bubbles:
+        return bubbles
+
+    bubbles, _ = _hough_bubbles(image, template, min_dist=20)
+    return bubbles
+
+
+def detect_circles_and_contours(image: np.ndarray, template: dict) -> List[dict]:
+    """
+    Like detect_circles, backed up by contour detection when HoughCircles finds too few
+
+    Contour bubbles are merged with the circles, so a bubble both methods
+    found is only counted once.
+    """
+    bubbles = _grid_bubbles(image, template)
+    if bubbles:
+        return bubbles
+
+    bubbles, blocks = _hough_bubbles(image, template, min_dist=30)
+
+    if len(bubbles) < template["questions"] * len(template["choices"]):
+        record_fallback("contour_backup")
+        if blocks:
+            radius_range = (min(block.radius_range[0] for block in blocks),
+                            max(block.radius_range[1] for block in blocks))
+        else:
+            radius_range = template["bubble_size_range"]
+        with timed_stage("contours"):
+            if blocks:
+                contour_bubbles = _contour_bubbles_in_blocks(image, blocks, radius_range)
+            else:
+                contour_bubbles = _contour_bubbles(image, radius_range)
+        log.debug("Contour detection found %d bubbles", len(contour_bubbles))
+        bubbles = merge_candidates([bubbles, contour_bubbles])
+
+    log.debug("Total bubbles detected: %d", len(bubbles))
+    return bubbles
+
+
+# ---------------------------------------------------------------------------
+# measure: (binary image, bubbles, template) -> Measurement of the answers and fields
+# ---------------------------------------------------------------------------
+
+def measure_layout(image: np.ndarray, bubbles: List[dict], template: dict) -> Measurement:
+    """
+    Place the bubbles on the template's questions and fields and measure how filled each is
+
+    Grid lookups already come in question order, followed by the template's
+    fields; anything else is placed by the layout its positions form (see
+    layout_inference.infer_layout), and leaves the fields unread.
+
+    Returns:
+        Measurement of the answers, shape (questions, choices), and of every
+        field, shape (positions, values); NaN where no bubble was found
+    """
+    n_choices = len(template["choices"])
+    fills = np.full((template["questions"], n_choices), np.nan)
+    fields = {
+        name: np.full((field["positions"], len(field["values"])), np.nan)
+        for name, field in template.get("fields", {}).items()
+    }
+    if not bubbles:
+        log.warning("No bubbles to analyze", template=template.get("grid"))
+        return Measurement(fills, fields)
+
+    if bubbles[0].get("method") == "grid":
+        answer_bubbles = [bubble for bubble in bubbles if "field" not in bubble]
+        slots = [answer_bubbles[i:i + n_choices] for i in range(0, len(answer_bubbles), n_choices)]
+        field_bubbles = [bubble for bubble in bubbles if bubble.get("field") in fields]
+    else:
+        slots = infer_layout(bubbles, template["questions"], n_choices)
+        field_bubbles = []
+
+    # Measure every placed bubble, answers and fields alike, in one pass
+    placed = [(q, c) for q, row in enumerate(slots) for c, bubble in enumerate(row) if bubble is not None]
+    if not placed and not field_bubbles:
+        return Measurement(fills, fields)
+
+    circles = bubbles_to_circles([slots[q][c] for q, c in placed] + field_bubbles)
+    circles[:, 2] = np.maximum(np.floor(circles[:, 2] * MEASURED_RADIUS), 1)
+    ratios = measure_fill_ratios(image, circles)
+
+    if placed:
+        questions, choices = zip(*placed)
+        fills[questions, choices] = ratios[:len(placed)]
+    for bubble, ratio in zip(field_bubbles, ratios[len(placed):].tolist()):
+        fields[bubble["field"]][bubble["position"], bubble["value"]] = ratio
+    return Measurement(fills, fields)
+
+
+# ---------------------------------------------------------------------------
+# decide: (Measurement, bubbles, template) -> Decision
+# ---------------------------------------------------------------------------
+
+def _normal_cdf(z: np.ndarray) -> np.ndarray:
+    return 0.5 * (1.0 + np.vectorize(math.erf, otypes=[float])(z / math.sqrt(2.0)))
+
+
+def _row_medians(values: np.ndarray) -> np.ndarray:
+    # Median of every row ignoring NaN (NaN for rows with none); np.nanmedian
+    # takes a slow masked path on arrays this small
+    ordered = np.sort(values, axis=1)  # NaN sorts last
+    count = (~np.isnan(values)).sum(axis=1)
+    low = np.take_along_axis(ordered, np.maximum((count - 1) // 2, 0)[:, None], axis=1)
+    high = np.take_along_axis(ordered, (count // 2)[:, None], axis=1)
+    return ((low + high) / 2)[:, 0]
+
+
+def _local_background(fills: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fill of an unmarked bubble around every question, and how much it varies
+
+    Most bubbles on a sheet are unmarked, so the median of the fills of
+    the neighbouring questions is an unmarked bubble's fill there, however
+    the lighting or the detector's circle fit shifts it across the page.
+
+    Returns:
+        (background fill, noise spread (scaled MAD, at least MIN_FILL_NOISE)) per question
+    """
+    padded = np.pad(fills, ((BACKGROUND_WINDOW, BACKGROUND_WINDOW), (0, 0)), constant_values=np.nan)
+    windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * BACKGROUND_WINDOW + 1, axis=0)
+    windows = windows.reshape(len(fills), -1)
+
+    background = _row_medians(windows)
+    spread = 1.4826 * _row_medians(np.abs(windows - background[:, None]))
+    return background, np.fmax(spread, MIN_FILL_NOISE)
+
+
+def decide_by_contrast(measurement: Measurement, bubbles: List[dict], template: dict) -> Decision:
+    """
+    Read each question from its whole fill vector, relative to the local background
+
+    Every fill is taken as its contrast over the local background, in
+    units of the sheet's typical mark (so light pencil and dark pen read
+    alike). A choice at MARKED_LEVEL or above is marked; the darkest
+    marked choice is the answer.
+
+    The confidence is the probability, given the background's noise
+    spread, that the darkest bubble really is above the marked level and
+    the second darkest really is below it (for a blank question: that the
+    darkest is below it), so it falls off as the margin between the two
+    closes. A question read from only some of its choices is scaled by
+    the chance that the choices the detector missed are unmarked (low for
+    a blank reading, see BLANK_PRIOR); questions with none found get no
+    confidence at all.
+
+    A template's other fields are read the same way, each position as a
+    question with the field's values as its choices.
+    """
+    fields = {
+        name: _decide_rows(measurement.fields[name], field["values"], name)
+        for name, field in template.get("fields", {}).items()
+    }
+    return _decide_rows(measurement.answers, template["choices"], "questions")._replace(fields=fields)
+
+
+def _decide_rows(fills: np.ndarray, choices: List[str], name: str) -> Decision:
+    # decide_by_contrast for one grid of rows (questions, or a field's positions) x choices
+    n_questions = len(fills)
+    answers = [""] * n_questions
+    confidence = [0.0] * n_questions
+    flags: List[List[str]] = [[] for _ in range(n_questions)]
+
+    found = ~np.isnan(fills)
+    readable = found.any(axis=1)
+    if not readable.any():
+        return Decision(answers, confidence, flags, {})
+
+    background, noise = _local_background(fills)
+    found, noise = found[readable], noise[readable]
+    contrast = np.where(found, fills[readable] - background[readable, None], -np.inf)
+
+    ordered = np.sort(contrast, axis=1)
+    darkest, second = ordered[:, -1], ordered[:, -2]
+    darkest_choice = np.argmax(contrast, axis=1)
+
+    # The sheet's typical mark, from the questions clearly marked
+    clear_marks = darkest[darkest > MARK_NOISE_SPREADS * noise]
+    mark_contrast = float(np.median(clear_marks)) if len(clear_marks) else DEFAULT_MARK_CONTRAST
+    marked_level = MARKED_LEVEL * mark_contrast
+
+    marked = contrast >= marked_level
+    erased = (contrast >= ERASED_LEVEL * mark_contrast) & ~marked
+    answered = marked.any(axis=1)
+
+    above = _normal_cdf((darkest - marked_level) / noise)
+    below_second = _normal_cdf((marked_level - second) / noise)
+    missing = (~found).sum(axis=1)
+    missing_unmarked = np.where(
+        answered,
+        (1.0 - 1.0 / len(choices)) ** missing,
+        BLANK_PRIOR / (BLANK_PRIOR + (1.0 - BLANK_PRIOR) * missing / len(choices))
+    )
+    question_confidence = np.where(answered, above * below_second, 1.0 - above) * missing_unmarked
+
+    for index, question in enumerate(np.flatnonzero(readable).tolist()):
+        if answered[index]:
+            answers[question] = choices[darkest_choice[index]]
+        confidence[question] = round(float(question_confidence[index]), 4)
+
+        n_marked = int(marked[index].sum())
+        if n_marked == 0:
+            flags[question].append(FLAG_BLANK)
+        elif n_marked > 1:
+            flags[question].append(FLAG_MULTIPLE)
+        if erased[index].any():
+            flags[question].append(FLAG_ERASED)
+
+    if log.debug_enabled():
+        log.debug("Typical mark contrast %.3f; flagged %s: %s", mark_contrast, name,
+                  {q + 1: f for q, f in enumerate(flags) if f})
+    return Decision(answers, confidence, flags, {})
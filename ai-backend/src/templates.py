@@ -0,0 +1,271 @@
+import numpy as np
+from functools import lru_cache
+from typing import Dict, List
+
+from .fill_measurement import measure_fill_counts, measure_fill_ratios
+
+# Printed sheet geometry (A4 portrait), in millimetres, as lib/bubblesheet.ts
+# prints it. Layouts below are normalized by these so they apply at any resolution.
+PAGE_WIDTH_MM = 210.0
+PAGE_HEIGHT_MM = 297.0
+
+# Filled corner alignment markers printed on every sheet (TL, TR, BR, BL)
+FIDUCIAL_CENTERS_MM = ((15.0, 15.0), (195.0, 15.0), (195.0, 282.0), (15.0, 282.0))
+FIDUCIAL_RADIUS_MM = 4.0
+
+# The generator's answer area: columns split the page between the margins,
+# separated by a gap, and the first question row sits at ANSWERS_TOP_MM.
+# Choice A is BUBBLE_OFFSET_MM from its column's left edge unless a layout
+# says otherwise (the generator's sheetLayouts table).
+SHEET_MARGIN_MM = 20.0
+ANSWERS_TOP_MM = 90.0
+BUBBLE_OFFSET_MM = 25.0
+COLUMN_GAP_MM = 15.0
+
+# Bubble grid geometry per printed layout, in normalized page coordinates:
+#   origin        center of question 1 / choice A as (x / page width, y / page height)
+#   choice_pitch  distance between choices of one question (fraction of page width)
+#   row_pitch     distance between consecutive questions (fraction of page height)
+#   column_pitch  distance between question columns (fraction of page width)
+#   radius        bubble radius (fraction of page width)
+#   canonical_width  page width in pixels that registered images are warped to; chosen so
+#                    bubbles come out ~10-11 px in radius, where the 11 px adaptive
+#                    threshold still separates filled interiors from empty outlines
+# Questions run down each column first, then continue in the next column.
+#
+# Layouts can also print other bubble fields (a student ID grid, a version code),
+# each a grid of positions (rows, read top to bottom) by values (across):
+#   positions, values  number of rows and of bubbles per row
+#   origin             center of the first position's first value
+#   value_pitch        distance between values of one position (fraction of page width)
+#   position_pitch     distance between positions (fraction of page height)
+#   radius             bubble radius (fraction of page width)
+# Fields sit well above the answers (more than 8 answer radii) so searching an
+# unaligned photo never links them into a question column. The generator
+# prints them in place of the student information box (its sheetFields table).
+
+
+def _printed_grid(questions: int, choices: int, columns: int, rows: int,
+                  choice_pitch: float, row_pitch: float, radius: float, canonical_width: int,
+                  bubble_offset: float = BUBBLE_OFFSET_MM, column_gap: float = COLUMN_GAP_MM) -> dict:
+    # A layout from the generator's sheetLayouts entry (lengths in mm), placed
+    # the way generateBubbleSheetPDF places it
+    column_width = (PAGE_WIDTH_MM - 2 * SHEET_MARGIN_MM - (columns - 1) * column_gap) / columns
+    return {
+        "questions": questions,
+        "choices": choices,
+        "columns": columns,
+        "rows": rows,
+        "origin": ((SHEET_MARGIN_MM + bubble_offset) / PAGE_WIDTH_MM, ANSWERS_TOP_MM / PAGE_HEIGHT_MM),
+        "choice_pitch": choice_pitch / PAGE_WIDTH_MM,
+        "row_pitch": row_pitch / PAGE_HEIGHT_MM,
+        "column_pitch": (column_width + column_gap) / PAGE_WIDTH_MM,
+        "radius": radius / PAGE_WIDTH_MM,
+        "canonical_width": canonical_width
+    }
+
+
+def _printed_field(positions: int, values: int, x: float, y: float, value_pitch: float,
+                   position_pitch: float, radius: float) -> dict:
+    # A field from the generator's sheetFields entry (lengths in mm)
+    return {
+        "positions": positions,
+        "values": values,
+        "origin": (x / PAGE_WIDTH_MM, y / PAGE_HEIGHT_MM),
+        "value_pitch": value_pitch / PAGE_WIDTH_MM,
+        "position_pitch": position_pitch / PAGE_HEIGHT_MM,
+        "radius": radius / PAGE_WIDTH_MM
+    }
+
+
+TEMPLATE_LAYOUTS = {
+    "simple_5": _printed_grid(
+        questions=5, choices=4, columns=1, rows=5,
+        choice_pitch=15, row_pitch=18, radius=3, canonical_width=800
+    ),
+    "standard_25": _printed_grid(
+        questions=25, choices=4, columns=2, rows=13,
+        choice_pitch=15, row_pitch=13, radius=3, canonical_width=800
+    ),
+    "standard_50": _printed_grid(
+        questions=50, choices=4, columns=2, rows=25,
+        choice_pitch=12, row_pitch=7, radius=2.5, canonical_width=950
+    ),
+    "standard_50_id": {
+        **_printed_grid(
+            questions=50, choices=4, columns=2, rows=25,
+            choice_pitch=12, row_pitch=7, radius=2.5, canonical_width=950
+        ),
+        "fields": {
+            "student_id": _printed_field(
+                positions=6, values=10, x=110, y=38, value_pitch=7, position_pitch=6, radius=2.2
+            ),
+            "version": _printed_field(
+                positions=1, values=4, x=25, y=38, value_pitch=12, position_pitch=0, radius=2.2
+            )
+        }
+    },
+    "extended_100": _printed_grid(
+        questions=100, choices=5, columns=3, rows=34,
+        choice_pitch=8, row_pitch=5, radius=2, canonical_width=1100,
+        bubble_offset=12, column_gap=4
+    )
+}
+
+# How much more ink the outline band must hold than the bubble center for the grid
+# to count as aligned (empty bubbles dominate every sheet, so this uses the median)
+RING_CONTRAST_THRESHOLD = 0.15
+
+
+def canonical_size(layout_id: str) -> tuple[int, int]:
+    """
+    Get the (width, height) in pixels that pages of a layout are registered to
+    """
+    width = TEMPLATE_LAYOUTS[layout_id]["canonical_width"]
+    return width, int(round(width * PAGE_HEIGHT_MM / PAGE_WIDTH_MM))
+
+
+def _pixel_circles(x: np.ndarray, y: np.ndarray, radius: float, width: int, height: int) -> np.ndarray:
+    # Normalized centers and radius -> read-only int64 (..., 3) array of (x, y, radius) in pixels
+    circles = np.empty(x.shape + (3,), dtype=np.int64)
+    circles[..., 0] = np.rint(x * width)
+    circles[..., 1] = np.rint(y * height)
+    circles[..., 2] = max(1, int(round(radius * width)))
+
+    circles.setflags(write=False)
+    return circles
+
+
+@lru_cache(maxsize=64)
+def compile_layout(layout_id: str, width: int, height: int) -> np.ndarray:
+    """
+    Compile a template layout into pixel coordinates for one page size
+
+    Args:
+        layout_id: Key into TEMPLATE_LAYOUTS
+        width: Page width in pixels
+        height: Page height in pixels
+
+    Returns:
+        Read-only int64 array of shape (questions, choices, 3) holding (x, y, radius)
+    """
+    layout = TEMPLATE_LAYOUTS[layout_id]
+    origin_x, origin_y = layout["origin"]
+
+    column, row = np.divmod(np.arange(layout["questions"]), layout["rows"])
+    choice = np.arange(layout["choices"])
+
+    x = (origin_x + column * layout["column_pitch"])[:, None] + choice * layout["choice_pitch"]
+    y = np.broadcast_to((origin_y + row * layout["row_pitch"])[:, None], x.shape)
+    return _pixel_circles(x, y, layout["radius"], width, height)
+
+
+@lru_cache(maxsize=64)
+def compile_fields(layout_id: str, width: int, height: int) -> Dict[str, np.ndarray]:
+    """
+    Compile a layout's other bubble fields into pixel coordinates for one page size
+
+    Returns:
+        Read-only int64 array of shape (positions, values, 3) holding (x, y, radius)
+        per field name (empty for layouts without fields)
+    """
+    fields = {}
+    for name, field in TEMPLATE_LAYOUTS[layout_id].get("fields", {}).items():
+        origin_x, origin_y = field["origin"]
+        value = np.arange(field["values"])
+        position = np.arange(field["positions"])
+
+        x = np.broadcast_to(origin_x + value * field["value_pitch"], (len(position), len(value)))
+        y = np.broadcast_to((origin_y + position * field["position_pitch"])[:, None], x.shape)
+        fields[name] = _pixel_circles(x, y, field["radius"], width, height)
+    return fields
+
+
+def measure_ring_ratios(image: np.ndarray, circles: np.ndarray,
+                        inner: float = 0.75, outer: float = 1.25) -> np.ndarray:
+    """
+    Measure how much of the band around each bubble outline is marked
+
+    Args:
+        image: Preprocessed binary image (non-zero = marked)
+        circles: (N, 3) array of (x, y, radius)
+        inner: Inner edge of the band as a fraction of the radius
+        outer: Outer edge of the band as a fraction of the radius
+
+    Returns:
+        float64 array of marked fractions of the band
+    """
+    circles = np.asarray(circles, dtype=np.int64).reshape(-1, 3)
+    inner_circles = circles.copy()
+    outer_circles = circles.copy()
+    inner_circles[:, 2] = np.floor(circles[:, 2] * inner)
+    outer_circles[:, 2] = np.ceil(circles[:, 2] * outer)
+
+    inner_filled, inner_total = measure_fill_counts(image, inner_circles)
+    outer_filled, outer_total = measure_fill_counts(image, outer_circles)
+
+    band_total = outer_total - inner_total
+    ratios = np.zeros(len(circles), dtype=np.float64)
+    np.divide(outer_filled - inner_filled, band_total, out=ratios, where=band_total > 0)
+    return ratios
+
+
+def locate_grid_bubbles(image: np.ndarray, layout_id: str) -> List[dict]:
+    """
+    Look up a template's bubbles at their known positions on a page-aligned image
+
+    The printed outlines are checked at the compiled positions (ink on the
+    outline band, not in the center); if the page doesn't line up with the
+    layout, no bubbles are returned so the caller can fall back to searching
+    the image. The layout's other fields are looked up with the answers and
+    follow them, marked with "field", "position" and "value".
+
+    Args:
+        image: Preprocessed binary image covering exactly the page
+        layout_id: Key into TEMPLATE_LAYOUTS
+
+    Returns:
+        Bubble dictionaries in question order, then choice order, then each
+        field's in position and value order (empty if not aligned)
+    """
+    height, width = image.shape[:2]
+    circles = compile_layout(layout_id, width, height)
+    n_questions, n_choices = circles.shape[:2]
+
+    flat = circles.reshape(-1, 3)
+    centers = flat.copy()
+    centers[:, 2] //= 2
+
+    ring_contrast = measure_ring_ratios(image, flat) - measure_fill_ratios(image, centers)
+    if np.median(ring_contrast) < RING_CONTRAST_THRESHOLD:
+        return []
+
+    bubbles = [
+        {
+            "id": i,
+            "x": int(x),
+            "y": int(y),
+            "radius": int(r),
+            "question": i // n_choices,
+            "choice": i % n_choices,
+            "method": "grid"
+        }
+        for i, (x, y, r) in enumerate(flat)
+    ]
+
+    for name, field in compile_fields(layout_id, width, height).items():
+        first, n_values = len(bubbles), field.shape[1]
+        bubbles.extend(
+            {
+                "id": first + i,
+                "x": int(x),
+                "y": int(y),
+                "radius": int(r),
+                "field": name,
+                "position": i // n_values,
+                "value": i % n_values,
+                "method": "grid"
+            }
+            for i, (x, y, r) in enumerate(field.reshape(-1, 3))
+        )
+    return bubbles
@@ -0,0 +1,166 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, Tuple, Union
+
+import numpy as np
+
+from . import bubble_search
+from .pipeline import PIPELINES, pipeline_for
+from .ingestion import ImageRejectedError, decode_image
+from .logging_utils import PipelineLogger, configure_logging
+from .metrics import REGISTRY, MetricsDelta, record_sheet, sheet_scope, timed_stage
+
+log = PipelineLogger("worker")
+
+
+class PoolSaturatedError(Exception):
+    """Raised when the grading pool already holds its maximum number of jobs"""
+
+
+def _init_worker(tile_threads: int):
+    """
+    Set up logging, metrics and tile threads, and warm up the pipelines, once per worker process
+    """
+    configure_logging()
+    bubble_search.TILE_THREADS = tile_threads
+    for pipeline in PIPELINES.values():
+        pipeline.warm_up()
+    # Metrics recorded here are shipped back with each result (see detect_sheet)
+    REGISTRY.forwarding = True
+
+
+def detect_sheet(image_data: Union[bytes, np.ndarray], template_id: str, page: int = 0,
+                 debug: Optional[bool] = None) -> Tuple[dict, MetricsDelta]:
+    """
+    Decode one bubble sheet and read its answers inside a worker process
+
+    Args:
+        image_data: Raw uploaded image bytes, or a page already decoded to
+            grayscale (see ingestion.iter_pages)
+        template_id: Template configuration to use
+        page: Frame (or PDF page) to read for multi-page uploads
+        debug: Force debug logging on/off for this sheet
+
+    Returns:
+        SheetDetection or ErrorResult as a plain dict, and the metrics
+        recorded while processing (to merge into the API process's registry)
+    """
+    pipeline = pipeline_for(template_id)
+    log.debug("Using %s pipeline for %s", pipeline.name, template_id)
+
+    if isinstance(image_data, np.ndarray):
+        gray = image_data  # A page of a multi-page upload, decoded by the API process
+    else:
+        # Decode once, straight to grayscale at the size the template needs
+        with sheet_scope(pipeline.name, template_id):
+            start = time.perf_counter()
+            try:
+                with timed_stage("decode"):
+                    gray = decode_image(image_data, template_id, page)
+            except ImageRejectedError as e:
+                # Refused from the header alone, before any pixels were decoded
+                record_sheet("rejected", time.perf_counter() - start)
+                log.info("Sheet rejected", template=template_id, reason=e.result.error_code)
+                return e.result.model_dump(), REGISTRY.drain()
+
+    detection = pipeline.detect(gray, template_id, debug)
+    return detection.model_dump(), REGISTRY.drain()
+
+
+class GradingPool:
+    """
+    Bounded process pool that keeps the CPU-bound grading pipeline off the event loop
+
+    Configuration comes from the environment unless given explicitly:
+        SNAPGRADE_WORKERS      worker processes (default: CPU count)
+        SNAPGRADE_TILE_THREADS tile search threads per worker (default: CPU count
+                               / workers, so all workers' threads fit the cores)
+        SNAPGRADE_MAX_PENDING  running + queued jobs before rejecting (default: 4 per worker)
+        SNAPGRADE_JOB_TIMEOUT  seconds to wait for one job's result (default: 30)
+
+    The timeout bounds only how long a caller waits, not the work: a job that
+    has started keeps running in its worker, and holding its slot, until it
+    finishes. A job still queued when its caller gives up is cancelled.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_pending: Optional[int] = None,
+                 job_timeout: Optional[float] = None, tile_threads: Optional[int] = None):
+        self.workers = workers or int(os.getenv("SNAPGRADE_WORKERS", os.cpu_count() or 1))
+        self.tile_threads = tile_threads or int(
+            os.getenv("SNAPGRADE_TILE_THREADS", max(1, (os.cpu_count() or 1) // self.workers))
+        )
+        self.max_pending = max_pending or int(
+            os.getenv("SNAPGRADE_MAX_PENDING", self.workers * 4)
+        )
+        self.job_timeout = job_timeout or float(os.getenv("SNAPGRADE_JOB_TIMEOUT", 30))
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs currently running or queued"""
+        return self._pending
+
+    def start(self):
+        """Create the worker processes"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.tile_threads,)
+            )
+
+    def shutdown(self):
+        """Stop the worker processes, cancelling queued jobs"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _submit(self, fn: Callable[..., Any], *args):
+        self.start()
+        try:
+            return self._executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM) - replace the pool and retry once
+            self.shutdown()
+            self.start()
+            return self._executor.submit(fn, *args)
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """
+        Run fn(*args) in a worker process
+
+        The job keeps its slot until its future is done: a timed-out job that
+        has started still counts against max_pending until the worker finishes
+        it, and one still queued is cancelled, which frees its slot at once.
+
+        Raises:
+            PoolSaturatedError: If max_pending jobs are already in the pool
+            asyncio.TimeoutError: If the job does not finish within job_timeout
+                (the worker is not interrupted)
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PoolSaturatedError(
+                    f"Grading queue is full ({self.max_pending} jobs pending)"
+                )
+            self._pending += 1
+
+        try:
+            future = self._submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+
+        future.add_done_callback(self._release)
+        return await asyncio.wait_for(asyncio.wrap_future(future), self.job_timeout)
@@ -63,6 +63,106 @@ def test_demo_processing():
         print(f"❌ Demo processing test failed: {e}")
         return False
 
+def make_test_sheet() -> bytes:
+    """A PNG page of empty bubble outlines (sharp enough for the quality gate)"""
+    import cv2
+    import numpy as np
+    
+    page = np.full((1100, 850), 255, dtype=np.uint8)
+    for y in range(200, 700, 60):
+        for x in range(150, 700, 80):
+            cv2.circle(page, (x, y), 14, 0, 2)
+    return cv2.imencode('.png', page)[1].tobytes()
+
+def test_batch_processing():
+    """Test the batch processing endpoint streams one result per sheet"""
+    print("\n🔍 Testing batch processing...")
+    try:
+        # Two unmarked sheets plus one undecodable upload
+        sheet = make_test_sheet()
+        files = [
+            ('files', ('sheet1.png', sheet, 'image/png')),
+            ('files', ('broken.png', b'not an image', 'image/png')),
+            ('files', ('sheet2.png', sheet, 'image/png')),
+        ]
+        data = {'answer_key': json.dumps(["A", "B", "C", "D", "A"]), 'template_id': 'simple_5'}
+        
+        response = requests.post(f"{BASE_URL}/process-batch", data=data, files=files)
+        if response.status_code != 200:
+            print(f"❌ Batch processing failed: {response.status_code}")
+            return False
+        
+        results = [json.loads(line) for line in response.text.splitlines() if line]
+        indexes = sorted(result['index'] for result in results)
+        failed = [result['index'] for result in results if not result['success']]
+        
+        if indexes == [0, 1, 2] and failed == [1]:
+            print(f"✅ Batch processing works - {len(results)} sheets streamed")
+            return True
+        else:
+            print(f"❌ Unexpected batch results: indexes={indexes}, failed={failed}")
+            return False
+    except Exception as e:
+        print(f"❌ Batch processing test failed: {e}")
+        return False
+
+def test_jobs():
+    """Test a queued job runs in the background and can be polled"""
+    print("\n🔍 Testing background jobs...")
+    try:
+        files = [
+            ('files', ('sheet1.png', make_test_sheet(), 'image/png')),
+            ('files', ('broken.png', b'not an image', 'image/png')),
+        ]
+        data = {'answer_key': json.dumps(["A", "B", "C", "D", "A"]), 'template_id': 'simple_5'}
+        
+        response = requests.post(f"{BASE_URL}/jobs", data=data, files=files)
+        if response.status_code != 202:
+            print(f"❌ Job submission failed: {response.status_code}")
+            return False
+        job_id = response.json()['job_id']
+        
+        for _ in range(60):
+            job = requests.get(f"{BASE_URL}/jobs/{job_id}").json()
+            if job['status'] in ('completed', 'failed'):
+                break
+            time.sleep(0.5)
+        
+        indexes = [result['index'] for result in job['results']]
+        if job['status'] == 'completed' and indexes == [0, 1] and job['failed_sheets'] == 1:
+            print(f"✅ Background jobs work - {job['completed_sheets']} sheets graded")
+            return True
+        else:
+            print(f"❌ Unexpected job state: status={job['status']}, indexes={indexes}")
+            return False
+    except Exception as e:
+        print(f"❌ Background job test failed: {e}")
+        return False
+
+def test_metrics():
+    """Test the metrics endpoint exposes pipeline histograms"""
+    print("\n🔍 Testing metrics endpoint...")
+    try:
+        response = requests.get(f"{BASE_URL}/metrics")
+        if response.status_code != 200:
+            print(f"❌ Metrics endpoint failed: {response.status_code}")
+            return False
+        
+        if "snapgrade_stage_seconds" not in response.text:
+            print("❌ Metrics are missing the stage latency histogram")
+            return False
+        
+        stages = sorted({
+            line.split('stage="')[1].split('"')[0]
+            for line in response.text.splitlines()
+            if line.startswith("snapgrade_stage_seconds_count")
+        })
+        print(f"✅ Metrics endpoint works - stages seen: {', '.join(stages) or 'none yet'}")
+        return True
+    except Exception as e:
+        print(f"❌ Metrics test failed: {e}")
+        return False
+
 def test_opencv_import():
     """Test if OpenCV and dependencies are properly installed"""
     print("\n🔍 Testing OpenCV and dependencies...")
@@ -104,6 +204,9 @@ def run_all_tests():
     health_ok = test_health_check()
     templates_ok = test_templates()
     demo_ok = test_demo_processing()
+    batch_ok = test_batch_processing()
+    jobs_ok = test_jobs()
+    metrics_ok = test_metrics()
     
     print("\n" + "=" * 50)
     print("📊 Test Results:")
@@ -111,8 +214,11 @@ def run_all_tests():
     print(f"   Health Check: {'✅' if health_ok else '❌'}")
     print(f"   Templates: {'✅' if templates_ok else '❌'}")
     print(f"   Demo Processing: {'✅' if demo_ok else '❌'}")
+    print(f"   Batch Processing: {'✅' if batch_ok else '❌'}")
+    print(f"   Background Jobs: {'✅' if jobs_ok else '❌'}")
+    print(f"   Metrics: {'✅' if metrics_ok else '❌'}")
     
-    all_passed = all([opencv_ok, health_ok, templates_ok, demo_ok])
+    all_passed = all([opencv_ok, health_ok, templates_ok, demo_ok, batch_ok, jobs_ok, metrics_ok])
     
     if all_passed:
         print("\n🎉 All tests passed! The backend is ready to use.")
@@ -0,0 +1,121 @@
+"""
+Offline tests of the vectorized grading and item analysis against hand-computed values
+Run with: python -m pytest test_grading.py
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+from src.grading import (
+    BLANK, INVALID, NOT_DETECTED, encode_answers, grade_answers, item_analysis, score_matrix,
+    stack_encoded, wrong_question_numbers
+)
+
+KEY = ["A", "B", "C"]
+
+# 4 students x 3 questions; right (1) / wrong (0) and score per student:
+#   A  B  C   1 1 1   3
+#   A  B  D   1 1 0   2
+#   -  B  A   0 1 0   1
+#   B  C  D   0 0 0   0
+CLASS_ANSWERS = [["A", "B", "C"], ["A", "B", "D"], ["", "B", "A"], ["B", "C", "D"]]
+
+
+def test_encode_answers_codes():
+    """Letters of either case become choice indexes; everything else gets its own code"""
+    matrix = encode_answers([["A", "", "b", "AB", "?"], ["C"]], width=6)
+    assert matrix.dtype == np.int8
+    assert matrix.tolist() == [
+        [0, BLANK, 1, INVALID, INVALID, NOT_DETECTED],
+        [2] + [NOT_DETECTED] * 5
+    ]
+
+
+def test_stack_encoded_pads_with_not_detected():
+    rows = [np.array([0, 1], dtype=np.int8), np.array([2], dtype=np.int8)]
+    assert stack_encoded(rows, 3).tolist() == [[0, 1, NOT_DETECTED], [2, NOT_DETECTED, NOT_DETECTED]]
+
+
+def test_score_matrix_edge_codes():
+    """Blank and invalid answers are wrong; questions not read are neither right nor wrong"""
+    matrix = encode_answers([["A", "", "b", "AB", "?"], ["C"]], width=6)
+    key = encode_answers([["A", "B", "B", "A", "C", "D"]])[0]
+    scores, wrong = score_matrix(matrix, key)
+
+    assert scores.tolist() == [2, 0]
+    assert wrong_question_numbers(wrong) == [[2, 4, 5], [1]]
+
+
+def test_score_matrix_matches_grade_answers():
+    """The vectorized scores agree with grading each sheet on its own"""
+    matrix = encode_answers(CLASS_ANSWERS)
+    scores, wrong = score_matrix(matrix, encode_answers([KEY])[0])
+
+    expected = [grade_answers(answers, KEY) for answers in CLASS_ANSWERS]
+    assert scores.tolist() == [score for score, _ in expected] == [3, 2, 1, 0]
+    assert wrong_question_numbers(wrong) == [incorrect for _, incorrect in expected]
+
+
+def test_item_analysis_hand_computed():
+    stats = item_analysis(encode_answers(CLASS_ANSWERS), encode_answers([KEY])[0])
+
+    assert stats["scores"].tolist() == [3, 2, 1, 0]
+    assert stats["difficulty"].tolist() == [0.5, 0.75, 0.25]
+    assert stats["histogram"].tolist() == [1, 1, 1, 1]
+
+    # Each item against the score on the other two (population statistics):
+    #   Q1: item 1100, rest 2110 -> cov 0.25,   sd 0.5 and sqrt(0.5)
+    #   Q2: item 1110, rest 2100 -> cov 0.1875, sd sqrt(0.1875) and sqrt(0.6875)
+    #   Q3: item 1000, rest 2210 -> cov 0.1875, sd sqrt(0.1875) and sqrt(0.6875)
+    expected = [
+        0.25 / (0.5 * math.sqrt(0.5)),
+        0.1875 / math.sqrt(0.1875 * 0.6875),
+        0.1875 / math.sqrt(0.1875 * 0.6875)
+    ]
+    assert stats["discrimination"] == pytest.approx(expected)
+
+    # KR-20 = k / (k - 1) * (1 - sum p(1 - p) / var(scores)) = 3/2 * (1 - 0.625 / 1.25)
+    assert stats["reliability"] == pytest.approx(0.75)
+
+    # Choices A-D picked per question, blanks counted apart
+    assert stats["choice_counts"].tolist() == [[2, 1, 0, 0], [0, 3, 1, 0], [1, 0, 1, 2]]
+    assert stats["blank_counts"].tolist() == [1, 0, 0]
+
+
+def test_item_analysis_ignores_unread_and_invalid_answers_in_counts():
+    matrix = encode_answers([["A", "AB"], ["B"]], width=2)
+    stats = item_analysis(matrix, encode_answers([["A", "A"]])[0], choices=2)
+
+    assert stats["choice_counts"].tolist() == [[1, 1], [0, 0]]
+    assert stats["blank_counts"].tolist() == [0, 0]
+    assert stats["scores"].tolist() == [1, 0]
+
+
+def test_item_analysis_single_student():
+    """One student has no score variance: discrimination and KR-20 are undefined, not errors"""
+    stats = item_analysis(encode_answers([["A", "C", "C"]]), encode_answers([KEY])[0])
+
+    assert stats["scores"].tolist() == [2]
+    assert stats["difficulty"].tolist() == [1.0, 0.0, 1.0]
+    assert np.isnan(stats["discrimination"]).all()
+    assert math.isnan(stats["reliability"])
+    assert stats["histogram"].tolist() == [0, 0, 1, 0]
+
+
+def test_item_analysis_zero_variance():
+    """Every student with the same score leaves KR-20 undefined"""
+    stats = item_analysis(encode_answers([KEY, KEY, KEY]), encode_answers([KEY])[0])
+
+    assert stats["difficulty"].tolist() == [1.0, 1.0, 1.0]
+    assert np.isnan(stats["discrimination"]).all()
+    assert math.isnan(stats["reliability"])
+
+
+def test_item_analysis_pads_short_matrices_and_rejects_empty():
+    stats = item_analysis(encode_answers([["A"], ["B"]]), encode_answers([KEY])[0])
+    assert stats["difficulty"].tolist() == [0.5, 0.0, 0.0]
+
+    with pytest.raises(ValueError):
+        item_analysis(np.empty((0, 3), dtype=np.int8), encode_answers([KEY])[0])
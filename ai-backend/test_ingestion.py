@@ -0,0 +1,65 @@
+"""
+Offline tests of upload ingestion: 600 dpi flatbed scans are decoded reduced and graded
+Run with: python -m pytest test_ingestion.py
+"""
+
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from benchmark import render_sheet
+from src.ingestion import ImageRejectedError, decode_image, ingest_limits, inspect_upload, iter_pages
+from src.pipeline import PIPELINES, TEMPLATES
+
+# An A4 page scanned at 600 dpi
+A4_600_DPI = (4961, 7016)
+
+
+@pytest.fixture(scope="module")
+def scan_page():
+    template = TEMPLATES["extended_100"]
+    rng = np.random.default_rng(5)
+    marks = rng.integers(0, len(template["choices"]), template["questions"]).tolist()
+    page = render_sheet(template["grid"], marks, width=A4_600_DPI[0])
+    assert page.shape == A4_600_DPI[::-1]
+    return page, [template["choices"][mark] for mark in marks]
+
+
+def encode(page: np.ndarray, image_format: str, frames: int = 1) -> bytes:
+    buffer = io.BytesIO()
+    image = Image.fromarray(page)
+    extra = {"save_all": True, "append_images": [image] * (frames - 1)} if frames > 1 else {}
+    image.save(buffer, format=image_format, **extra)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("image_format", ["PNG", "TIFF", "JPEG"])
+def test_600_dpi_scan_is_decoded_reduced_and_graded(scan_page, image_format):
+    page, answers = scan_page
+    image_data = encode(page, image_format)
+    assert inspect_upload(image_data) == 1
+
+    gray = decode_image(image_data, "extended_100")
+    long_side, short_side = ingest_limits("extended_100")
+    assert gray.shape[0] <= long_side and gray.shape[1] <= short_side
+
+    detection = PIPELINES[TEMPLATES["extended_100"]["pipeline"]].detect(gray, "extended_100")
+    assert detection.student_answers == answers
+
+
+def test_600_dpi_tiff_pages_are_decoded_one_at_a_time(scan_page):
+    page, _ = scan_page
+    pages = list(iter_pages(encode(page, "TIFF", frames=2), "extended_100"))
+
+    assert len(pages) == 2
+    for sheet, frame in pages:
+        assert isinstance(sheet, np.ndarray) and frame == 0
+
+
+def test_oversized_image_is_still_refused():
+    image_data = encode(np.full((9000, 6000), 255, dtype=np.uint8), "PNG")
+    with pytest.raises(ImageRejectedError) as rejected:
+        inspect_upload(image_data)
+    assert rejected.value.result.error_code == "IMAGE_TOO_LARGE"
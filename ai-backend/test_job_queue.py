@@ -0,0 +1,125 @@
+"""
+Offline tests of background jobs: uploads are streamed from the queue and split like a batch,
+and callbacks are only sent to public addresses
+Run with: python -m pytest test_job_queue.py
+"""
+
+import io
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import main
+from benchmark import render_sheet
+from src import job_queue
+from src.job_queue import COMPLETED, CallbackRefusedError, MemoryJobQueue, SQLiteJobQueue, check_callback_url, post_json
+from src.pipeline import TEMPLATES
+from src.scan_store import ScanStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def queue(request, tmp_path):
+    queue = MemoryJobQueue() if request.param == "memory" else SQLiteJobQueue(str(tmp_path / "jobs.db"))
+    yield queue
+    queue.close()
+
+
+def test_pending_uploads_are_loaded_one_at_a_time(queue):
+    job_id = queue.submit({"template_id": "standard_25"}, [("a.tif", b"first", 2), ("b.jpg", b"second", 1)])
+    queue.record_result(job_id, 0, {"success": True})
+
+    uploads = queue.pending_uploads(job_id)
+    assert next(uploads) == ("a.tif", b"first", 2, {1: 1})
+    assert next(uploads) == ("b.jpg", b"second", 1, {0: 2})
+    assert next(uploads, None) is None
+
+    queue.record_result(job_id, 1, {"success": True})
+    assert [upload[0] for upload in queue.pending_uploads(job_id)] == ["b.jpg"]
+
+
+def test_multi_page_job_is_split_like_a_batch(tmp_path, monkeypatch):
+    """A TIFF job is graded page by page, each page against its own answers"""
+    queue = SQLiteJobQueue(str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(main, "job_queue", queue)
+    monkeypatch.setattr(main, "scan_store", ScanStore(str(tmp_path / "scans.db")))
+    monkeypatch.setattr(main.job_runner, "queue", queue)
+    monkeypatch.setattr(main.job_runner, "poll_interval", 0.1)
+
+    template = TEMPLATES["standard_25"]
+    rng = np.random.default_rng(2)
+    marks = [rng.integers(0, 4, template["questions"]).tolist() for _ in range(3)]
+    pages = [Image.fromarray(render_sheet(template["grid"], page_marks)) for page_marks in marks]
+    buffer = io.BytesIO()
+    pages[0].save(buffer, format="TIFF", save_all=True, append_images=pages[1:])
+
+    with TestClient(main.app) as client:
+        response = client.post(
+            "/jobs",
+            files={"files": ("scan.tif", buffer.getvalue(), "image/tiff")},
+            data={"answer_key": json.dumps(["A"] * template["questions"]), "template_id": "standard_25"}
+        )
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+
+        deadline = time.monotonic() + 60
+        while (job := client.get(f"/jobs/{job_id}").json())["status"] != COMPLETED:
+            assert time.monotonic() < deadline, job
+            time.sleep(0.2)
+
+    assert job["total_sheets"] == job["completed_sheets"] == 3
+    for result, page_marks in zip(job["results"], marks):
+        assert result["success"]
+        assert result["student_answers"] == [template["choices"][mark] for mark in page_marks]
+
+
+@pytest.mark.parametrize("url", [
+    "file:///etc/passwd", "ftp://example.com/hook", "http://127.0.0.1:8000/hook", "http://localhost/hook",
+    "http://169.254.169.254/latest/meta-data", "http://10.0.0.8/hook", "http://[::1]/hook",
+    "http://[::ffff:192.168.1.1]/hook", "http://0.0.0.0/hook"
+])
+def test_callback_to_a_local_address_is_refused(url):
+    with pytest.raises(CallbackRefusedError):
+        check_callback_url(url)
+
+
+def test_callback_host_is_checked_where_it_resolves(monkeypatch):
+    """A public-looking name that resolves to a private address is refused at connect time"""
+    assert check_callback_url("https://hooks.example.com/done") == "hooks.example.com"
+    monkeypatch.setattr(
+        socket, "getaddrinfo",
+        lambda host, port, *args, **kwargs: [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("10.1.2.3", port))]
+    )
+    with pytest.raises(CallbackRefusedError):
+        post_json("http://hooks.example.com/done", {"status": COMPLETED})
+
+
+def test_allowed_callback_host_is_posted_to(monkeypatch):
+    received = []
+
+    class Hook(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Hook)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/hook"
+    try:
+        with pytest.raises(CallbackRefusedError):
+            post_json(url, {"status": COMPLETED})
+        monkeypatch.setattr(job_queue, "CALLBACK_HOSTS", {"127.0.0.1"})
+        assert post_json(url, {"status": COMPLETED}) == 204
+    finally:
+        server.shutdown()
+    assert received == [{"status": COMPLETED}]
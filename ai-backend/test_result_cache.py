@@ -0,0 +1,27 @@
+"""
+Offline tests of the detection cache's memory and disk tiers
+Run with: python -m pytest test_result_cache.py
+"""
+
+import asyncio
+
+from src.result_cache import DetectionCache
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    """Entries stored from the event loop are written to disk and read back by a new cache"""
+    detection = {"template_id": "standard_25", "student_answers": ["A", "B"]}
+    key = DetectionCache.key(b"sheet", "standard_25", pipeline="standard")
+
+    first = DetectionCache(max_bytes=1024, disk_dir=str(tmp_path))
+    asyncio.run(first.store(key, detection))
+    assert first.get(key) == detection
+
+    restarted = DetectionCache(max_bytes=1024, disk_dir=str(tmp_path))
+    assert asyncio.run(restarted.lookup(key)) == detection
+    assert asyncio.run(restarted.lookup("v0-other")) is None
+
+    # The disk hit was promoted into the memory tier
+    for entry in tmp_path.iterdir():
+        entry.unlink()
+    assert restarted.get(key) == detection
@@ -0,0 +1,94 @@
+"""
+Offline tests of scan storage: a resubmitted sheet replaces its scan instead of adding a
+student, and stored scans are regraded against the key for their bubbled version
+Run with: python -m pytest test_scan_store.py
+"""
+
+import json
+
+import cv2
+import numpy as np
+from fastapi.testclient import TestClient
+
+import main
+from benchmark import generate_sheet, render_sheet
+from src.pipeline import TEMPLATES
+from src.scan_store import ScanStore
+
+
+def make_detection(answers: list) -> dict:
+    return {"template_id": "standard_25", "student_answers": answers}
+
+
+def test_resaved_sheet_keeps_its_scan_id(tmp_path):
+    """The same page of the same upload saved again under an exam replaces its scan"""
+    store = ScanStore(str(tmp_path / "scans.db"))
+    first = store.save(make_detection(["A", "B"]), "s1", "E1", "digest", 0)
+    again = store.save(make_detection(["A", "C"]), "s1", "E1", "digest", 0)
+    assert again == first
+
+    scans = store.load_answers(exam_id="E1")
+    assert [scan["scan_id"] for scan in scans] == [first]
+    assert scans[0]["answer_codes"].tolist() == [0, 2]
+
+    # Another page, another exam, or a save without an upload digest is a new scan
+    assert store.save(make_detection(["A"]), "s2", "E1", "digest", 1) != first
+    assert store.save(make_detection(["A"]), "s1", "E2", "digest", 0) != first
+    assert store.save(make_detection(["A"]), "s1", "E1") != first
+    assert len(store.load_answers(exam_id="E1")) == 3
+    store.close()
+
+
+def test_resubmission_does_not_add_a_student(tmp_path, monkeypatch):
+    """Sending one sheet three times leaves one student for /item-analysis and /regrade"""
+    monkeypatch.setattr(main, "scan_store", ScanStore(str(tmp_path / "scans.db")))
+    template = TEMPLATES["standard_25"]
+    image_data, answers, _, _ = generate_sheet(template["grid"], template["choices"], np.random.default_rng(3))
+    key = [answer or "A" for answer in answers]
+
+    with TestClient(main.app) as client:
+        scan_ids = set()
+        for _ in range(3):
+            response = client.post(
+                "/process-image",
+                files={"file": ("sheet.jpg", image_data, "image/jpeg")},
+                data={"answer_key": json.dumps(key), "template_id": "standard_25", "exam_id": "E1"}
+            )
+            assert response.status_code == 200
+            scan_ids.add(response.json()["scan_id"])
+        assert len(scan_ids) == 1
+
+        analysis = client.post("/item-analysis", json={"answer_key": key, "exam_id": "E1"}).json()
+        assert analysis["students"] == 1
+        regrade = client.post("/regrade", json={"answer_key": key, "exam_id": "E1"}).json()
+        assert regrade["regraded"] == 1
+
+
+def test_regrade_and_item_analysis_use_each_sheets_version_key(tmp_path, monkeypatch):
+    """Per-version keys score every stored sheet against its bubbled version's key"""
+    monkeypatch.setattr(main, "scan_store", ScanStore(str(tmp_path / "scans.db")))
+    keys = {"A": ["A"] * 50, "B": ["B"] * 50}
+
+    with TestClient(main.app) as client:
+        # Version A and B sheets that both answer A throughout, and one with no version bubbled
+        for student_id, version in (("100001", [0]), ("100002", [1]), ("100003", [])):
+            page = render_sheet("standard_50_id", [0] * 50, fields={
+                "student_id": [int(digit) for digit in student_id], "version": version
+            })
+            response = client.post(
+                "/process-image",
+                files={"file": ("sheet.png", cv2.imencode(".png", page)[1].tobytes(), "image/png")},
+                data={"answer_key": json.dumps(["A"] * 50), "template_id": "standard_50_id", "exam_id": "E1"}
+            )
+            assert response.status_code == 200
+
+        regrade = client.post("/regrade", json={"answer_key": keys, "exam_id": "E1"}).json()
+        scores = {score["student_id"]: (score["version"], score["score"]) for score in regrade["results"]}
+        assert scores == {"100001": ("A", 50), "100002": ("B", 0)}
+        assert len(regrade["unknown_version_scan_ids"]) == 1
+
+        analysis = client.post("/item-analysis", json={"answer_key": keys, "exam_id": "E1"}).json()
+        assert sorted(analysis["versions"]) == ["A", "B"]
+        assert analysis["versions"]["A"]["items"][0]["difficulty"] == 1.0
+        assert analysis["versions"]["B"]["items"][0]["difficulty"] == 0.0
+        assert len(analysis["unknown_version_scan_ids"]) == 1
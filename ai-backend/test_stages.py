@@ -0,0 +1,154 @@
+"""
+Offline tests of the answer decision (stages.decide_by_contrast), bubbled fields and layout inference
+Run with: python -m pytest test_stages.py
+"""
+
+import math
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmark import render_sheet
+from src.grading import grade_detection
+from src.layout_inference import infer_layout
+from src.pipeline import PIPELINES
+from src.stages import (
+    FLAG_BLANK, FLAG_ERASED, FLAG_MULTIPLE, Measurement, decide_by_contrast
+)
+from src.templates import compile_fields
+
+TEMPLATE = {"questions": 12, "choices": ["A", "B", "C", "D"]}
+BACKGROUND = 0.1
+MARK = 0.8
+
+
+def sheet_fills(marks: dict, questions: int = 12, level: float = MARK) -> np.ndarray:
+    """Fills of a sheet with one mark per question (question -> choice index)"""
+    fills = np.full((questions, 4), BACKGROUND)
+    for question, choice in marks.items():
+        fills[question, choice] = level
+    return fills
+
+
+def decide(fills: np.ndarray):
+    return decide_by_contrast(Measurement(fills, {}), [], TEMPLATE)
+
+
+def test_clean_marks_are_read_with_high_confidence():
+    decision = decide(sheet_fills({q: q % 4 for q in range(12)}))
+
+    assert decision.answers == ["A", "B", "C", "D"] * 3
+    assert min(decision.confidence) > 0.99
+    assert decision.flags == [[]] * 12
+
+
+def test_light_pencil_reads_like_dark_pen():
+    """Marks are judged against the sheet's typical mark, not a fixed fill"""
+    decision = decide(sheet_fills({q: q % 4 for q in range(12)}, level=0.35))
+
+    assert decision.answers == ["A", "B", "C", "D"] * 3
+    assert min(decision.confidence) > 0.99
+
+
+def test_blank_multiple_and_erased_questions_are_flagged():
+    fills = sheet_fills({q: 0 for q in range(12) if q != 2})
+    fills[5, 1] = MARK + 0.02                          # Two marks, B the darker
+    fills[8, 3] = BACKGROUND + 0.3 * (MARK - BACKGROUND)  # An erased D next to the A marked
+    decision = decide(fills)
+
+    assert decision.answers[2] == ""
+    assert decision.flags[2] == [FLAG_BLANK]
+    assert decision.confidence[2] > 0.99
+
+    assert decision.answers[5] == "B"
+    assert decision.flags[5] == [FLAG_MULTIPLE]
+    assert decision.confidence[5] < 0.01
+
+    assert decision.answers[8] == "A"
+    assert decision.flags[8] == [FLAG_ERASED]
+
+
+def test_missing_choices_lower_the_confidence():
+    fills = sheet_fills({q: 0 for q in range(12)})
+    fills[4, 3] = np.nan        # Marked A, D not found: D could hold a second mark
+    fills[6, 1:] = BACKGROUND
+    fills[6, 0] = np.nan        # Nothing marked among B-D, A not found: A could hold the mark
+    fills[9] = np.nan           # No bubble of the question found
+    decision = decide(fills)
+
+    assert decision.answers[4] == "A"
+    assert decision.confidence[4] == pytest.approx(decision.confidence[0] * 0.75, abs=1e-3)
+
+    assert decision.answers[6] == ""
+    assert decision.confidence[6] < 0.5
+
+    assert (decision.answers[9], decision.confidence[9], decision.flags[9]) == ("", 0.0, [])
+
+
+def test_fields_are_read_per_position():
+    template = dict(TEMPLATE, fields={"version": {"positions": 1, "values": ["A", "B"]}})
+    fields = {"version": np.array([[BACKGROUND, MARK]])}
+    decision = decide_by_contrast(Measurement(sheet_fills({q: 0 for q in range(12)}), fields), [], template)
+
+    assert decision.fields["version"].answers == ["B"]
+
+
+def grid_bubbles(columns: int, rows: int, choices: int, angle_degrees: float = 0.0) -> list:
+    """Bubbles of a printed answer grid, rotated about the page center, in shuffled order"""
+    angle = math.radians(angle_degrees)
+    bubbles = []
+    for column in range(columns):
+        for row in range(rows):
+            for choice in range(choices):
+                x, y = 100 + column * 300 + choice * 40, 200 + row * 40
+                bubbles.append({
+                    "x": 400 + (x - 400) * math.cos(angle) - (y - 400) * math.sin(angle),
+                    "y": 400 + (x - 400) * math.sin(angle) + (y - 400) * math.cos(angle),
+                    "radius": 12,
+                    "expected": (column * rows + row, choice)
+                })
+    order = np.random.default_rng(0).permutation(len(bubbles))
+    return [bubbles[i] for i in order]
+
+
+@pytest.mark.parametrize("angle", [0.0, 4.0, -6.0])
+def test_infer_layout_numbers_questions_down_each_column(angle):
+    bubbles = grid_bubbles(columns=2, rows=10, choices=4, angle_degrees=angle)
+    slots = infer_layout(bubbles, questions=20, choices=4)
+
+    for question, row in enumerate(slots):
+        for choice, bubble in enumerate(row):
+            assert bubble is not None and bubble["expected"] == (question, choice)
+
+
+def test_infer_layout_leaves_a_hole_for_a_missed_bubble():
+    bubbles = [b for b in grid_bubbles(columns=2, rows=10, choices=4) if b["expected"] != (3, 1)]
+    slots = infer_layout(bubbles, questions=20, choices=4)
+
+    assert slots[3][1] is None
+    placed = [(q, c) for q, row in enumerate(slots) for c, bubble in enumerate(row) if bubble is not None]
+    assert len(placed) == 79
+    assert all(slots[q][c]["expected"] == (q, c) for q, c in placed)
+
+
+@pytest.mark.parametrize("unclear", ["blank", "multiple"])
+def test_partly_bubbled_id_is_unread_and_reviewed(unclear):
+    """An ID with a position left blank or marked twice is never filed under a shorter or other ID"""
+    student_id = [1, 2, 3, 4, 5, 6]
+    page = render_sheet("standard_50_id", [0] * 50, fields={"student_id": student_id, "version": [0]})
+    layout_circles = compile_fields("standard_50_id", page.shape[1], page.shape[0])["student_id"]
+    x, y, radius = layout_circles[2, student_id[2]]
+    if unclear == "blank":
+        cv2.circle(page, (int(x), int(y)), int(radius * 0.85), 245, -1)
+    else:
+        x, y, radius = layout_circles[2, 9]
+        cv2.circle(page, (int(x), int(y)), int(radius * 0.85), 40, -1, cv2.LINE_AA)
+
+    detection = PIPELINES["standard"].detect(page, "standard_50_id")
+    assert detection.fields["version"].value == "A"
+    assert detection.fields["student_id"].value is None
+
+    result = grade_detection(detection, ["A"] * 50)
+    assert result.student_id is None
+    assert result.review_fields == ["student_id"] and result.needs_review
@@ -0,0 +1,178 @@
+"""
+Offline check that the sheets the app prints land on the compiled bubble grids
+
+A sheet is drawn the way lib/bubblesheet.ts (generateBubbleSheetPDF) prints
+it, using the generator's own layout numbers read from that file, then
+photographed (perspective, blur, noise, JPEG) and read back.
+Run with: python -m pytest test_templates.py
+"""
+
+import re
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+from src.ingestion import decode_image
+from src.pipeline import PIPELINES, TEMPLATES
+from src.stages import register_to_template, threshold_and_clean
+from src.templates import TEMPLATE_LAYOUTS, locate_grid_bubbles
+
+GENERATOR = Path(__file__).resolve().parent.parent / "lib" / "bubblesheet.ts"
+
+# Rendering resolution of the simulated print, in pixels per millimetre (~200 dpi)
+PX_PER_MM = 8.0
+
+
+def read_generator_layout(questions: int) -> dict:
+    """Read a template's columns and sheetLayouts entry from lib/bubblesheet.ts"""
+    source = GENERATOR.read_text()
+
+    def entries(block: str) -> dict:
+        values = {key: float(value) for key, value in re.findall(r"(\w+):\s*([\d.]+)", block)}
+        choices = re.search(r"choices:\s*\[([^\]]*)\]", block)
+        if choices:
+            values["choices"] = re.findall(r'"(\w)"', choices.group(1))
+        return values
+
+    config = re.search(rf"\n  {questions}: \{{(.*?)\n?  \}},", source, re.S).group(1)
+    layouts = source[source.index("export const sheetLayouts"):]
+    layout = re.search(rf"\n  {questions}: (?:\{{(.*?)\}}|defaultLayout),", layouts, re.S).group(1) or ""
+    default = re.search(r"const defaultLayout: SheetLayout = \{(.*?)\};", source, re.S).group(1)
+    return {**entries(config), **entries(default), **entries(layout)}
+
+
+def read_generator_fields(questions: int) -> dict:
+    """Read a template's sheetFields entries from lib/bubblesheet.ts, by field name"""
+    source = GENERATOR.read_text()
+    table = source[source.index("export const sheetFields"):]
+    block = re.search(rf"\n  {questions}: \{{(.*?)\n  \}},", table, re.S).group(1)
+
+    fields = {}
+    for name, body in re.findall(r"\n    (\w+): \{(.*?)\n    \},", block, re.S):
+        field = {key: float(value) for key, value in re.findall(r"(\w+):\s*([\d.]+),", body)}
+        field["label"] = re.search(r'label:\s*"([^"]*)"', body).group(1)
+        field["values"] = re.findall(r'"(\w)"', re.search(r"values:\s*\[([^\]]*)\]", body).group(1))
+        fields[name] = field
+    return fields
+
+
+def draw_text(page: np.ndarray, text: str, x_mm: float, y_mm: float, size_pt: float, align: str = "left"):
+    scale = size_pt * 0.3528 * 0.7 * PX_PER_MM / 22  # Cap height in px over Hershey's ~22 px
+    (width, _), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, 1)
+    x = x_mm * PX_PER_MM - {"left": 0, "center": width / 2, "right": width}[align]
+    cv2.putText(page, text, (int(x), int(y_mm * PX_PER_MM)), cv2.FONT_HERSHEY_SIMPLEX, scale, 0, 2, cv2.LINE_AA)
+
+
+def print_sheet(questions: int, answers: list, fields: dict = None) -> np.ndarray:
+    """Draw a marked sheet as generateBubbleSheetPDF lays it out (with bubbled fields if given)"""
+    layout = read_generator_layout(questions)
+    page_width, page_height, margin, start_y = 210, 297, 20, 90
+    page = np.full((int(page_height * PX_PER_MM), int(page_width * PX_PER_MM)), 255, dtype=np.uint8)
+
+    def mm(value: float) -> int:
+        return int(round(value * PX_PER_MM))
+
+    for x, y in ((15, 15), (page_width - 15, 15), (15, page_height - 15), (page_width - 15, page_height - 15)):
+        cv2.circle(page, (mm(x), mm(y)), mm(4), 0, -1, cv2.LINE_AA)
+
+    draw_text(page, "SnapGrade Bubble Sheet", page_width / 2, 30, 16, "center")
+    if fields:
+        for name, field in read_generator_fields(questions).items():
+            radius = field["bubbleRadius"]
+            for index, value in enumerate(field["values"]):
+                draw_text(page, value, field["x"] + index * field["valueSpacing"], field["y"] - radius - 1.5, 7, "center")
+            for position in range(int(field["positions"])):
+                for index, value in enumerate(field["values"]):
+                    center = (mm(field["x"] + index * field["valueSpacing"]), mm(field["y"] + position * field["positionSpacing"]))
+                    cv2.circle(page, center, mm(radius), 0, max(1, mm(0.3)), cv2.LINE_AA)
+                    if fields[name][position] == value:
+                        cv2.circle(page, center, mm(radius * 0.8), 40, -1, cv2.LINE_AA)
+            last_y = field["y"] + (field["positions"] - 1) * field["positionSpacing"]
+            draw_text(page, field["label"], field["x"] - radius, last_y + radius + 5, 9)
+        draw_text(page, "Name: ______________________", margin, 58, 10)
+        draw_text(page, "Date: ______________", margin, 66, 10)
+        draw_text(page, f"{questions} Questions", margin, 74, 10)
+        draw_text(page, "Fill bubbles completely with a #2 pencil. Bubble one digit per row of your ID.",
+                  page_width / 2, 80, 8, "center")
+    else:
+        draw_text(page, f"{questions} Questions", page_width / 2, 40, 12, "center")
+        draw_text(page, "Fill bubbles completely with a #2 pencil. Make no stray marks.", page_width / 2, 50, 8, "center")
+        cv2.rectangle(page, (mm(margin), mm(55)), (mm(page_width - margin), mm(75)), 0, mm(0.5))
+        draw_text(page, "Name: ________________________________", margin + 5, 67, 10)
+        draw_text(page, "Date: _______________", margin + 5, 72, 10)
+        draw_text(page, "Student ID: __________________", page_width - margin - 100, 67, 10)
+
+    columns, per_column = int(layout["columns"]), int(layout["questionsPerColumn"])
+    gap, offset, pitch = layout["columnGap"], layout["bubbleOffset"], layout["bubbleSpacing"]
+    radius = layout["bubbleRadius"]
+    column_width = (page_width - 2 * margin - (columns - 1) * gap) / columns
+
+    for column in range(columns):
+        start_x = margin + column * (column_width + gap)
+        for index, letter in enumerate(layout["choices"]):
+            draw_text(page, letter, start_x + offset + index * pitch, start_y - 5, 8, "center")
+
+    for q in range(questions):
+        column, row = divmod(q, per_column)
+        start_x = margin + column * (column_width + gap)
+        y = start_y + row * layout["questionSpacing"]
+        assert y <= page_height - 30, f"question {q + 1} doesn't fit on the printed page"
+
+        draw_text(page, f"{q + 1}.", start_x + offset - 10, y + 2, 9, "right")
+        for index, letter in enumerate(layout["choices"]):
+            center = (mm(start_x + offset + index * pitch), mm(y))
+            cv2.circle(page, center, mm(radius), 0, max(1, mm(0.3)), cv2.LINE_AA)
+            if answers[q] == letter:
+                cv2.circle(page, center, mm(radius * 0.8), 40, -1, cv2.LINE_AA)
+
+    draw_text(page, "Generated by SnapGrade", page_width / 2, page_height - 10, 7, "center")
+    return page
+
+
+def photograph(page: np.ndarray, seed: int = 0) -> bytes:
+    """Simulate a phone photo of the printed page: perspective, blur, noise, JPEG"""
+    rng = np.random.default_rng(seed)
+    height, width = page.shape
+    canvas = np.full((int(height * 1.15), int(width * 1.15)), 150, dtype=np.uint8)
+    corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    placed = corners + np.float32([width * 0.07, height * 0.07]) + rng.uniform(-25, 25, (4, 2)).astype(np.float32)
+    warp = cv2.getPerspectiveTransform(corners, placed)
+    photo = cv2.warpPerspective(page, warp, canvas.shape[::-1], dst=canvas, borderMode=cv2.BORDER_TRANSPARENT)
+    photo = cv2.GaussianBlur(photo, (3, 3), 0)
+    photo = np.clip(photo + rng.normal(0, 4, photo.shape), 0, 255).astype(np.uint8)
+    return cv2.imencode(".jpg", photo, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+@pytest.mark.skipif(not GENERATOR.exists(), reason="lib/bubblesheet.ts is not checked out with the backend")
+@pytest.mark.parametrize("template_id", ["simple_5", "standard_25", "standard_50", "extended_100"])
+def test_generator_sheets_register_onto_the_grid(template_id):
+    """A printed sheet is read from its compiled grid, not the fallback search"""
+    template = TEMPLATES[template_id]
+    rng = np.random.default_rng(7)
+    answers = [str(rng.choice(template["choices"])) for _ in range(template["questions"])]
+    image_data = photograph(print_sheet(template["questions"], answers))
+
+    gray = decode_image(image_data, template_id)
+    registered, _ = register_to_template(gray, template)
+    bubbles = locate_grid_bubbles(threshold_and_clean(registered), template["grid"])
+    layout = TEMPLATE_LAYOUTS[template["grid"]]
+    assert len(bubbles) == layout["questions"] * layout["choices"]
+
+    detection = PIPELINES[template["pipeline"]].detect(gray, template_id)
+    assert detection.student_answers == answers
+
+
+@pytest.mark.skipif(not GENERATOR.exists(), reason="lib/bubblesheet.ts is not checked out with the backend")
+def test_generator_id_sheet_fields_are_read():
+    """The student ID and version the generator prints are read from the template's fields"""
+    template = TEMPLATES["standard_50_id"]
+    rng = np.random.default_rng(11)
+    answers = [str(rng.choice(template["choices"])) for _ in range(template["questions"])]
+    fields = {"student_id": "402917", "version": "C"}
+    image_data = photograph(print_sheet(template["questions"], answers, fields))
+
+    detection = PIPELINES[template["pipeline"]].detect(decode_image(image_data, "standard_50_id"), "standard_50_id")
+    assert detection.student_answers == answers
+    assert {name: reading.value for name, reading in detection.fields.items()} == fields
@@ -0,0 +1,89 @@
+"""
+Offline tests of uploads: a file over the size limit fails alone instead of refusing the batch,
+and a multi-page scan is sent on from /process-image
+Run with: python -m pytest test_uploads.py
+"""
+
+import io
+import json
+import time
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import main
+from benchmark import generate_sheet, render_sheet
+from src.job_queue import COMPLETED, SQLiteJobQueue
+from src.pipeline import TEMPLATES
+from src.scan_store import ScanStore
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    queue = SQLiteJobQueue(str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(main, "job_queue", queue)
+    monkeypatch.setattr(main.job_runner, "queue", queue)
+    monkeypatch.setattr(main.job_runner, "poll_interval", 0.1)
+    monkeypatch.setattr(main, "scan_store", ScanStore(str(tmp_path / "scans.db")))
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    """A sheet under the upload limit and a file over it, with the sheet's answers"""
+    template = TEMPLATES["standard_25"]
+    image_data, answers, _, _ = generate_sheet(template["grid"], template["choices"], np.random.default_rng(4))
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", len(image_data) + 1)
+    files = [
+        ("files", ("sheet.jpg", image_data, "image/jpeg")),
+        ("files", ("huge.jpg", image_data + b"\0" * 16, "image/jpeg"))
+    ]
+    form = {"answer_key": json.dumps([answer or "A" for answer in answers]), "template_id": "standard_25"}
+    return files, form, answers
+
+
+def check_results(results: list, answers: list):
+    results = sorted(results, key=lambda result: result["index"])
+    assert [result["filename"] for result in results] == ["sheet.jpg", "huge.jpg"]
+    assert results[0]["success"] and results[0]["student_answers"] == answers
+    assert not results[1]["success"] and results[1]["error_code"] == "IMAGE_TOO_LARGE"
+
+
+def test_oversized_file_fails_alone_in_a_batch(client, uploads):
+    files, form, answers = uploads
+    response = client.post("/process-batch", files=files, data=form)
+    assert response.status_code == 200
+    check_results([json.loads(line) for line in response.text.splitlines()], answers)
+
+
+def test_oversized_file_fails_alone_in_a_job(client, uploads):
+    files, form, answers = uploads
+    response = client.post("/jobs", files=files, data=form)
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    deadline = time.monotonic() + 60
+    while (job := client.get(f"/jobs/{job_id}").json())["status"] != COMPLETED:
+        assert time.monotonic() < deadline, job
+        time.sleep(0.2)
+    assert job["total_sheets"] == job["completed_sheets"] == 2
+    assert job["failed_sheets"] == 1
+    check_results(job["results"], answers)
+
+
+def test_multi_page_scan_is_refused_by_process_image(client):
+    template = TEMPLATES["standard_25"]
+    page = Image.fromarray(render_sheet(template["grid"], [0] * template["questions"]))
+    buffer = io.BytesIO()
+    page.save(buffer, format="TIFF", save_all=True, append_images=[page])
+
+    response = client.post(
+        "/process-image",
+        files={"file": ("scan.tif", buffer.getvalue(), "image/tiff")},
+        data={"answer_key": json.dumps(["A"] * template["questions"]), "template_id": "standard_25"}
+    )
+    assert response.status_code == 400
+    assert "2 pages" in response.json()["detail"] and "/process-batch" in response.json()["detail"]
@@ -0,0 +1,34 @@
+"""
+Offline tests of the grading pool: a timed-out job holds its slot until its worker is done
+Run with: python -m pytest test_worker_pool.py
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from src.worker_pool import GradingPool, PoolSaturatedError
+
+
+def test_timed_out_job_keeps_its_slot_until_it_finishes():
+    pool = GradingPool(workers=1, max_pending=1, job_timeout=1, tile_threads=1)
+
+    async def run():
+        await pool.run(time.sleep, 0)  # Start the worker before timing anything
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.run(time.sleep, 2)
+        assert pool.pending == 1
+        with pytest.raises(PoolSaturatedError):
+            await pool.run(time.sleep, 0)
+
+        deadline = time.monotonic() + 10
+        while pool.pending:
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.1)
+        await pool.run(time.sleep, 0)
+
+    try:
+        asyncio.run(run())
+    finally:
+        pool.shutdown()
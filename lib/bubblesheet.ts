@@ -47,9 +47,100 @@ export const templateConfigs = {
   },
 };
 
-export const generateBubbleSheetPDF = (questions: number): jsPDF => {
+// Printed answer grid per template, in mm. The grading backend reads the
+// sheets at these positions (ai-backend/src/templates.py derives its layouts
+// from the same numbers), so a change here must be made there too.
+export interface SheetLayout {
+  choices: string[];
+  bubbleSpacing: number; // Between the choices of one question
+  questionSpacing: number; // Between consecutive questions of a column
+  bubbleRadius: number;
+  bubbleOffset: number; // Choice A's center from its column's left edge
+  columnGap: number;
+}
+
+const defaultLayout: SheetLayout = {
+  choices: ["A", "B", "C", "D"],
+  bubbleSpacing: 15,
+  questionSpacing: 18,
+  bubbleRadius: 3,
+  bubbleOffset: 25,
+  columnGap: 15,
+};
+
+// Every question must fit between the answer header and the footer
+export const sheetLayouts: Record<number, SheetLayout> = {
+  5: defaultLayout,
+  10: defaultLayout,
+  15: { ...defaultLayout, questionSpacing: 12 },
+  20: defaultLayout,
+  25: { ...defaultLayout, questionSpacing: 13 },
+  50: {
+    ...defaultLayout,
+    bubbleSpacing: 12,
+    questionSpacing: 7,
+    bubbleRadius: 2.5,
+  },
+  100: {
+    choices: ["A", "B", "C", "D", "E"],
+    bubbleSpacing: 8,
+    questionSpacing: 5,
+    bubbleRadius: 2,
+    bubbleOffset: 12,
+    columnGap: 4,
+  },
+};
+
+// Bubbled fields a sheet can print in place of the student information box,
+// in mm: rows (positions) of one mark each, read top to bottom. The backend's
+// templates with fields (standard_50_id) read them at these positions.
+export interface BubbleField {
+  label: string;
+  values: string[];
+  positions: number;
+  x: number; // Center of the first position's first value
+  y: number;
+  valueSpacing: number; // Between the values of one position
+  positionSpacing: number; // Between consecutive positions
+  bubbleRadius: number;
+}
+
+export const sheetFields: Record<number, Record<string, BubbleField>> = {
+  50: {
+    version: {
+      label: "Version",
+      values: ["A", "B", "C", "D"],
+      positions: 1,
+      x: 25,
+      y: 38,
+      valueSpacing: 12,
+      positionSpacing: 0,
+      bubbleRadius: 2.2,
+    },
+    student_id: {
+      label: "Student ID",
+      values: ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9"],
+      positions: 6,
+      x: 110,
+      y: 38,
+      valueSpacing: 7,
+      positionSpacing: 6,
+      bubbleRadius: 2.2,
+    },
+  },
+};
+
+export const generateBubbleSheetPDF = (
+  questions: number,
+  withFields = false
+): jsPDF => {
   const doc = new jsPDF();
   const config = templateConfigs[questions as keyof typeof templateConfigs];
+  const layout = sheetLayouts[questions] ?? defaultLayout;
+  const fields = withFields ? sheetFields[questions] : undefined;
+  if (withFields && !fields) {
+    throw new Error(`No student ID sheet for ${questions} questions`);
+  }
 
   // Page dimensions
   const pageWidth = doc.internal.pageSize.getWidth();
@@ -57,11 +148,16 @@ export const generateBubbleSheetPDF = (questions: number): jsPDF => {
 
   // Layout constants
   const margin = 20;
-  const bubbleRadius = 3;
-  const bubbleSpacing = 15;
-  const questionSpacing = 18; // Reduced spacing for better fit
+  const {
+    choices,
+    bubbleRadius,
+    bubbleSpacing,
+    questionSpacing,
+    bubbleOffset,
+    columnGap,
+  } = layout;
   const columnWidth =
-    (pageWidth - 2 * margin - (config.columns - 1) * 15) / config.columns; // Reduced column spacing
+    (pageWidth - 2 * margin - (config.columns - 1) * columnGap) / config.columns;
 
   // Alignment markers (corner circles)
   const markerRadius = 4;
@@ -76,26 +172,65 @@ export const generateBubbleSheetPDF = (questions: number): jsPDF => {
   doc.setFont("helvetica", "bold");
   doc.text("SnapGrade Bubble Sheet", pageWidth / 2, 30, { align: "center" });
 
-  doc.setFontSize(12);
-  doc.setFont("helvetica", "normal");
-  doc.text(`${questions} Questions`, pageWidth / 2, 40, { align: "center" });
+  if (fields) {
+    // Bubbled fields take the place of the subtitle and information box
+    doc.setFont("helvetica", "normal");
+    Object.values(fields).forEach((field) => {
+      doc.setFontSize(7);
+      field.values.forEach((value, index) => {
+        const x = field.x + index * field.valueSpacing;
+        doc.text(value, x, field.y - field.bubbleRadius - 1.5, {
+          align: "center",
+        });
+      });
 
-  // Instructions
-  doc.setFontSize(8);
-  doc.text(
-    "Fill bubbles completely with a #2 pencil. Make no stray marks.",
-    pageWidth / 2,
-    50,
-    { align: "center" }
-  );
+      doc.setLineWidth(0.3);
+      for (let position = 0; position < field.positions; position++) {
+        const y = field.y + position * field.positionSpacing;
+        field.values.forEach((_, index) => {
+          doc.circle(field.x + index * field.valueSpacing, y, field.bubbleRadius);
+        });
+      }
+
+      const lastY = field.y + (field.positions - 1) * field.positionSpacing;
+      doc.setFontSize(9);
+      doc.text(field.label, field.x - field.bubbleRadius, lastY + field.bubbleRadius + 5);
+    });
 
-  // Student information section
-  doc.setLineWidth(0.5);
-  doc.rect(margin, 55, pageWidth - 2 * margin, 20);
-  doc.setFontSize(10);
-  doc.text("Name: ________________________________", margin + 5, 67);
-  doc.text("Date: _______________", margin + 5, 72);
-  doc.text("Student ID: __________________", pageWidth - margin - 100, 67);
+    doc.setFontSize(10);
+    doc.text("Name: ______________________", margin, 58);
+    doc.text("Date: ______________", margin, 66);
+    doc.text(`${questions} Questions`, margin, 74);
+
+    doc.setFontSize(8);
+    doc.text(
+      "Fill bubbles completely with a #2 pencil. Bubble one digit per row of your ID.",
+      pageWidth / 2,
+      80,
+      { align: "center" }
+    );
+  } else {
+    doc.setFontSize(12);
+    doc.setFont("helvetica", "normal");
+    doc.text(`${questions} Questions`, pageWidth / 2, 40, { align: "center" });
+
+    // Instructions
+    doc.setFontSize(8);
+    doc.text(
+      "Fill bubbles completely with a #2 pencil. Make no stray marks.",
+      pageWidth / 2,
+      50,
+      { align: "center" }
+    );
+
+    // Student information section
+    doc.setLineWidth(0.5);
+    doc.rect(margin, 55, pageWidth - 2 * margin, 20);
+    doc.setFontSize(10);
+    doc.text("Name: ________________________________", margin + 5, 67);
+    doc.text("Date: _______________", margin + 5, 72);
+    doc.text("Student ID: __________________", pageWidth - margin - 100, 67);
+  }
 
   // Answer choices header
   const startY = 90;
@@ -103,10 +238,10 @@ export const generateBubbleSheetPDF = (questions: number): jsPDF => {
   doc.setFont("helvetica", "bold");
 
   for (let col = 0; col < config.columns; col++) {
-    const startX = margin + col * (columnWidth + 15); // Match the spacing used in question generation
+    const startX = margin + col * (columnWidth + columnGap); // Match the spacing used in question generation
     // Column headers for answer choices
-    ["A", "B", "C", "D"].forEach((letter, index) => {
-      const x = startX + 25 + index * bubbleSpacing;
+    choices.forEach((letter, index) => {
+      const x = startX + bubbleOffset + index * bubbleSpacing;
       doc.text(letter, x, startY - 5, { align: "center" });
     });
   }
@@ -120,7 +255,7 @@ export const generateBubbleSheetPDF = (questions: number): jsPDF => {
     // Skip if we would exceed the number of columns
     if (column >= config.columns) continue;
 
-    const startX = margin + column * (columnWidth + 15); // Reduced spacing between columns
+    const startX = margin + column * (columnWidth + columnGap);
     const y = startY + rowInColumn * questionSpacing;
 
     // Skip if we exceed page bounds
@@ -128,12 +263,12 @@ export const generateBubbleSheetPDF = (questions: number): jsPDF => {
 
     // Question number
     doc.setFontSize(9);
-    doc.text(`${q}.`, startX + 15, y + 2, { align: "right" });
+    doc.text(`${q}.`, startX + bubbleOffset - 10, y + 2, { align: "right" });
 
-    // Answer bubbles A, B, C, D
+    // Answer bubbles
     doc.setLineWidth(0.3);
-    ["A", "B", "C", "D"].forEach((letter, index) => {
-      const x = startX + 25 + index * bubbleSpacing;
+    choices.forEach((letter, index) => {
+      const x = startX + bubbleOffset + index * bubbleSpacing;
       doc.circle(x, y, bubbleRadius);
     });
   }
@@ -151,10 +286,11 @@ export const generateBubbleSheetPDF = (questions: number): jsPDF => {
   return doc;
 };
 
-export const downloadBubbleSheetPDF = (questions: number) => {
+export const downloadBubbleSheetPDF = (questions: number, withFields = false) => {
   try {
-    const doc = generateBubbleSheetPDF(questions);
-    doc.save(`snapgrade-bubble-sheet-${questions}q.pdf`);
+    const doc = generateBubbleSheetPDF(questions, withFields);
+    const suffix = withFields ? "-id" : "";
+    doc.save(`snapgrade-bubble-sheet-${questions}q${suffix}.pdf`);
   } catch (error) {
     console.error("Error generating PDF:", error);
     // Fallback to SVG if PDF fails